@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+In-memory audio segments handed from the recorders to the transcriber
+PCM stays in memory from capture to upload; no WAV round-trip through /tmp
+"""
+
+import io
+import collections
+import os
+import time
+import wave
+import queue
+import logging
+import threading
+from metrics import Timeline, metrics
+
+class AudioSegment:
+    """A recorded utterance: raw PCM bytes plus format and timing metadata"""
+    def __init__(self, pcm=b"", sample_rate=16000, channels=1, sample_width=2,
+                 start_time=None, end_time=None, segment_id=0, timeline=None):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width  # bytes per sample, 2 = S16LE
+        self.segment_id = segment_id
+        # monotonic timestamps of speech onset and end of speech
+        self.end_time = end_time if end_time is not None else time.monotonic()
+        self.start_time = start_time if start_time is not None else \
+            self.end_time - self.duration
+        # stage timestamps from onset to injection, see metrics.py
+        self.timeline = timeline if timeline is not None else Timeline()
+        # compressed uploads by format, filled in by encode.py
+        self.uploads = {}
+        # Future of the typed text, see inject.py
+        self.injection = None
+
+    @property
+    def name(self):
+        return f"audio_segment_{self.segment_id:05d}.wav"
+
+    @property
+    def duration(self):
+        """Length of the audio in seconds"""
+        frame_size = self.channels * self.sample_width
+        return len(self.pcm) / float(self.sample_rate * frame_size)
+
+    def __len__(self):
+        return len(self.pcm)
+
+    def __bool__(self):
+        return len(self.pcm) > 0
+
+    def __repr__(self):
+        return f"<AudioSegment #{self.segment_id} {self.duration:.2f}s {len(self.pcm)} bytes>"
+
+    def age(self):
+        """Seconds since the end of speech"""
+        return time.monotonic() - self.end_time
+
+    def merge(self, other, gap=0.3):
+        """
+        One segment holding this one, `gap` seconds of silence, then other.
+        Keeps this segment's id, onset and timeline; end-of-speech marks come from other.
+        """
+        frame_size = self.channels * self.sample_width
+        silence = bytes(int(gap * self.sample_rate) * frame_size)
+        timeline = Timeline()
+        timeline.marks = dict(self.timeline.marks)
+        for stage in ("speech_end", "valve_close", "saved"):
+            if stage in other.timeline.marks:
+                timeline.mark(stage, other.timeline.marks[stage])
+        return AudioSegment(self.pcm + silence + other.pcm, self.sample_rate,
+                            self.channels, self.sample_width,
+                            start_time=self.start_time, end_time=other.end_time,
+                            segment_id=self.segment_id, timeline=timeline)
+
+    @classmethod
+    def join(cls, segments, gap=0.5):
+        """
+        One segment holding all of segments, separated by `gap` seconds of
+        silence, to transcribe them with a single request. The result's
+        `spans` lists each segment's (start, end) offset in seconds.
+        """
+        first = segments[0]
+        frame_size = first.channels * first.sample_width
+        silence = bytes(int(gap * first.sample_rate) * frame_size)
+        rate = float(first.sample_rate * frame_size)
+        parts, spans, size = [], [], 0
+        for segment in segments:
+            if parts:
+                parts.append(silence)
+                size += len(silence)
+            spans.append((size / rate, (size + len(segment.pcm)) / rate))
+            parts.append(segment.pcm)
+            size += len(segment.pcm)
+        joined = cls(b"".join(parts), first.sample_rate, first.channels, first.sample_width,
+                     start_time=first.start_time, end_time=segments[-1].end_time,
+                     segment_id=first.segment_id)
+        joined.spans = spans
+        return joined
+
+    def wav_bytes(self) -> bytes:
+        """Return the segment as a complete WAV file, built in memory"""
+        out = io.BytesIO()
+        with wave.open(out, 'wb') as wav_file:
+            wav_file.setnchannels(self.channels)
+            wav_file.setsampwidth(self.sample_width)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(self.pcm)
+        return out.getvalue()
+
+    @classmethod
+    def from_wav(cls, file_name, segment_id=0, remove=False, timeline=None):
+        """
+        Load a WAV file recorded by delayRecord into memory.
+        With remove=True the file is deleted once it has been read.
+        """
+        end_time = time.monotonic()
+        with wave.open(file_name, 'rb') as wav_file:
+            segment = cls(wav_file.readframes(wav_file.getnframes()),
+                          sample_rate=wav_file.getframerate(),
+                          channels=wav_file.getnchannels(),
+                          sample_width=wav_file.getsampwidth(),
+                          end_time=end_time,
+                          segment_id=segment_id,
+                          timeline=timeline)
+        segment.timeline.mark("saved")
+        if remove:
+            os.remove(file_name)
+        return segment
+
+class PCMRingBuffer:
+    """
+    Fixed-size lookahead buffer holding the most recent PCM chunks.
+    Chunks are kept by reference, so handing the history to a new
+    segment costs no copy.
+    """
+    def __init__(self, seconds=0.6, sample_rate=16000, channels=1, sample_width=2):
+        self.capacity = int(seconds * sample_rate * channels * sample_width)
+        self.chunks = collections.deque()
+        self.size = 0
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        # drop the oldest chunks, but never hold less than capacity
+        while self.chunks and self.size - len(self.chunks[0]) >= self.capacity:
+            self.size -= len(self.chunks.popleft())
+
+    def drain(self):
+        """Return the buffered chunks, oldest first, and empty the buffer"""
+        chunks = list(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return chunks
+
+class SegmentQueue:
+    """
+    Bounded queue of AudioSegments with a policy for when it is full:
+      block - put() waits for room, so the recorder stops taking new speech
+      merge - the new segment is appended to the newest waiting one
+      drop  - the oldest waiting segment is dropped
+    With max_age, segments older than that many seconds after the end of
+    speech are dropped by get() instead of being typed minutes late.
+    on_drop(segment, reason) is called for every dropped segment, and
+    on_merge(merged, segment) when segment was merged into the waiting one,
+    which keeps its segment_id.
+    """
+    POLICIES = ("block", "merge", "drop")
+
+    def __init__(self, maxsize=0, policy="block", max_age=0, on_drop=None, on_merge=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}', use one of {self.POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_age = max_age
+        self.on_drop = on_drop
+        self.on_merge = on_merge
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.merged = 0
+        self.dropped = 0
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self.items)
+
+    def oldest_age(self):
+        """Seconds the oldest waiting segment has waited since the end of speech"""
+        with self.cond:
+            return self.items[0].age() if self.items else 0.0
+
+    def put(self, segment, block=True, timeout=None):
+        dropped = []
+        merged = None
+        with self.cond:
+            if self.full():
+                if self.policy == "merge":
+                    merged = self.items[-1] = self.items[-1].merge(segment)
+                    self.merged += 1
+                    metrics.inc("segments_merged_total")
+                    logging.debug(f"Queue full, merged into {merged}")
+                elif self.policy == "drop":
+                    dropped.append((self.items.popleft(), "overflow"))
+                elif not block or not self.cond.wait_for(lambda: not self.full(), timeout):
+                    raise queue.Full
+            if merged is None:
+                self.items.append(segment)
+                self.cond.notify_all()
+        if merged is not None and self.on_merge:
+            self.on_merge(merged, segment)
+        self._dropped(dropped)
+
+    def get(self, block=True, timeout=None):
+        """Oldest segment that is not too stale; raises queue.Empty like queue.Queue"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        dropped = []
+        try:
+            with self.cond:
+                while True:
+                    if not self.items:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if not block or (remaining is not None and remaining <= 0):
+                            raise queue.Empty
+                        self.cond.wait(remaining)
+                        continue
+                    segment = self.items.popleft()
+                    self.cond.notify_all()
+                    age = segment.age()
+                    if self.max_age and age > self.max_age:
+                        dropped.append((segment, "stale"))
+                        continue
+                    metrics.observe("queue_age_seconds", age)
+                    return segment
+        finally:
+            self._dropped(dropped)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _dropped(self, dropped):
+        # outside the lock: on_drop may speak or log
+        for segment, reason in dropped:
+            self.dropped += 1
+            metrics.inc("segments_dropped_total", reason=reason)
+            logging.warning(f"Dropped {segment} ({reason}, {segment.age():.1f}s after speech)")
+            if self.on_drop:
+                self.on_drop(segment, reason)
@@ -0,0 +1,286 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Caches in front of the speech and chat backends
+
+PersistentLRU is a small least-recently-used map that can be saved to
+and loaded from a JSON file. TranscriptionCache uses it to answer
+repeated short utterances ("new paragraph", "press enter") without an
+inference. Audio is never byte-identical twice, so segments are keyed
+on a spectral fingerprint: log band energies on a fixed time/frequency
+grid, normalized and quantized to bytes, compared by correlation.
+ResponseCache answers repeated assistant prompts without a chat request.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import collections
+
+np = None  # numpy, imported by the first TranscriptionCache
+
+class PersistentLRU:
+    """Ordered map with a size cap and optional JSON persistence"""
+    def __init__(self, capacity=256, path=None):
+        self.capacity = max(int(capacity), 1)
+        self.path = path
+        self.items = collections.OrderedDict()
+        self.lock = threading.RLock()  # reentrant, so a caller can hold it across get() and put()
+        if path:
+            self.load()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+    def values(self):
+        """Snapshot of (key, value) pairs, most recently used last"""
+        with self.lock:
+            return list(self.items.items())
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                for key, value in json.load(f):
+                    self.put(key, value)
+            logging.debug(f"Loaded {len(self.items)} cache entries from {self.path}")
+        except (OSError, ValueError, TypeError) as e:
+            logging.error(f"Could not load cache {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.values(), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"Could not save cache {self.path}: {e}")
+
+class TranscriptionCache:
+    """
+    Near-duplicate lookup of short segments by spectral fingerprint.
+    Durations are those of the voiced span, without the preroll and the
+    silence hangover around it, which vary from one utterance to the next.
+    Only segments whose voiced span is up to max_duration seconds are
+    cached, and a hit needs a fingerprint correlation of at least
+    `similarity` and a voiced duration within `duration_tolerance` of the
+    cached one.
+    """
+    SLOTS = 16   # time slots per fingerprint
+    BANDS = 16   # log-spaced bands, 150-4000 Hz
+
+    def __init__(self, capacity=256, max_duration=1.5, similarity=0.9,
+                 duration_tolerance=0.25, path=None, frame_ms=32):
+        global np
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("TranscriptionCache requires numpy")
+        self.entries = PersistentLRU(capacity, path)
+        self.max_duration = max_duration
+        self.similarity = similarity
+        self.duration_tolerance = duration_tolerance
+        self.frame_ms = frame_ms
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.lock = threading.Lock()  # counters, updated by several transcription workers
+
+    def fingerprint(self, segment):
+        """
+        (fingerprint, seconds) of a 16-bit mono segment: SLOTS x BANDS bytes,
+        and the length of the voiced span they were taken from. None if the
+        segment is too short or has no voiced span of at most max_duration.
+        """
+        if segment.sample_width != 2 or segment.channels != 1:
+            return None
+        samples = np.frombuffer(segment.pcm, dtype="<i2").astype(np.float32)
+        frame_len = int(segment.sample_rate * self.frame_ms / 1000)
+        count = len(samples) // frame_len
+        if count < self.SLOTS:
+            return None
+        frames = samples[:count * frame_len].reshape(count, frame_len)
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_len), axis=1)) ** 2
+
+        # trim leading and trailing silence, so the grid lines up with speech
+        energy = 10 * np.log10(spectrum.sum(axis=1) + 1e-9)
+        voiced = np.nonzero(energy > energy.max() - 30)[0]
+        spectrum = spectrum[voiced[0]:voiced[-1] + 1]
+        seconds = len(spectrum) * frame_len / segment.sample_rate
+        if len(spectrum) < self.SLOTS or seconds > self.max_duration:
+            return None
+
+        freqs = np.fft.rfftfreq(frame_len, 1.0 / segment.sample_rate)
+        edges = np.geomspace(150, 4000, self.BANDS + 1)
+        bands = np.stack([spectrum[:, (freqs >= lo) & (freqs < hi)].sum(axis=1)
+                          for lo, hi in zip(edges[:-1], edges[1:])], axis=1)
+        # average frames into a fixed number of time slots
+        grid = np.log10(np.stack([chunk.mean(axis=0)
+                                  for chunk in np.array_split(bands, self.SLOTS)]) + 1e-9)
+        # independent of loudness, quantized to one signed byte per cell
+        grid = (grid - grid.mean()) / (grid.std() + 1e-9)
+        return np.clip(np.round(grid * 32), -127, 127).astype(np.int8).tobytes(), seconds
+
+    @staticmethod
+    def correlation(a, b):
+        a = np.frombuffer(a, dtype=np.int8).astype(np.float32)
+        b = np.frombuffer(b, dtype=np.int8).astype(np.float32)
+        a -= a.mean()
+        b -= b.mean()
+        norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+        return float(np.dot(a, b) / norm) if norm else 0.0
+
+    def _matches(self, segment, context):
+        analysis = self.fingerprint(segment)
+        if analysis is None:
+            return None
+        fingerprint, seconds = analysis
+        best, best_score = None, self.similarity
+        for key, entry in self.entries.values():
+            if entry["context"] != context:
+                continue
+            duration = entry["duration"]
+            if abs(duration - seconds) > self.duration_tolerance * duration:
+                continue
+            score = self.correlation(fingerprint, bytes.fromhex(entry["fingerprint"]))
+            if score >= best_score:
+                best, best_score = key, score
+        return best, best_score
+
+    def lookup(self, segment, context):
+        """
+        (status, text) for segment: ("hit", cached text of a near-duplicate),
+        ("miss", None), or ("uncacheable", None) for a segment the cache
+        cannot hold, which counts as neither hit nor miss.
+        """
+        match = self._matches(segment, context)
+        if match is None:
+            return "uncacheable", None
+        key, score = match
+        entry = self.entries.get(key) if key is not None else None  # may be evicted meanwhile
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return "miss", None
+            self.hits += 1
+        logging.debug(f"Transcription cache hit ({score:.2f}): '{entry['text']}'")
+        return "hit", entry["text"]
+
+    def store(self, segment, context, text):
+        """Remember text for a short segment"""
+        if not text or not text.strip():
+            return
+        analysis = self.fingerprint(segment)
+        if analysis is None:
+            return
+        fingerprint, seconds = analysis
+        self.entries.put(f"{context}:{fingerprint.hex()}", {
+            "context": context, "fingerprint": fingerprint.hex(),
+            "duration": round(seconds, 3), "text": text,
+        })
+        with self.lock:
+            self.stores += 1
+            save = self.entries.path and self.stores % 16 == 0
+        if save:
+            self.entries.save()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        self.entries.save()
+
+class ResponseCache:
+    """
+    Chat replies keyed on the normalized prompt and a hash of the recent
+    conversation. Entries expire after ttl seconds. With variants > 1,
+    a prompt is generated that many times before it is answered from the
+    cache, and the different replies collected are handed out in
+    rotation; a provider that always gives the same reply yields one.
+    """
+    def __init__(self, capacity=256, ttl=86400, variants=1, path=None):
+        self.entries = PersistentLRU(capacity, path)
+        self.ttl = ttl
+        self.variants = max(int(variants), 1)
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self.stores = 0
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        """Lower case, without punctuation or repeated spaces"""
+        return " ".join(re.sub(r"[^\w\s']", " ", prompt.lower()).split())
+
+    def key(self, prompt, context=()):
+        """Cache key of prompt after the context messages"""
+        digest = hashlib.sha1(json.dumps(list(context), sort_keys=True).encode()).hexdigest()[:16]
+        return f"{digest}:{self.normalize(prompt)}"
+
+    def lookup(self, prompt, context=()):
+        """A cached reply, or None"""
+        key = self.key(prompt, context)
+        with self.entries.lock:  # entries are shared with other lookups and store()
+            entry = self.entries.get(key)
+            if entry and time.time() - entry["created"] > self.ttl:
+                logging.debug(f"Response cache entry expired: '{prompt}'")
+                entry = None
+            if not entry or entry["generated"] < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += entry["seconds"]
+            reply = entry["replies"][entry["next"] % len(entry["replies"])]
+            entry["next"] += 1
+        logging.debug(f"Response cache hit: '{prompt}'")
+        return reply
+
+    def store(self, prompt, context, reply, seconds):
+        """Remember a reply that took seconds to generate"""
+        if not reply or not reply.strip():
+            return
+        key = self.key(prompt, context)
+        with self.entries.lock:
+            entry = self.entries.get(key)
+            if not entry or time.time() - entry["created"] > self.ttl:
+                entry = {"replies": [], "next": 0, "seconds": 0.0, "generated": 0,
+                         "created": time.time()}
+            entry["generated"] += 1
+            if reply not in entry["replies"]:
+                entry["replies"] = (entry["replies"] + [reply])[-self.variants:]
+            # mean generation time, what a hit saves
+            entry["seconds"] += (seconds - entry["seconds"]) / entry["generated"]
+            self.entries.put(key, entry)
+            self.stores += 1
+            save = self.entries.path and self.stores % 16 == 0
+        if save:
+            self.entries.save()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        self.entries.save()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Chat context kept within a token budget
+
+The prompt always opens with the same prefix: the system message, any
+pinned messages, then a summary of the turns dropped so far. Old turns
+are dropped in one block when the budget runs out, rather than two at a
+time on every turn, so the prefix stays byte-identical for many turns
+and llama.cpp can reuse its KV cache (cache_prompt) instead of decoding
+the whole conversation again.
+"""
+
+import re
+import logging
+from metrics import metrics
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, about four characters per token for English"""
+    return len(text) // 4 + 1
+
+def first_sentence(text: str, limit=160) -> str:
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip(), re.S)
+    sentence = match.group(1) if match else text.strip()
+    return sentence if len(sentence) <= limit else sentence[:limit].rsplit(" ", 1)[0] + "..."
+
+def extract_summary(summary: str, dropped) -> str:
+    """Summary of dropped messages without a model: each question and the gist of its answer"""
+    lines = [summary] if summary else []
+    for message in dropped:
+        who = "The user asked" if message["role"] == "user" else "You answered"
+        lines.append(f"{who}: {first_sentence(message['content'])}")
+    return "\n".join(lines)
+
+class Conversation:
+    """
+    Messages for a chat provider, at most `budget` tokens including
+    `reserve` tokens left for the reply. summarize(summary, dropped)
+    returns the new summary of dropped turns; it falls back to
+    extract_summary() if it fails.
+    """
+    MESSAGE_OVERHEAD = 4  # tokens of role and separators per message
+
+    def __init__(self, system, budget=2048, reserve=512, summary_tokens=256,
+                 pinned=(), count_tokens=estimate_tokens, summarize=None):
+        self.system = {"role": "system", "content": system}
+        self.pinned = [{"role": "system", "content": text} for text in pinned]
+        self.budget = budget
+        self.reserve = reserve
+        self.summary_tokens = summary_tokens
+        self.count_tokens = count_tokens
+        self.summarize = summarize or extract_summary
+        self.summary = ""
+        self.turns = []  # user and assistant messages after the prefix
+        self.trims = 0
+
+    def prefix(self):
+        """The stable part of the prompt"""
+        messages = [self.system] + self.pinned
+        if self.summary:
+            messages.append({"role": "system",
+                             "content": "Summary of the earlier conversation:\n" + self.summary})
+        return messages
+
+    def messages(self):
+        return self.prefix() + self.turns
+
+    def tokens(self, messages) -> int:
+        return sum(self.count_tokens(m["content"]) + self.MESSAGE_OVERHEAD for m in messages)
+
+    def add(self, role, content):
+        self.turns.append({"role": role, "content": content})
+
+    def _pop_turn(self):
+        """Remove the oldest user message and the replies to it"""
+        dropped = [self.turns.pop(0)]
+        while self.turns and self.turns[0]["role"] != "user":
+            dropped.append(self.turns.pop(0))
+        return dropped
+
+    def fit(self):
+        """
+        Drop the oldest turns if the conversation no longer fits. Enough is
+        dropped to free half the room, so the prefix then stays the same
+        for several turns.
+        """
+        limit = self.budget - self.reserve
+        if self.tokens(self.messages()) <= limit:
+            return
+        room = limit - self.tokens([self.system] + self.pinned) - self.summary_tokens
+        dropped = []
+        while sum(m["role"] == "user" for m in self.turns) > 1 and \
+                self.tokens(self.turns) > room // 2:
+            dropped += self._pop_turn()
+        if not dropped:
+            return
+        try:
+            summary = self.summarize(self.summary, dropped)
+        except Exception as e:
+            logging.debug(f"Could not summarize dropped turns: {e}")
+            summary = extract_summary(self.summary, dropped)
+        # keep the most recent part of the summary within its budget
+        lines = summary.split("\n")
+        while len(lines) > 1 and self.count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)[-self.summary_tokens * 4:]
+        self.trims += 1
+        metrics.inc("context_trims_total")
+        logging.debug(f"Dropped {len(dropped)} messages from the chat context; "
+                      f"{self.tokens(self.messages())} tokens left")
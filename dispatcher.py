@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compiled command registry for spoken commands
+
+Patterns are compiled once at startup and merged, in table order, into
+small alternation groups. One regex call rules out a whole group, and
+only a group that matches is scanned pattern by pattern, so the first
+command in table order still wins. Handlers are plain callables taking
+the rest of the utterance after the match (q).
+"""
+
+import re
+import logging
+
+# patterns using these cannot be merged, since merging renumbers groups
+_UNMERGEABLE = re.compile(r"\\\d|\(\?P=|\(\?[aiLmsux]+\)")
+
+# commands per merged group; large alternations with many capture groups
+# get slower per pattern in the re engine, so keep them small
+GROUP_SIZE = 8
+
+class Command:
+    def __init__(self, pattern, handler, name=None, sends_keys=False):
+        self.pattern = pattern
+        self.handler = handler
+        self.name = name or getattr(handler, "__name__", pattern)
+        self.sends_keys = sends_keys
+        self.open_ended = getattr(handler, "open_ended", False)
+        self.regex = re.compile(pattern)
+
+    def __repr__(self):
+        return f"<Command {self.name} {self.pattern!r}>"
+
+class CommandRegistry:
+    def __init__(self, commands=None, skip_keys=False):
+        self.commands = []
+        self.skip_keys = skip_keys  # leave out commands that send keys (NO_KEYS)
+        self.groups = None
+        for pattern, handler in (commands or {}).items():
+            self.add(pattern, handler)
+
+    def add(self, pattern, handler, name=None, sends_keys=None):
+        """Register a command; handlers marked with sends_keys() can be skipped"""
+        if sends_keys is None:
+            sends_keys = getattr(handler, "sends_keys", False)
+        self.commands.append(Command(pattern, handler, name, sends_keys))
+        self.groups = None  # recompile on next match
+
+    def compile(self):
+        """Build the merged groups: (prefilter regex, anchored, commands)"""
+        active = [c for c in self.commands if not (self.skip_keys and c.sends_keys)]
+        self.groups = []
+        group = []
+        def close(group):
+            if not group:
+                return
+            if len(group) == 1:
+                regex = group[0].regex
+            else:
+                regex = re.compile("|".join(f"(?:{c.pattern})" for c in group))
+            anchored = all(c.pattern.startswith("^") for c in group)
+            self.groups.append((regex, anchored, group))
+        names = set()  # named groups in the current group; re allows each once
+        for command in active:
+            if _UNMERGEABLE.search(command.pattern):
+                close(group)
+                close([command])
+                group = []
+                names = set()
+                continue
+            if names & command.regex.groupindex.keys():
+                close(group)
+                group = []
+                names = set()
+            group.append(command)
+            names |= command.regex.groupindex.keys()
+            if len(group) == GROUP_SIZE:
+                close(group)
+                group = []
+                names = set()
+        close(group)
+        logging.debug(f"Compiled {len(active)} commands into {len(self.groups)} groups")
+
+    def match(self, text):
+        """
+        Find the first command matching text, in registration order.
+        Returns (command, q) where q is the text after the match, or None.
+        """
+        if self.groups is None:
+            self.compile()
+        for regex, anchored, group in self.groups:
+            # anchored groups can only match at position 0
+            if not (regex.match(text) if anchored else regex.search(text)):
+                continue
+            for command in group:
+                if m := command.regex.search(text):
+                    return command, text[m.end():]
+        return None
+
+    def fullmatch(self, text):
+        """
+        The first command whose pattern matches all of text, or None.
+        Unlike match(), a command followed by more words does not count.
+        """
+        for command in self.commands:
+            if self.skip_keys and command.sends_keys:
+                continue
+            if command.regex.fullmatch(text):
+                return command
+        return None
+
+    def __contains__(self, text):
+        return self.match(text) is not None
+
+    def __len__(self):
+        return len(self.commands)
+
+def sends_keys(handler):
+    """Mark a command handler that drives the keyboard or mouse"""
+    handler.sends_keys = True
+    return handler
+
+def open_ended(handler):
+    """Mark a command handler that takes any words after it, such as a chat prompt"""
+    handler.open_ended = True
+    return handler
+
+def is_complete_command(text, registries):
+    """
+    True if text is all of a command in one of registries that takes no
+    more words, such as "new paragraph", so the endpointer can end the
+    utterance at once. Not for open-ended commands or a bare wake word:
+    the user may pause mid-sentence.
+    """
+    for registry in registries:
+        command = registry.fullmatch(text)
+        if command and not command.open_ended:
+            return True
+    return False
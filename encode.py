@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+In-process compression of AudioSegments before upload
+
+Raw 16-bit WAV is large over Wi-Fi, tethered or metered links. FLAC is
+lossless and roughly halves it; Opus is much smaller still. Segments are
+encoded with the same GStreamer encoders record.py uses, on a background
+thread as soon as they are queued, so the upload is ready by the time a
+transcription worker picks the segment up.
+
+whisper.cpp's server decodes WAV, FLAC and MP3 by itself; Opus needs
+whisper-server --convert (ffmpeg). The OpenAI API accepts all of them.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+# upload format -> file extension (key into encodings) and MIME type
+FORMATS = {
+    "wav":  (".wav",  "audio/wav"),
+    "flac": (".flac", "audio/flac"),
+    "opus": (".opus", "audio/ogg"),
+    "ogg":  (".ogg",  "audio/ogg"),
+    "mp3":  (".mp3",  "audio/mpeg"),
+}
+
+def encode_segment(segment, fmt, timeout=10.0) -> bytes:
+    """Encode a segment's PCM with GStreamer, entirely in memory"""
+    # GStreamer is loaded with the first compressed upload, not at start-up
+    from record import Gst, encodings
+    ext, mime = FORMATS[fmt]
+    caps = (f"audio/x-raw,format=S16LE,layout=interleaved,"
+            f"rate={segment.sample_rate},channels={segment.channels}")
+    pipeline = Gst.parse_launch(
+        f"appsrc name=src format=time caps={caps} ! audioconvert ! audioresample ! "
+        f"{encodings[ext]} ! appsink name=sink sync=false"
+    )
+    src = pipeline.get_by_name("src")
+    sink = pipeline.get_by_name("sink")
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        buffer = Gst.Buffer.new_wrapped(segment.pcm)
+        buffer.pts = 0
+        buffer.duration = int(segment.duration * Gst.SECOND)
+        src.emit("push-buffer", buffer)
+        src.emit("end-of-stream")
+        chunks = []
+        deadline = time.monotonic() + timeout
+        while not sink.is_eos():
+            sample = sink.emit("try-pull-sample", Gst.SECOND // 10)
+            if sample:
+                out = sample.get_buffer()
+                chunks.append(out.extract_dup(0, out.get_size()))
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f"{fmt} encoder did not finish in {timeout}s")
+        return b"".join(chunks)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+class SegmentEncoder:
+    """Encodes segments for upload on a background thread"""
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="encoder")
+        self.lock = threading.Lock()
+
+    def _encode(self, segment, fmt):
+        start = time.monotonic()
+        data = encode_segment(segment, fmt)
+        elapsed = time.monotonic() - start
+        metrics.observe("encode_seconds", elapsed, format=fmt)
+        logging.debug(f"Encoded {segment} to {fmt}: {len(data)} bytes in {elapsed:.3f}s")
+        return data
+
+    def prepare(self, segment, fmt):
+        """Start encoding segment to fmt in the background"""
+        if fmt not in FORMATS or fmt == "wav":
+            return
+        with self.lock:
+            if fmt not in segment.uploads:
+                segment.uploads[fmt] = self.executor.submit(self._encode, segment, fmt)
+
+    def upload(self, segment, fmt):
+        """
+        (file name, bytes, MIME type) of segment in upload format fmt.
+        Falls back to WAV if the format is unknown or encoding fails.
+        """
+        wav_size = 44 + len(segment.pcm)  # what a WAV upload would cost
+        base = os.path.splitext(segment.name)[0]
+        if fmt in FORMATS and fmt != "wav":
+            self.prepare(segment, fmt)
+            try:
+                data = segment.uploads[fmt].result()
+                if data:
+                    ext, mime = FORMATS[fmt]
+                    metrics.inc("upload_bytes_total", len(data), format=fmt)
+                    metrics.inc("upload_bytes_saved_total", max(wav_size - len(data), 0))
+                    return base + ext, data, mime
+            except Exception as e:
+                logging.error(f"Could not encode {segment} to {fmt}, sending WAV: {e}")
+                metrics.inc("encode_errors_total", format=fmt)
+        data = segment.wav_bytes()
+        metrics.inc("upload_bytes_total", len(data), format="wav")
+        return base + ".wav", data, "audio/wav"
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Adaptive end-of-utterance detection
+
+Instead of always waiting the full stop_after seconds of silence, pick
+the hangover for each utterance from how long it is, the user's recent
+pause habits, and the latest partial transcript: known commands end
+almost at once, short finished sentences end early, and long dictation
+still gets a full pause.
+"""
+
+import re
+import logging
+import collections
+
+class Endpointer:
+    def __init__(self, stop_after=2.2, min_stop_after=0.3, is_command=None,
+                 short_utterance=1.0, short_sentence=3.0, history=50):
+        self.stop_after = stop_after          # longest hangover, as before
+        self.min_stop_after = min_stop_after  # shortest hangover, for commands
+        # lower-case text -> True if it is a whole command that takes no
+        # more words; not a chat prompt, which may go on after a pause
+        self.is_command = is_command
+        self.short_utterance = short_utterance
+        # Whisper ends nearly every partial with punctuation, so only a
+        # sentence with less speech than this counts as finished
+        self.short_sentence = short_sentence
+        self.pauses = collections.deque(maxlen=history)
+        self.partial_id = None
+        self.partial = ""
+
+    def note_pause(self, seconds):
+        """Record a pause after which the user kept talking"""
+        self.pauses.append(seconds)
+
+    def set_partial(self, segment_id, text):
+        """Latest partial transcript of the utterance being recorded"""
+        self.partial_id = segment_id
+        self.partial = text.strip()
+
+    def typical_pause(self):
+        """Hangover long enough to ride over 90% of the user's own pauses"""
+        if len(self.pauses) < 5:
+            return self.stop_after
+        pauses = sorted(self.pauses)
+        p90 = pauses[int(0.9 * (len(pauses) - 1))]
+        return min(max(p90 * 1.5, self.min_stop_after), self.stop_after)
+
+    def hangover(self, speech_seconds, segment_id=None):
+        """
+        Seconds of silence that should end the current utterance, after
+        speech_seconds from its onset to the last speech, without preroll
+        or the silence heard since
+        """
+        base = self.typical_pause()
+        text = self.partial if segment_id is None or segment_id == self.partial_id else ""
+        if text:
+            tl = re.sub(r"[^\w\s]$", "", text.lower())
+            if self.is_command and self.is_command(tl):
+                return self.min_stop_after
+            if re.search(r"[.?!]$", text) and speech_seconds < self.short_sentence:
+                return max(self.min_stop_after, base * 0.5)
+        if speech_seconds < self.short_utterance:
+            return max(self.min_stop_after, base * 0.6)
+        return base
+
+def make_endpointer(mode, stop_after, min_stop_after=0.3, is_command=None):
+    """Return an Endpointer for mode 'adaptive', or None for the fixed stop_after"""
+    if mode == "adaptive":
+        return Endpointer(stop_after, min_stop_after, is_command)
+    if mode != "fixed":
+        logging.warning(f"Unknown endpointing mode '{mode}'; using fixed stop_after")
+    return None
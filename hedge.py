@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Hedged requests across two speech backends
+
+A segment goes to the preferred backend first. If no answer has come
+back within the recent p90 latency of that backend, the same segment is
+also sent to the secondary one, and whichever answers first wins. Only
+the slowest tenth of requests is sent twice, so the extra load is small
+while the tail latency follows the faster of the two backends.
+"""
+
+import time
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import metrics
+
+class HedgedTranscriber:
+    """
+    Callable segment -> text over two backends, given as name -> function
+    that returns the text or raises. The hedging delay is the `percentile`
+    of the preferred backend's last `window` latencies, or initial_delay
+    until min_samples have been seen.
+    """
+    def __init__(self, backends, preferred, secondary, percentile=90,
+                 initial_delay=1.5, min_delay=0.2, min_samples=10, window=100, workers=4):
+        self.backends = backends
+        self.preferred = preferred
+        self.secondary = secondary
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = {name: collections.deque(maxlen=window) for name in backends}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.wins = collections.Counter()
+
+    def delay(self) -> float:
+        """Seconds to wait for the preferred backend before hedging"""
+        with self.lock:
+            recent = sorted(self.latencies[self.preferred])
+        if len(recent) < self.min_samples:
+            return self.initial_delay
+        index = min(int(self.percentile / 100.0 * len(recent)), len(recent) - 1)
+        return max(recent[index], self.min_delay)
+
+    def _call(self, name, segment):
+        start = time.monotonic()
+        text = self.backends[name](segment)
+        # losers count too: their latency is what the next delay is learned from
+        with self.lock:
+            self.latencies[name].append(time.monotonic() - start)
+        return text
+
+    def __call__(self, segment):
+        delay = self.delay()
+        with self.lock:
+            self.requests += 1
+        pending = {self.executor.submit(self._call, self.preferred, segment): self.preferred}
+        hedged = False
+        error = None
+        timeout = delay
+        while pending:
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logging.error(f"{name} backend failed: {e}")
+                    error = e
+                    continue
+                self._cancel(pending)
+                with self.lock:
+                    self.wins[name] += 1
+                metrics.inc("hedge_wins_total", backend=name, hedged=str(hedged).lower())
+                logging.debug(f"{segment} answered by {name}" +
+                              (f" after hedging at {delay:.2f}s" if hedged else ""))
+                return text
+            if not hedged:
+                # the preferred backend is slow or failed: ask the secondary too
+                hedged = True
+                timeout = None
+                with self.lock:
+                    self.hedged += 1
+                metrics.inc("hedged_requests_total")
+                logging.debug(f"No answer for {segment} from {self.preferred} in {delay:.2f}s, "
+                              f"hedging to {self.secondary}")
+                pending[self.executor.submit(self._call, self.secondary, segment)] = self.secondary
+        raise error
+
+    def _cancel(self, pending):
+        """
+        Cancel the losing request. One that has not started is dropped;
+        an HTTP request already on the wire cannot be aborted, so it is
+        left to finish on its worker and its answer is discarded.
+        """
+        for future, name in pending.items():
+            if not future.cancel():
+                logging.debug(f"Discarding the {name} answer still in flight")
+            metrics.inc("hedge_cancelled_total", backend=name)
+
+    def stats(self):
+        with self.lock:
+            result = {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "wins": dict(self.wins),
+            }
+        result["delay"] = self.delay()
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
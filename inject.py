@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Text injection into the active window
+
+pyautogui.write() sends one key event per character with a pause after
+each call, and cannot type anything outside ASCII. The backends here
+type through xdotool (X11) or ydotool (Wayland, via a uinput virtual
+keyboard), or paste through the clipboard, saving and restoring what
+was on it. TextInjector runs them on a worker thread, in order, so
+long answers do not hold up transcription, and measures characters/sec.
+"""
+
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future
+from metrics import metrics
+
+class PyAutoGUIBackend:
+    """pyautogui: works everywhere pyautogui does, ASCII only"""
+    name = "pyautogui"
+
+    def __init__(self, pyautogui, interval=0.0):
+        self.pyautogui = pyautogui
+        self.interval = interval
+
+    def can_type(self, text):
+        return text.isascii()
+
+    def write(self, text):
+        self.pyautogui.write(text, interval=self.interval)
+
+    def backspace(self, count):
+        self.pyautogui.press('backspace', presses=count)
+
+class XdotoolBackend:
+    """xdotool type: X11, any Unicode text"""
+    name = "xdotool"
+
+    def __init__(self, delay_ms=2):
+        self.delay = str(delay_ms)
+
+    def can_type(self, text):
+        return True
+
+    def write(self, text):
+        subprocess.run(["xdotool", "type", "--clearmodifiers", "--delay", self.delay,
+                        "--", text], check=True)
+
+    def backspace(self, count):
+        subprocess.run(["xdotool", "key", "--delay", self.delay, "--repeat", str(count),
+                        "BackSpace"], check=True)
+
+class YdotoolBackend:
+    """ydotool type: Wayland and the console, through a uinput virtual keyboard"""
+    name = "ydotool"
+    BACKSPACE = "14"  # Linux input event code KEY_BACKSPACE
+
+    def __init__(self, delay_ms=2):
+        self.delay = str(delay_ms)
+
+    def can_type(self, text):
+        return True
+
+    def write(self, text):
+        subprocess.run(["ydotool", "type", "--key-delay", self.delay, "--", text], check=True)
+
+    def backspace(self, count):
+        keys = [f"{self.BACKSPACE}:1", f"{self.BACKSPACE}:0"] * count
+        subprocess.run(["ydotool", "key", "--key-delay", self.delay] + keys, check=True)
+
+class ClipboardBackend:
+    """
+    Paste: put the text on the clipboard, press the paste keys, then put
+    back what was there before. Any length in one keystroke. Only text
+    clipboard contents can be restored.
+    """
+    name = "clipboard"
+
+    def __init__(self, hotkey, keys=("ctrl", "v"), settle=0.15, fallback=None):
+        self.hotkey = hotkey  # presses a key combination, e.g. pyautogui.hotkey
+        self.keys = keys
+        self.settle = settle  # seconds for the window to read the clipboard
+        self.fallback = fallback  # for backspaces
+        if os.getenv("WAYLAND_DISPLAY") and shutil.which("wl-copy"):
+            self.copy_cmd, self.paste_cmd = ["wl-copy"], ["wl-paste", "--no-newline"]
+        elif shutil.which("xclip"):
+            self.copy_cmd = ["xclip", "-selection", "clipboard"]
+            self.paste_cmd = ["xclip", "-selection", "clipboard", "-o"]
+        elif shutil.which("xsel"):
+            self.copy_cmd, self.paste_cmd = ["xsel", "-ib"], ["xsel", "-ob"]
+        else:
+            raise RuntimeError("clipboard injection needs wl-clipboard, xclip or xsel")
+
+    def can_type(self, text):
+        return True
+
+    def write(self, text):
+        saved = subprocess.run(self.paste_cmd, capture_output=True, timeout=2)
+        subprocess.run(self.copy_cmd, input=text.encode(), check=True, timeout=2)
+        self.hotkey(*self.keys)
+        time.sleep(self.settle)
+        if saved.returncode == 0:
+            subprocess.run(self.copy_cmd, input=saved.stdout, timeout=2)
+
+    def backspace(self, count):
+        self.fallback.backspace(count)
+
+def make_backend(name, pyautogui, delay_ms=2):
+    """Typing backend by name; auto picks ydotool on Wayland, xdotool on X11, else pyautogui"""
+    if name == "auto":
+        if os.getenv("WAYLAND_DISPLAY") and shutil.which("ydotool"):
+            name = "ydotool"
+        elif os.getenv("DISPLAY") and shutil.which("xdotool"):
+            name = "xdotool"
+        else:
+            name = "pyautogui"
+    if name == "xdotool":
+        return XdotoolBackend(delay_ms)
+    if name == "ydotool":
+        return YdotoolBackend(delay_ms)
+    if name == "clipboard":
+        return ClipboardBackend(lambda *keys: pyautogui.hotkey(*keys),
+                                fallback=PyAutoGUIBackend(pyautogui))
+    return PyAutoGUIBackend(pyautogui)
+
+class TextInjector:
+    """
+    Types text on a worker thread, in the order it was given. Text of
+    paste_over characters or more, or that the typing backend cannot
+    type, is pasted through `paste` instead, if there is one.
+    write() and backspace() return a Future done once the keys are sent.
+    """
+    def __init__(self, backend, paste=None, paste_over=0):
+        self.backend = backend
+        self.paste = paste
+        self.paste_over = paste_over
+        self.queue = queue.Queue()
+        self.chars = 0
+        self.seconds = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True, name="injector")
+        self.thread.start()
+
+    def write(self, text) -> Future:
+        return self._put("write", text)
+
+    def backspace(self, count) -> Future:
+        return self._put("backspace", count)
+
+    def _put(self, op, arg):
+        future = Future()
+        self.queue.put((op, arg, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been typed, e.g. before a hotkey"""
+        self._put("flush", None).result(timeout)
+
+    def _backend_for(self, text):
+        if self.paste and ((self.paste_over and len(text) >= self.paste_over)
+                           or not self.backend.can_type(text)):
+            return self.paste
+        return self.backend
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            op, arg, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.monotonic()
+            try:
+                if op == "write" and arg:
+                    backend = self._backend_for(arg)
+                    backend.write(arg)
+                    elapsed = time.monotonic() - start
+                    self.chars += len(arg)
+                    self.seconds += elapsed
+                    metrics.inc("injected_chars_total", len(arg), backend=backend.name)
+                    metrics.observe("inject_seconds", elapsed, backend=backend.name)
+                    logging.debug(f"Typed {len(arg)} characters with {backend.name} in {elapsed:.3f}s")
+                elif op == "backspace" and arg:
+                    self.backend.backspace(arg)
+                future.set_result(True)
+            except Exception as e:
+                logging.error(f"Could not type with {self.backend.name}: {e}")
+                metrics.inc("inject_errors_total", backend=self.backend.name)
+                future.set_exception(e)
+
+    def rate(self):
+        """Characters per second typed so far"""
+        return self.chars / self.seconds if self.seconds else 0.0
+
+    def close(self, timeout=2.0):
+        self.queue.put(None)
+        self.thread.join(timeout)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Deferred imports for optional subsystems
+
+The camera, TTS, image generation, Gemini and OpenAI each pull in large
+libraries (GStreamer, PIL, the OpenAI SDK) that a plain dictation
+session may never use. LazyModule and LazyObject stand in for a module
+or a client until it is first used, so that cost is paid by the first
+command that needs it instead of by every start-up.
+"""
+
+import time
+import logging
+import importlib
+import threading
+from metrics import metrics
+
+# module name -> seconds its first import took, in load order
+loaded = {}
+_lock = threading.RLock()
+
+class LazyModule:
+    """Imports the named module the first time one of its attributes is used"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    start = time.monotonic()
+                    module = importlib.import_module(self._name)
+                    elapsed = time.monotonic() - start
+                    loaded[self._name] = elapsed
+                    metrics.observe("lazy_import_seconds", elapsed, module=self._name)
+                    logging.debug(f"Imported {self._name} on first use in {elapsed:.3f}s")
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+class LazyObject:
+    """Calls factory() to build the object the first time it is used, e.g. an API client"""
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+
+    def _load(self):
+        if self._object is None:
+            with _lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def lazy_function(module, name):
+    """A function of a LazyModule that imports the module when it is first called"""
+    def call(*args, **kwargs):
+        return getattr(module, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+On-demand lifecycle of the local whisper-server and llama-server
+
+A ManagedServer starts its server, from a command line or a systemd user
+unit, the first time it is needed. It waits for the readiness probe to
+answer, sends a warm-up request so the model is resident on the GPU
+before the user speaks, and stops the server again after idle_timeout
+seconds without requests to free the VRAM. A server that was already
+running when the client started is used, but never stopped.
+"""
+
+import os
+import time
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from metrics import metrics
+
+class ManagedServer:
+    def __init__(self, name, probe_url, command=None, unit=None, warmup=None,
+                 idle_timeout=0, start_timeout=120.0):
+        self.name = name
+        self.probe_url = probe_url
+        self.command = command  # shell-style command line that runs the server
+        self.unit = unit  # or a systemd --user unit that does
+        self.warmup = warmup  # callable sending a short request
+        self.idle_timeout = idle_timeout  # seconds; 0 keeps the server running
+        self.start_timeout = start_timeout
+        self.process = None
+        self.owned = False  # started by us, so ours to stop
+        self.ready = False
+        self.warm = False  # warm-up sent since the server last started
+        self.last_used = time.monotonic()
+        self.starts = 0
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        if idle_timeout:
+            threading.Thread(target=self._idle_loop, daemon=True,
+                             name=f"{name}-idle").start()
+
+    @property
+    def managed(self):
+        return bool(self.command or self.unit)
+
+    def probe(self, timeout=1.0) -> bool:
+        """True if the server answers its readiness probe with 200"""
+        try:
+            with urllib.request.urlopen(self.probe_url, timeout=timeout) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError, ValueError):
+            return False
+
+    def ensure_running(self) -> float:
+        """
+        Start the server if it is not ready. Returns the seconds the caller
+        waited for it: 0 when it was already warm.
+        """
+        self.last_used = time.monotonic()
+        if self.ready and not self._exited():
+            return 0.0
+        start = time.monotonic()
+        with self.lock:
+            if self.ready and not self._exited():
+                return time.monotonic() - start  # another thread started it meanwhile
+            if self._exited():
+                logging.warning(f"{self.name} exited with status {self.process.returncode}, restarting it")
+                metrics.inc("server_exits_total", server=self.name)
+                self.process = None
+                self.owned = False
+            self.ready = False
+            if self.probe():
+                logging.debug(f"{self.name} is already running")
+                if self.warm:
+                    self.ready = True  # it only missed a request
+                    return 0.0
+            elif self.managed:
+                self.warm = False
+                self._start()
+                self.owned = True
+                try:
+                    self._wait_ready()
+                except Exception:
+                    self.stop()
+                    raise
+                self.starts += 1
+                metrics.observe("server_start_seconds", time.monotonic() - start, server=self.name)
+            else:
+                return 0.0  # not ours to start; the request will report the error
+            self.ready = True
+            if self.warmup:
+                self._warm_up()
+            self.warm = True
+            waited = time.monotonic() - start
+            logging.info(f"{self.name} ready after {waited:.1f}s")
+            self.last_used = time.monotonic()
+            return waited
+
+    def _exited(self):
+        """True if the server process we started is gone"""
+        return self.process is not None and self.process.poll() is not None
+
+    def mark_down(self):
+        """
+        A request could not connect: probe again before the next one, and
+        start the server if it is gone, e.g. stopped from outside.
+        """
+        if self.ready:
+            logging.debug(f"{self.name} did not answer; probing it before the next request")
+            self.ready = False
+
+    def start_in_background(self):
+        """Start and warm up the server without waiting, e.g. at client start-up"""
+        threading.Thread(target=self._start_quietly, daemon=True,
+                         name=f"{self.name}-start").start()
+
+    def _start_quietly(self):
+        try:
+            self.ensure_running()
+        except Exception as e:
+            logging.error(f"Could not start {self.name}: {e}")
+
+    def _start(self):
+        if self.unit:
+            logging.info(f"Starting {self.name}: systemctl --user start {self.unit}")
+            subprocess.run(["systemctl", "--user", "start", self.unit], check=True)
+        else:
+            logging.info(f"Starting {self.name}: {self.command}")
+            self.process = subprocess.Popen(shlex.split(self.command),
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL,
+                                            start_new_session=True)
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.start_timeout
+        while not self.probe():
+            if self.process and self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with status {self.process.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{self.name} not ready after {self.start_timeout:.0f}s")
+            time.sleep(0.25)
+
+    def _warm_up(self):
+        start = time.monotonic()
+        try:
+            self.warmup()
+        except Exception as e:
+            logging.debug(f"{self.name} warm-up failed: {e}")
+            return
+        elapsed = time.monotonic() - start
+        metrics.observe("server_warmup_seconds", elapsed, server=self.name)
+        logging.debug(f"{self.name} warmed up in {elapsed:.2f}s")
+
+    def _idle_loop(self):
+        while not self.stopped.wait(min(self.idle_timeout / 4, 10)):
+            if self.ready and self.owned and \
+                    time.monotonic() - self.last_used > self.idle_timeout:
+                logging.info(f"{self.name} idle for {self.idle_timeout:.0f}s, stopping it")
+                self.stop()
+
+    def stop(self):
+        """Stop the server if we started it"""
+        with self.lock:
+            if not self.owned:
+                return
+            self.ready = False
+            self.warm = False
+            self.owned = False
+            metrics.inc("server_stops_total", server=self.name)
+            if self.unit:
+                subprocess.run(["systemctl", "--user", "stop", self.unit])
+            elif self.process:
+                # the whole session, as a script such as start_server.sh runs the server as a child
+                self._signal(signal.SIGTERM)
+                try:
+                    self.process.wait(10)
+                except subprocess.TimeoutExpired:
+                    self._signal(signal.SIGKILL)
+                self.process = None
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        self.stopped.set()
+        self.stop()
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Per-utterance latency timelines and a small metrics registry
+
+Every AudioSegment carries a Timeline of monotonic timestamps, one per
+stage from speech onset to text injection. Finished timelines are folded
+into histograms, which can be served on a local HTTP endpoint in
+Prometheus text format (/metrics) or JSON (/metrics.json), and written
+one per line to a JSONL trace file.
+"""
+
+import json
+import time
+import logging
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# stage name, and the name of the interval that ends at that stage
+STAGES = (
+    ("onset", None),                     # sound above threshold
+    ("valve_open", "onset"),             # recording started, after the ignore window
+    ("speech_end", "speech"),            # last sound above threshold
+    ("valve_close", "hangover"),         # recording stopped after the silence hangover
+    ("saved", "save"),                   # PCM gathered into an AudioSegment
+    ("queued", "handoff"),               # put in audio_queue
+    ("dequeued", "queue"),               # picked up by a transcription worker
+    ("request_sent", "encode"),          # upload built, request on the wire
+    ("response_received", "request"),    # backend replied
+    ("postprocessed", "postprocess"),    # filters and repetition removal done
+    ("injected", "inject"),              # text typed into the active window
+)
+
+# seconds; covers a fast keystroke up to a slow cloud round-trip
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Timeline:
+    """Monotonic timestamps of the stages one segment went through"""
+    def __init__(self):
+        self.marks = {}
+
+    def mark(self, stage, when=None):
+        """Record that stage was reached, now or at monotonic time `when`"""
+        self.marks[stage] = time.monotonic() if when is None else when
+
+    def __bool__(self):
+        return bool(self.marks)
+
+    def intervals(self):
+        """Seconds spent in each interval, between consecutive marked stages"""
+        result = {}
+        previous = None
+        for stage, interval in STAGES:
+            if stage not in self.marks:
+                continue
+            if previous is not None and interval:
+                result[interval] = max(self.marks[stage] - self.marks[previous], 0.0)
+            previous = stage
+        return result
+
+    def end_to_end(self):
+        """Seconds from the end of speech to the text being typed, or None"""
+        end = self.marks.get("speech_end", self.marks.get("valve_close"))
+        if end is None or "injected" not in self.marks:
+            return None
+        return max(self.marks["injected"] - end, 0.0)
+
+    def as_dict(self):
+        """Marks relative to the first one, for the trace file"""
+        if not self.marks:
+            return {}
+        first = min(self.marks.values())
+        order = [stage for stage, _ in STAGES]
+        stages = sorted(self.marks, key=lambda s: order.index(s) if s in order else len(order))
+        return {stage: round(self.marks[stage] - first, 6) for stage in stages}
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, recent=1000):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        # recent observations, for percentiles in the JSON view
+        self.recent = collections.deque(maxlen=recent)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentile(self, p):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(int(p / 100.0 * len(values)), len(values) - 1)]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Metrics:
+    """Counters, gauges and histograms, keyed by name and labels"""
+    def __init__(self, prefix="whisper_"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}  # name -> callable returning a number
+        self.help = {}
+        self.trace_file = None
+        self.server = None
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, _labels(labels))] += value
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, _labels(labels)), 0)
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def gauge(self, name, read):
+        """Register a gauge; read() is called whenever metrics are exported"""
+        self.gauges[name] = read
+
+    def _read_gauges(self):
+        values = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logging.debug(f"Gauge {name} failed: {e}")
+                continue
+            if value is not None:
+                values[name] = float(value)
+        return values
+
+    def record(self, timeline, **fields):
+        """Fold a finished segment timeline into the histograms and the trace file"""
+        for interval, seconds in timeline.intervals().items():
+            self.observe("stage_seconds", seconds, stage=interval)
+        end_to_end = timeline.end_to_end()
+        if end_to_end is not None:
+            self.observe("end_to_end_seconds", end_to_end)
+        if self.trace_file:
+            entry = dict(fields, marks=timeline.as_dict(),
+                         intervals={k: round(v, 6) for k, v in timeline.intervals().items()},
+                         end_to_end=end_to_end)
+            line = json.dumps(entry) + "\n"
+            with self.lock:
+                try:
+                    self.trace_file.write(line)
+                    self.trace_file.flush()
+                except (OSError, ValueError) as e:
+                    logging.error(f"Could not write trace: {e}")
+                    self.trace_file = None
+
+    def open_trace(self, file_name):
+        """Append one JSON line per finished segment to file_name"""
+        self.trace_file = open(file_name, "a", buffering=1)
+        logging.debug(f"Writing segment traces to {file_name}")
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        seen = set()
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {self.prefix}{name} {self.help[name]}")
+            lines.append(f"# TYPE {self.prefix}{name} {kind}")
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            for (name, key), value in counters:
+                header(name, "counter")
+                lines.append(f"{self.prefix}{name}{_format_labels(key)} {value:g}")
+            for (name, key), h in histograms:
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{self.prefix}{name}_bucket"
+                                 f"{_format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{self.prefix}{name}_bucket{_format_labels(key, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{self.prefix}{name}_sum{_format_labels(key)} {h.sum:.6f}")
+                lines.append(f"{self.prefix}{name}_count{_format_labels(key)} {h.count}")
+        for name, value in sorted(self._read_gauges().items()):
+            header(name, "gauge")
+            lines.append(f"{self.prefix}{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """All metrics as plain data, with percentiles for histograms"""
+        def flat(name, key):
+            return name + "".join(f"[{v}]" for _, v in key)
+        with self.lock:
+            result = {
+                "counters": {flat(n, k): v for (n, k), v in self.counters.items()},
+                "histograms": {flat(n, k): h.summary() for (n, k), h in self.histograms.items()},
+            }
+        result["gauges"] = self._read_gauges()
+        return result
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics and /metrics.json from a background thread"""
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format % args)
+
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.snapshot(), indent=1).encode()
+                    kind = "application/json"
+                elif self.path.startswith("/metrics") or self.path == "/":
+                    body = metrics.prometheus().encode()
+                    kind = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True,
+                         name="metrics").start()
+        logging.info(f"Metrics on http://{host}:{self.server.server_port}/metrics")
+        return self.server
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+
+# shared by the recorders, the pipeline and the client
+metrics = Metrics()
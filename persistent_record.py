@@ -13,28 +13,46 @@ import math
 import logging
 import threading
 import queue
-import tempfile
 gi.require_version("Gst", "1.0")
 from gi.repository import Gst, GLib
+from audio_buffer import AudioSegment, PCMRingBuffer, SegmentQueue
+from vad import make_vad
+from metrics import Timeline, metrics
 
 # Initialize GStreamer
 Gst.init(None)
 
 class PersistentAudioRecorder:
-    def __init__(self, threshold=-30, stop_after=2.2, ignore=0.3, preroll=0.6):
+    def __init__(self, threshold=-30, stop_after=2.2, ignore=0.3, preroll=0.6,
+                 vad="level", endpointer=None, queue_size=0):
         self.threshold = threshold
         self.stop_after = stop_after
         self.ignore = ignore
         self.preroll = preroll
         
-        # Audio queue for completed segments
-        self.audio_queue = queue.Queue()
+        # Voice activity detector: a name for make_vad() or an instance
+        self.vad = make_vad(vad, threshold, ignore) if isinstance(vad, str) else vad
+        logging.debug(f"Using {type(self.vad).__name__} voice activity detection")
+        
+        # Optional adaptive end-of-utterance detection (see endpoint.py)
+        self.endpointer = endpointer
+        
+        # Audio queue for completed segments; when a bounded queue is
+        # full, no new segment is started until the consumer catches up
+        self.audio_queue = SegmentQueue(queue_size, policy="block")
+        self.refusing = False
         
         # Recording state
         self.recording = False
         self.quiet_timer = self.sound_timer = time.time()
-        self.current_segment = None
+        self.segment_start = None
         self.segment_count = 0
+        self.timeline = None
+        
+        # Lookahead: always holds the last `preroll` seconds of audio,
+        # so speech onsets are not clipped when a segment starts
+        self.lookahead = PCMRingBuffer(seconds=preroll)
+        self.buffer_lock = threading.Lock()
         
         # Threading
         self.running = True
@@ -48,16 +66,16 @@ class PersistentAudioRecorder:
         """Create the persistent GStreamer pipeline"""
         # Create pipeline with tee to split audio stream
         # One branch goes to level detection, other to appsink for buffering
+        # The appsink always runs; between segments it feeds the lookahead buffer
         self.pipeline = Gst.parse_launch(
             "autoaudiosrc ! "
             "audio/x-raw,rate=16000,channels=1,format=S16LE ! "
             "tee name=t ! "
             "queue ! level name=level_element interval=100000000 ! fakesink "
-            "t. ! queue ! valve name=recording_valve drop=true ! "
+            "t. ! queue ! "
             "appsink name=appsink emit-signals=true max-buffers=1000"
         )
         
-        self.valve = self.pipeline.get_by_name('recording_valve')
         self.appsink = self.pipeline.get_by_name('appsink')
         
         # Connect to appsink signals
@@ -77,7 +95,16 @@ class PersistentAudioRecorder:
         sample = appsink.emit('pull-sample')
         if sample:
             buffer = sample.get_buffer()
-            self.audio_buffer.append(buffer)
+            chunk = buffer.extract_dup(0, buffer.get_size())
+            with self.buffer_lock:
+                if self.recording:
+                    self.audio_buffer.append(chunk)
+                else:
+                    self.lookahead.push(chunk)
+            if self.vad.uses_frames:
+                speech = self.vad.process(chunk)
+                if speech is not None:
+                    self._update_vad(speech)
         return Gst.FlowReturn.OK
         
     def _monitor_levels(self, bus, message):
@@ -97,79 +124,86 @@ class PersistentAudioRecorder:
             
         if self._level_count % 50 == 0:  # Every ~5 seconds at 10Hz
             logging.debug(f"Audio level: {rms:.1f} dB (threshold: {self.threshold})")
+            if self.vad.rejected_bursts:
+                logging.debug(f"VAD rejected {self.vad.rejected_bursts} non-speech bursts")
             
+        if not self.vad.uses_frames:
+            self._update_vad(self.vad.is_speech(rms))
+            
+    def _update_vad(self, speech):
+        """Start and stop segments from speech/non-speech decisions"""
         reset = time.time()
         seconds_of_quiet = reset - self.quiet_timer
         seconds_of_sound = reset - self.sound_timer
         
         # Voice activity detection
-        if rms > self.threshold:
+        if speech:
             if self.ignore < seconds_of_sound and not self.recording:
-                self._start_segment_recording()
+                self._start_segment_recording(onset=time.monotonic() - seconds_of_sound)
+            elif self.recording and self.endpointer and seconds_of_quiet > 0.15:
+                # the user paused, then kept talking
+                self.endpointer.note_pause(seconds_of_quiet)
             self.quiet_timer = reset
         else:
-            if self.recording and self.stop_after < seconds_of_quiet:
-                self._stop_segment_recording()
+            if self.recording and self._hangover() < seconds_of_quiet:
+                self._stop_segment_recording(speech_end=time.monotonic() - seconds_of_quiet)
             elif not self.recording:
                 self.sound_timer = reset
                 
-    def _start_segment_recording(self):
+    def _hangover(self):
+        """Seconds of silence that end the current segment"""
+        if not self.endpointer:
+            return self.stop_after
+        # speech from onset to the last loud level, without preroll or silence
+        return self.endpointer.hangover(self.quiet_timer - self.sound_timer,
+                                        self.segment_count)
+                
+    def _start_segment_recording(self, onset=None):
         """Start recording a new audio segment"""
+        if self.audio_queue.full():
+            if not self.refusing:
+                logging.warning("Transcription is behind; not recording until it catches up")
+                metrics.inc("segments_refused_total")
+            self.refusing = True
+            return
+        self.refusing = False
         logging.debug("Starting audio segment recording")
-        self.recording = True
-        self.segment_count += 1
+        timeline = Timeline()
+        timeline.mark("onset", onset)
+        timeline.mark("valve_open")
+        with self.buffer_lock:
+            # Start the new recording with the lookahead history
+            self.audio_buffer = self.lookahead.drain()
+            preroll = sum(map(len, self.audio_buffer)) / (16000 * 2)
+            self.recording = True
+            self.segment_count += 1
+            self.segment_start = time.monotonic() - preroll
+            self.timeline = timeline
         
-        # Clear buffer for new recording
-        self.audio_buffer = []
-        
-        # Open the valve to start recording
-        self.valve.set_property("drop", False)
-        
-    def _stop_segment_recording(self):
+    def _stop_segment_recording(self, speech_end=None):
         """Stop recording current segment and queue it"""
-        logging.debug("Stopping audio segment recording")
-        self.recording = False
-        
-        # Close the valve to stop recording
-        self.valve.set_property("drop", True)
+        logging.debug(f"Stopping audio segment recording after {self._hangover():.2f}s of silence")
+        with self.buffer_lock:
+            self.recording = False
+            audio_buffer, self.audio_buffer = self.audio_buffer, []
+        timeline = self.timeline or Timeline()
+        timeline.mark("speech_end", speech_end)
+        timeline.mark("valve_close")
         
-        # Save buffered audio to file
-        if self.audio_buffer:
-            segment_file = f"/tmp/audio_segment_{self.segment_count:05d}.wav"
-            if self._save_buffer_to_file(segment_file):
-                self.audio_queue.put(segment_file)
-                logging.debug(f"Queued audio segment: {segment_file}")
+        # Hand the buffered PCM over in memory
+        if audio_buffer:
+            segment = AudioSegment(b"".join(audio_buffer),
+                                   start_time=self.segment_start,
+                                   segment_id=self.segment_count,
+                                   timeline=timeline)
+            timeline.mark("saved")
+            try:
+                # never block the GLib thread
+                self.audio_queue.put(segment, block=False)
+                logging.debug(f"Queued audio segment: {segment}")
+            except queue.Full:
+                logging.error(f"Segment queue full, dropped {segment}")
             
-    def _save_buffer_to_file(self, filename):
-        """Save audio buffer to WAV file"""
-        try:
-            import wave
-            import struct
-            
-            # WAV file parameters
-            sample_rate = 16000
-            channels = 1
-            sample_width = 2  # 16-bit
-            
-            with wave.open(filename, 'wb') as wav_file:
-                wav_file.setnchannels(channels)
-                wav_file.setsampwidth(sample_width)
-                wav_file.setframerate(sample_rate)
-                
-                # Convert GStreamer buffers to audio data
-                for buffer in self.audio_buffer:
-                    success, map_info = buffer.map(Gst.MapFlags.READ)
-                    if success:
-                        wav_file.writeframes(map_info.data)
-                        buffer.unmap(map_info)
-                        
-            logging.debug(f"Saved {len(self.audio_buffer)} buffers to {filename}")
-            return True
-            
-        except Exception as e:
-            logging.error(f"Error saving audio buffer: {e}")
-            return False
-        
     def _on_bus_message(self, bus, message):
         """Handle bus messages"""
         if message.type == Gst.MessageType.ERROR:
@@ -210,8 +244,19 @@ class PersistentAudioRecorder:
         except Exception as e:
             logging.error(f"Main loop error: {e}")
             
+    def snapshot(self):
+        """
+        Return the utterance recorded so far as an AudioSegment,
+        or None when no segment is being recorded
+        """
+        if not self.recording:
+            return None
+        return AudioSegment(b"".join(list(self.audio_buffer)),
+                            start_time=self.segment_start,
+                            segment_id=self.segment_count)
+            
     def get_audio_segment(self, timeout=5.0):
-        """Get next available audio segment"""
+        """Get next available AudioSegment, or None on timeout"""
         try:
             return self.audio_queue.get(timeout=timeout)
         except queue.Empty:
@@ -231,11 +276,9 @@ class PersistentAudioRecorder:
         if self.loop:
             self.loop.quit()
             
-        # Clean up any remaining temp files
+        # Discard any segments that were never picked up
         try:
             while True:
-                segment = self.audio_queue.get_nowait()
-                if os.path.exists(segment):
-                    os.remove(segment)
+                self.audio_queue.get_nowait()
         except queue.Empty:
             pass
\ No newline at end of file
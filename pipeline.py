@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Pipelined transcription: several segments in flight at once,
+results handed back strictly in the order the segments were spoken
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def split_transcript(result, spans):
+    """
+    Split a verbose_json transcript of joined segments (AudioSegment.join)
+    back into one text per segment. Each word goes to the span its midpoint
+    is in, or nearest to. Returns None if the result has no timestamps fine
+    enough to split it.
+    """
+    def distance(t, span):
+        start, end = span
+        return 0.0 if start <= t <= end else min(abs(t - start), abs(t - end))
+    texts = [""] * len(spans)
+    for piece in result.get("segments") or []:
+        words = piece.get("words")
+        if not words:
+            # no word timestamps: usable only if the piece lies within one span
+            words = [dict(piece, word=piece.get("text", ""))]
+            owners = {min(range(len(spans)), key=lambda i: distance(t, spans[i]))
+                      for t in (piece.get("start", 0.0), piece.get("end", 0.0))}
+            if len(owners) > 1:
+                return None
+        for word in words:
+            text = word.get("word", word.get("text", ""))
+            if "start" not in word or "end" not in word:
+                return None
+            if text.strip().startswith("[_"):
+                continue  # special tokens such as [_BEG_]
+            middle = (word["start"] + word["end"]) / 2
+            texts[min(range(len(spans)), key=lambda i: distance(middle, spans[i]))] += text
+    if not any(texts) and result.get("text", "").strip():
+        return None  # text but no segments
+    return texts
+
+class TranscriptionPipeline:
+    def __init__(self, transcribe, workers=1, transcribe_batch=None):
+        self.transcribe = transcribe  # segment -> text, e.g. gettext
+        # [segments] -> [text per segment] with one backend request, or None
+        self.transcribe_batch = transcribe_batch
+        self.workers = max(int(workers), 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="transcriber")
+        # reorder buffer: finished results wait here until their turn
+        self.cond = threading.Condition()
+        self.finished = {}
+        self.submitted = 0
+        self.delivered = 0
+        self.processed = 0
+        self.transcribed = 0
+        self.batches = 0
+        self.batched = 0
+
+        # statistics
+        self.started = time.monotonic()
+        self.busy_time = 0.0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def submit(self, segment):
+        """Queue a segment for transcription; returns its sequence number"""
+        with self.cond:
+            seq = self.submitted
+            self.submitted += 1
+        self.executor.submit(self._work, seq, segment)
+        return seq
+
+    def submit_batch(self, segments):
+        """
+        Queue several segments to be transcribed together; results are still
+        delivered one per segment, in order. Returns the first sequence number.
+        """
+        if len(segments) == 1 or not self.transcribe_batch:
+            return [self.submit(segment) for segment in segments][0]
+        with self.cond:
+            first = self.submitted
+            self.submitted += len(segments)
+        self.executor.submit(self._work_batch, first, segments)
+        return first
+
+    def _work(self, seq, segment):
+        text = self._run(seq, segment)
+        with self.cond:
+            self.finished[seq] = (segment, text)
+            self.cond.notify_all()
+
+    def _work_batch(self, first, segments):
+        texts = self._run_batch(first, segments)
+        with self.cond:
+            for i, (segment, text) in enumerate(zip(segments, texts)):
+                self.finished[first + i] = (segment, text)
+            self.cond.notify_all()
+
+    def _run_batch(self, first, segments):
+        """Transcribe a batch with one request, or one by one if that fails"""
+        start = time.monotonic()
+        for segment in segments:
+            timeline = getattr(segment, "timeline", None)
+            if timeline is not None:
+                timeline.mark("dequeued", start)
+        try:
+            texts = self.transcribe_batch(segments)
+        except Exception as e:
+            logging.error(f"Batch transcription of segments #{first}-#{first + len(segments) - 1} failed: {e}")
+            texts = None
+        if texts is None or len(texts) != len(segments):
+            logging.debug(f"Could not split batch #{first}, transcribing its segments one by one")
+            return [self._run(first + i, segment) for i, segment in enumerate(segments)]
+        busy = time.monotonic() - start
+        queue_wait = max(start - getattr(segments[0], "end_time", start), 0.0)
+        with self.cond:
+            self.busy_time += busy
+            self.queue_wait_total += queue_wait * len(segments)
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+            self.transcribed += len(segments)
+            self.batches += 1
+            self.batched += len(segments)
+        logging.debug(f"Batch of {len(segments)} segments from #{first} transcribed in {busy:.2f}s")
+        return texts
+
+    def _run(self, seq, segment):
+        """Transcribe one segment on a worker thread, keeping statistics"""
+        start = time.monotonic()
+        timeline = getattr(segment, "timeline", None)
+        if timeline is not None:
+            timeline.mark("dequeued", start)
+        # time since the end of speech, spent in audio_queue and here
+        queue_wait = max(start - getattr(segment, "end_time", start), 0.0)
+        try:
+            text = self.transcribe(segment)
+        except Exception as e:
+            logging.error(f"Transcription of segment #{seq} failed: {e}")
+            text = ""
+        busy = time.monotonic() - start
+        with self.cond:
+            self.busy_time += busy
+            self.queue_wait_total += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+            self.transcribed += 1
+        logging.debug(f"Segment #{seq} transcribed in {busy:.2f}s after waiting {queue_wait:.2f}s")
+        return text
+
+    def get(self, timeout=None):
+        """
+        Return (segment, text) for the next segment in spoken order,
+        or None if it is not ready within timeout seconds.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.delivered in self.finished,
+                                      timeout=timeout):
+                return None
+            result = self.finished.pop(self.delivered)
+            self.delivered += 1
+            self.cond.notify_all()
+            return result
+
+    def task_done(self):
+        """Like queue.Queue.task_done(): the consumer finished with a result"""
+        with self.cond:
+            self.processed += 1
+
+    def idle(self):
+        """True when every submitted segment has been delivered and processed"""
+        with self.cond:
+            return self.processed >= self.submitted
+
+    def wait_for_room(self, limit, timeout=None):
+        """Wait until fewer than limit segments are in flight; False on timeout"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.submitted - self.delivered < limit,
+                                      timeout=timeout)
+
+    def in_flight(self):
+        with self.cond:
+            return self.submitted - self.delivered
+
+    def stats(self):
+        with self.cond:
+            done = self.transcribed
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {
+                "workers": self.workers,
+                "in_flight": self.submitted - self.delivered,
+                "transcribed": done,
+                "worker_utilization": self.busy_time / (elapsed * self.workers),
+                "queue_wait_avg": self.queue_wait_total / done if done else 0.0,
+                "queue_wait_max": self.queue_wait_max,
+                "batches": self.batches,
+                "batched_segments": self.batched,
+            }
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+class AsyncTranscriptionPipeline(TranscriptionPipeline):
+    """
+    The same worker pool for an asyncio event loop: submit() from the
+    loop, and await get() for results in spoken order. Must be created
+    while the loop is running.
+    """
+    def __init__(self, transcribe, workers=1, transcribe_batch=None):
+        super().__init__(transcribe, workers, transcribe_batch)
+        self.loop = asyncio.get_running_loop()
+        # (segment, future, index in batch or None) in submission order
+        self.pending = asyncio.Queue()
+        self.delivered_event = asyncio.Event()
+
+    def submit(self, segment):
+        with self.cond:
+            seq = self.submitted
+            self.submitted += 1
+        future = self.loop.run_in_executor(self.executor, self._run, seq, segment)
+        self.pending.put_nowait((segment, future, None))
+        return seq
+
+    def submit_batch(self, segments):
+        if len(segments) == 1 or not self.transcribe_batch:
+            return [self.submit(segment) for segment in segments][0]
+        with self.cond:
+            first = self.submitted
+            self.submitted += len(segments)
+        future = self.loop.run_in_executor(self.executor, self._run_batch, first, segments)
+        for i, segment in enumerate(segments):
+            self.pending.put_nowait((segment, future, i))
+        return first
+
+    async def get(self):
+        """Wait for the next (segment, text) in spoken order"""
+        segment, future, index = await self.pending.get()
+        text = await future
+        if index is not None:
+            text = text[index]
+        with self.cond:
+            self.delivered += 1
+        self.delivered_event.set()
+        return segment, text
+
+    async def wait_for_room(self, limit):
+        """Wait until fewer than limit segments are in flight"""
+        while self.in_flight() >= limit:
+            self.delivered_event.clear()
+            await self.delivered_event.wait()
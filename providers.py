@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Chat providers with long-lived clients, health tracking and circuit breaking
+
+Each provider (OpenAI, Gemini, the local llama.cpp server) keeps one
+client for the life of the process and a rolling record of latency and
+errors. A provider that keeps failing has its circuit opened: it is
+skipped, instead of costing a full timeout on every prompt, while a
+background thread probes it until it answers again.
+"""
+
+import abc
+import time
+import logging
+import threading
+import collections
+from metrics import metrics
+
+class CircuitBreaker:
+    """
+    Closed while a provider works. Opens after `threshold` consecutive
+    failures, for `cooldown` seconds, doubling up to max_cooldown each
+    time a probe fails.
+    """
+    def __init__(self, threshold=3, cooldown=30.0, max_cooldown=300.0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def open(self):
+        return self.opened_at is not None
+
+    def probe_due(self):
+        with self.lock:
+            return self.open and time.monotonic() - self.opened_at >= self.cooldown
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.cooldown = self.base_cooldown
+
+    def failure(self):
+        """Count a failure; True if this opened the circuit"""
+        with self.lock:
+            self.failures += 1
+            if self.open:
+                # a failed probe: wait longer before the next one
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.opened_at = time.monotonic()
+            elif self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+class ChatProvider(abc.ABC):
+    """
+    A chat backend; subclasses implement reply() and probe().
+    server is the lifecycle.ManagedServer to start before a request, if any.
+    """
+    def __init__(self, name, timeout=30.0, window=20, breaker=None, server=None):
+        self.name = name
+        self.timeout = timeout
+        self.server = server
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = collections.deque(maxlen=window)
+        self.outcomes = collections.deque(maxlen=window)  # True for success
+
+    @abc.abstractmethod
+    def reply(self, messages, stream=None):
+        """
+        Answer the conversation in messages, whose last entry is the prompt.
+        With stream, a callable, the reply is passed to it as an iterator of
+        text pieces and its result returned; otherwise (text, False).
+        """
+
+    @abc.abstractmethod
+    def probe(self):
+        """A cheap request that raises if the provider is unreachable"""
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def latency(self):
+        """Mean latency of recent successful requests, or None"""
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    def stats(self):
+        return {"circuit": "open" if self.breaker.open else "closed",
+                "error_rate": round(self.error_rate(), 3), "latency": self.latency()}
+
+class OpenAIChatProvider(ChatProvider):
+    """
+    OpenAI, or any OpenAI-compatible server such as llama.cpp's.
+    extra_body holds server-specific request fields, e.g. cache_prompt.
+    """
+    def __init__(self, name, client, model="gpt-3.5-turbo", extra_body=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.client = client
+        self.model = model
+        self.options = {"timeout": self.timeout}
+        if extra_body:
+            self.options["extra_body"] = extra_body
+
+    @staticmethod
+    def deltas(stream):
+        """Text pieces of a streamed chat.completions response"""
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()  # stops generation when the reply is cut off
+
+    def reply(self, messages, stream=None):
+        if stream:
+            return stream(self.deltas(self.client.chat.completions.create(
+                model=self.model, messages=messages, stream=True, **self.options)))
+        completion = self.client.chat.completions.create(
+            model=self.model, messages=messages, **self.options)
+        return completion.choices[0].message.content, False
+
+    def probe(self):
+        self.client.models.list(timeout=self.timeout)
+
+class GeminiChatProvider(ChatProvider):
+    """
+    Google Gemini. The chat session is kept between turns and only rebuilt
+    when the conversation no longer matches it, e.g. after trimming.
+    """
+    def __init__(self, name, model, **kwargs):
+        super().__init__(name, **kwargs)
+        self.model = model
+        self.chat = None
+        self.synced = None  # the messages the chat session holds
+
+    @staticmethod
+    def history(messages):
+        return [{"role": "user" if x["role"] == "user" else "model", "parts": x["content"]}
+                for x in messages]
+
+    def reply(self, messages, stream=None):
+        prompt = messages[-1]["content"]
+        if self.chat is None or self.synced != messages[:-1]:
+            logging.debug(f"Starting a {self.name} chat with {len(messages) - 1} messages")
+            self.chat = self.model.start_chat(history=self.history(messages[:-1]))
+        self.synced = None  # until the reply is complete
+        options = {"request_options": {"timeout": self.timeout}}
+        if stream:
+            completion, clarify = stream(chunk.text for chunk in
+                                         self.chat.send_message(prompt, stream=True, **options))
+        else:
+            completion, clarify = self.chat.send_message(prompt, **options).text, False
+        self.synced = list(messages) + [{"role": "assistant", "content": completion}]
+        return completion, clarify
+
+    def probe(self):
+        self.model.count_tokens("ping")
+
+class ProviderPool:
+    """Providers in order of preference, skipping those with an open circuit"""
+    def __init__(self, providers, probe_interval=5.0):
+        self.providers = list(providers)
+        self.probe_interval = probe_interval
+        self.stopped = threading.Event()
+        self.prober = None
+
+    def available(self):
+        """Providers to try, in order; all of them if every circuit is open"""
+        closed = [p for p in self.providers if not p.breaker.open]
+        return closed or self.providers
+
+    def call(self, provider, messages, stream=None):
+        """provider.reply(), timed and counted towards its health"""
+        try:
+            # seconds spent starting the provider's server, if it was stopped
+            waited = provider.server.ensure_running() if provider.server else 0.0
+            start = time.monotonic()
+            result = provider.reply(messages, stream)
+        except Exception:
+            if provider.server:
+                provider.server.mark_down()  # restarted by the next request if it is gone
+            self.failed(provider)
+            raise
+        elapsed = time.monotonic() - start
+        provider.latencies.append(elapsed)
+        provider.outcomes.append(True)
+        provider.breaker.success()
+        metrics.observe("chat_seconds", elapsed, provider=provider.name)
+        metrics.inc("chat_requests_total", provider=provider.name, outcome="ok")
+        if waited:
+            metrics.observe("cold_request_seconds", waited + elapsed, server=provider.server.name)
+        return result
+
+    def failed(self, provider):
+        provider.outcomes.append(False)
+        metrics.inc("chat_requests_total", provider=provider.name, outcome="error")
+        if provider.breaker.failure():
+            logging.warning(f"{provider.name} keeps failing; skipping it until it answers again")
+            metrics.inc("chat_circuit_opened_total", provider=provider.name)
+            self._start_prober()
+
+    def _start_prober(self):
+        if self.prober and self.prober.is_alive():
+            return
+        self.prober = threading.Thread(target=self._probe_loop, daemon=True, name="chat-prober")
+        self.prober.start()
+
+    def _probe_loop(self):
+        """Probe providers with an open circuit until they all answer again"""
+        while not self.stopped.wait(self.probe_interval):
+            open_circuits = [p for p in self.providers if p.breaker.open]
+            if not open_circuits:
+                return
+            for provider in open_circuits:
+                if not provider.breaker.probe_due():
+                    continue
+                try:
+                    if provider.server:
+                        provider.server.ensure_running()  # e.g. after an idle stop
+                    provider.probe()
+                except Exception as e:
+                    logging.debug(f"{provider.name} probe failed: {e}")
+                    provider.breaker.failure()
+                    continue
+                logging.info(f"{provider.name} answers again")
+                provider.breaker.success()
+
+    def stats(self):
+        return {p.name: p.stats() for p in self.providers}
+
+    def close(self):
+        self.stopped.set()
@@ -29,9 +29,13 @@ import os
 import sys
 import time
 import math
+import queue
 import logging
+import threading
 gi.require_version("Gst", "1.0")
 from gi.repository import Gst, GLib
+from metrics import Timeline, metrics
+from audio_buffer import AudioSegment
 
 # Initialize GStreamer
 Gst.init(None)
@@ -44,6 +48,21 @@ logging.basicConfig(
         logging.StreamHandler(sys.stderr)
     ]
 )
+# GStreamer encoders by file extension, also used by encode.py
+encodings = {
+    ".aiff": "aiffenc",
+    ".mp3": "lamemp3enc",
+    ".flac": "flacenc",
+    ".gsm": "gsmsenc",
+    ".ogg": "vorbisenc ! oggmux",
+    ".ogx": "vorbisenc ! oggmux",
+    ".opus": "opusenc ! oggmux",
+    ".spx": "speexenc ! oggmux",
+    ".wav": "wavenc",
+    ".m4a": "avenc_aac ! mp4mux",
+    ".wma": "wmav2enc ! asfmuxtype=Audio",
+}
+
 def unique_file_name(file_name):
     """
     Generates a unique file name by appending numbers if the file already exists.
@@ -67,10 +86,22 @@ def unique_file_name(file_name):
     return file_name
 
 class delayRecord:
-    def __init__(self, file_name = "", threshold = None):
+    def __init__(self, file_name = "", threshold = None, long_lived = False):
+        setup_start = time.monotonic()
         # set default options
         self.recording   = False
         self.quiet_timer = self.sound_timer = time.time() # start timers
+        self.endpointer  = None # optional adaptive hangover, see endpoint.py
+        self.timeline    = Timeline() # stage timestamps, see metrics.py
+        # long-lived mode: keep the device open and cut segments from an
+        # appsink, instead of one pipeline and one file per utterance
+        self.long_lived  = long_lived
+        self.segments    = queue.Queue() # finished AudioSegments
+        self.chunks      = [] # PCM of the segment being recorded
+        self.chunk_lock  = threading.Lock()
+        self.segment_count = 0
+        self.closing     = None # GLib source id of a pending segment close
+        self.closing_timeline = None # timeline of the segment being closed
         from_options = self.process_options()
         if not file_name: file_name = from_options
         # Allow threshold override after processing options
@@ -78,25 +109,16 @@ class delayRecord:
             self.threshold = threshold
         ext = os.path.splitext(file_name)[1].lower()
         # Avoid overwriting files
-        file_name = self.file_name = unique_file_name(file_name)
+        if long_lived:
+            file_name = self.file_name = None
+            ext = ".wav"
+        else:
+            file_name = self.file_name = unique_file_name(file_name)
         
         # Create GStreamer elements
         self.pipeline = Gst.Pipeline.new("audio_pipeline")
         # recording source (alsasrc, pulsesrc, autoaudiosrc, etc.)
         self.source = Gst.ElementFactory.make("autoaudiosrc", "source")
-        encodings = {
-            ".aiff": "aiffenc",
-            ".mp3": "lamemp3enc",
-            ".flac": "flacenc",
-            ".gsm": "gsmsenc",
-            ".ogg": "vorbisenc ! oggmux",
-            ".ogx": "vorbisenc ! oggmux",
-            ".opus": "opusenc ! oggmux",
-            ".spx": "speexenc ! oggmux",
-            ".wav": "wavenc",
-            ".m4a": "avenc_aac ! mp4mux",
-            ".wma": "wmav2enc ! asfmuxtype=Audio",
-        }
         enc = encodings.get(ext) or 'wavenc'
         # vorbisenc doesn't support 16-bit rates
         rate = "" if ext[2] in "g" else self.rate
@@ -109,17 +131,80 @@ class delayRecord:
 
         delay = "ladspa-delay-so-delay-5s"
         #delay = "delay_5s"
+        if long_lived:
+            # raw PCM for AudioSegment, whatever the device rate
+            sink = "audio/x-raw,rate=16000,channels=1,format=S16LE ! " \
+                "appsink name=sink emit-signals=true sync=false async=false max-buffers=1000"
+        else:
+            sink = f"{rate} {enc} ! filesink name=fs location={file_name} async=false"
         # valve-type elements require async=off downstream
         self.pipeline = Gst.parse_launch(
-        f"{src} ! tee name=t ! {delay} name=d ! valve name=v ! {self.gstreamer} audioconvert ! queue ! audioresample ! {rate} {enc} ! filesink name=fs location={file_name} async=false t. ! queue ! level ! fakesink"
+        f"{src} ! tee name=t ! {delay} name=d ! valve name=v ! {self.gstreamer} audioconvert ! queue ! audioresample ! {sink} t. ! queue ! level ! fakesink"
         )
         self.filesink = self.pipeline.get_by_name('fs')
+        if long_lived:
+            self.pipeline.get_by_name('sink').connect('new-sample', self.on_new_sample)
         self.delay = self.pipeline.get_by_name('d')
         # Set delay properties
         self.delay.set_property("delay", self.preroll)
         self.delay.set_property("dry-wet-balance", 1.0)
         self.valve = self.pipeline.get_by_name('v')
         self.valve.set_property("drop", True)
+        self.setup_seconds = time.monotonic() - setup_start
+
+    # long-lived mode: collect PCM while the valve is open
+    def on_new_sample(self, appsink):
+        sample = appsink.emit('pull-sample')
+        if sample:
+            buffer = sample.get_buffer()
+            chunk = buffer.extract_dup(0, buffer.get_size())
+            with self.chunk_lock:
+                if self.recording or self.closing:
+                    self.chunks.append(chunk)
+        return Gst.FlowReturn.OK
+
+    # long-lived mode: end the utterance without stopping the pipeline
+    def end_segment(self):
+        self.recording = False
+        self.sound_timer = time.time()
+        if self.closing:
+            # speech resumed and ended again before the last segment was
+            # cut: both utterances go out as one segment
+            GLib.source_remove(self.closing)
+            for stage in ("speech_end", "valve_close"):
+                if stage in self.timeline.marks:
+                    self.closing_timeline.mark(stage, self.timeline.marks[stage])
+        else:
+            self.closing_timeline = self.timeline
+        self.timeline = Timeline()
+        # audio leaves the delay line `preroll` seconds late; let it drain
+        self.closing = GLib.timeout_add(int(self.preroll * 1000), self.close_segment)
+
+    # long-lived mode: cut the segment once its tail has left the delay line.
+    # If speech resumed meanwhile, the valve stays open and what follows,
+    # captured after the end of the last utterance, starts the next segment.
+    def close_segment(self):
+        self.closing = None
+        with self.chunk_lock:
+            chunks, self.chunks = self.chunks, []
+            if not self.recording:
+                self.valve.set_property("drop", True)
+        timeline, self.closing_timeline = self.closing_timeline, None
+        if chunks:
+            self.segment_count += 1
+            segment = AudioSegment(b"".join(chunks), segment_id=self.segment_count,
+                                   timeline=timeline)
+            timeline.mark("saved")
+            self.segments.put(segment)
+            logging.debug(f"Segment ready: {segment}")
+        return False # one-shot GLib timeout
+
+    # long-lived mode: next finished AudioSegment, or None on timeout
+    def get_audio_segment(self, timeout=5.0):
+        try:
+            return self.segments.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
     # handle sound-level messages 10 per second
     def monitor_levels(self, bus, message):
@@ -135,21 +220,42 @@ class delayRecord:
             # Stop recording if recording time exceeded
             if seconds_of_sound / 60 > self.minutes:
                 logging.critical('Recording time exceeded. Quitting.')
-                self.pipeline.send_event(Gst.Event.new_eos())
+                if self.long_lived:
+                    self.end_segment()
+                else:
+                    self.pipeline.send_event(Gst.Event.new_eos())
 
             # Start recording when there are sustained sound levels
             elif self.ignore < seconds_of_sound and not self.recording:
                 logging.debug("Recording started")
+                # if the last segment is still draining, it is cut when its
+                # tail is out of the delay line, not now; see close_segment()
                 self.valve.set_property("drop", False)
                 self.recording = True
+                self.timeline.mark("onset", time.monotonic() - seconds_of_sound)
+                self.timeline.mark("valve_open")
+            elif self.recording and self.endpointer and seconds_of_quiet > 0.15:
+                self.endpointer.note_pause(seconds_of_quiet)
             self.quiet_timer = reset # reset quiet timer
         else:
-            if self.recording and self.stop_after < seconds_of_quiet:
-                self.pipeline.send_event(Gst.Event.new_eos())
+            if self.recording and self.hangover(seconds_of_sound - seconds_of_quiet) < seconds_of_quiet:
+                self.timeline.mark("speech_end", time.monotonic() - seconds_of_quiet)
+                self.timeline.mark("valve_close")
+                if self.long_lived:
+                    self.end_segment()
+                else:
+                    self.pipeline.send_event(Gst.Event.new_eos())
             elif not self.recording:
                 self.sound_timer = reset # wait for sounds
                 # never stops listening, since nothing is being saved
 
+    # seconds of silence that end the recording, after seconds_of_speech
+    # from onset to the last loud level
+    def hangover(self, seconds_of_speech):
+        if not self.endpointer:
+            return self.stop_after
+        return self.endpointer.hangover(seconds_of_speech)
+
     # If loaded as a module, the parent process can call this
     def stop_recording(self):
         logging.debug("stop_recording() called")
@@ -218,8 +324,13 @@ class delayRecord:
         
         # Start playing the pipeline
         logging.debug("Starting GStreamer pipeline")
+        open_start = time.monotonic()
         ret = self.pipeline.set_state(Gst.State.PLAYING)
         logging.debug(f"Pipeline set_state(PLAYING) returned: {ret}")
+        # opening the device is part of the setup cost of a recording
+        self.setup_seconds += time.monotonic() - open_start
+        metrics.inc("device_opens_total")
+        metrics.observe("recorder_setup_seconds", self.setup_seconds)
         
         if ret == Gst.StateChangeReturn.FAILURE:
             logging.error("Failed to start pipeline")
@@ -238,6 +349,7 @@ class delayRecord:
 
         # Clean up
         logging.debug("Starting cleanup sequence")
+        teardown_start = time.monotonic()
         
         # Clean up bus connections first
         if hasattr(self, 'bus') and self.bus:
@@ -274,6 +386,7 @@ class delayRecord:
         import gc
         gc.collect()
         
+        metrics.observe("recorder_teardown_seconds", time.monotonic() - teardown_start)
         logging.debug("Cleanup completed")
 
     # Draw a VU meter in the terminal
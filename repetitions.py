@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Collapse Whisper's repetition loops ("the the the the ...", "!!!!!!!")
+
+Same results as the earlier regex version, which ran one
+re.sub(r'(.{n})(?:\1){min-1,}', r'\1' * keep) per pattern length n,
+but without backtracking. For each length n the text is compared with
+itself shifted by n characters in one big-integer XOR. A run of at
+least min repetitions shows up as a stretch of zero bytes, found with
+bytes.find(), so only real candidates are examined in Python.
+"""
+
+import re
+
+def _shift_mask(text):
+    """UTF-32 code units of text as one integer, for shifted comparisons"""
+    return int.from_bytes(text.encode("utf-32-le"), "little")
+
+def _collapse_period(text, code, length, min_repetitions, keep_repetitions):
+    """
+    One pass of the old re.sub for pattern length `length`.
+    code is _shift_mask(text). Returns the new text, or text unchanged.
+    """
+    n = len(text)
+    need = (min_repetitions - 1) * length  # chars equal to the char `length` later
+    if n - length < need:
+        return text
+    # byte 4*i..4*i+3 is zero where text[i] == text[i + length]
+    mask = (code ^ (code >> (32 * length))).to_bytes(4 * n, "little")[:4 * (n - length)]
+    zeros = bytes(4 * need)
+    pos = mask.find(zeros)
+    if pos < 0:
+        return text
+
+    out = []
+    i = 0
+    while pos >= 0:
+        c = -(-pos // 4)  # a real run starts on a character boundary
+        if c + need > n - length:
+            break
+        unit = text[c:c + length]
+        # '.' in the old pattern does not match newlines
+        if "\n" not in unit and text[c + length:c + length + need] == text[c:c + need]:
+            end = c + min_repetitions * length
+            while text.startswith(unit, end):  # greedy, like {min-1,}
+                end += length
+            out.append(text[i:c])
+            out.append(unit * keep_repetitions)
+            i = end
+            pos = mask.find(zeros, 4 * i)
+        else:
+            pos = mask.find(zeros, pos + 1)
+    if not out:
+        return text
+    out.append(text[i:])
+    return "".join(out)
+
+def remove_repetitions(text, min_repetitions=6, keep_repetitions=5):
+    """
+    Remove excessive repetitive patterns from text, keeping only a specified number of repetitions.
+
+    Args:
+        text: The input text to process
+        min_repetitions: Minimum number of repetitions to consider as excessive (default: 6)
+        keep_repetitions: Number of repetitions to keep (default: 5)
+
+    Returns:
+        Text with repetitions reduced to keep_repetitions occurrences
+    """
+    if not text:
+        return text
+
+    # Start with small pattern sizes and work up to larger ones
+    # This helps catch both single character and longer phrase repetitions
+    max_pattern_length = min(len(text) // min_repetitions, 100)  # Cap at 100 chars for performance
+
+    if min_repetitions < 2:
+        # every chunk "repeats"; not worth a fast path
+        for pattern_length in range(1, max_pattern_length + 1):
+            pattern = r'(.{' + str(pattern_length) + r'})(?:\1){' + str(min_repetitions - 1) + r',}'
+            text = re.sub(pattern, r'\1' * keep_repetitions, text)
+        return text
+
+    code = _shift_mask(text)
+    for pattern_length in range(1, max_pattern_length + 1):
+        collapsed = _collapse_period(text, code, pattern_length,
+                                     min_repetitions, keep_repetitions)
+        if collapsed is not text:
+            text = collapsed
+            code = _shift_mask(text)
+
+    return text
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Streaming partial transcription while the user is still speaking.
+
+Growing windows of the in-progress utterance are transcribed at a fixed
+cadence. Words that two consecutive hypotheses agree on are stable and
+may be typed right away; the unstable tail is fixed up by reconcile()
+when the final transcription of the segment arrives.
+"""
+
+import time
+import logging
+import threading
+import collections
+
+# finalized segment ids remembered, so late partials of them are ignored
+FINALIZED_KEPT = 64
+
+def common_prefix(a, b):
+    """Longest common prefix of two word lists"""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return a[:n]
+
+def reconcile(typed, final):
+    """
+    Work out how to turn text already typed into the final text.
+    Returns (number of backspaces, text to type after them).
+    """
+    n = 0
+    for x, y in zip(typed, final):
+        if x != y:
+            break
+        n += 1
+    return len(typed) - n, final[n:]
+
+class StreamingTranscriber:
+    def __init__(self, recorder, transcribe, emit, interval=1.0, min_audio=1.0,
+                 on_partial=None):
+        self.recorder = recorder      # needs snapshot() -> AudioSegment or None
+        self.transcribe = transcribe  # segment -> text, e.g. gettext
+        self.emit = emit              # emit(segment_id, stable, new_text) -> True if typed
+        self.on_partial = on_partial  # on_partial(segment_id, hypothesis), e.g. for endpointing
+        self.interval = interval
+        self.min_audio = min_audio
+        self.lock = threading.Lock()
+        self.hypotheses = {}  # segment_id -> previous hypothesis (word list)
+        self.typed = {}       # segment_id -> exact text already typed
+        self.suppressed = set()
+        self.finalized = collections.OrderedDict()  # used as a bounded ordered set
+        self.partials = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            snapshot = self.recorder.snapshot()
+            if not snapshot or snapshot.duration < self.min_audio:
+                continue
+            try:
+                text = self.transcribe(snapshot)
+            except Exception as e:
+                logging.debug(f"Partial transcription failed: {e}")
+                continue
+            if text:
+                self.partials += 1
+                if self.on_partial:
+                    self.on_partial(snapshot.segment_id, text)
+                self._update(snapshot.segment_id, text)
+
+    def _update(self, segment_id, text):
+        words = text.split()
+        with self.lock:
+            if segment_id in self.finalized or segment_id in self.suppressed:
+                return
+            previous = self.hypotheses.get(segment_id, [])
+            # hypotheses of utterances the recorder discarded, with nothing typed
+            for stale in [s for s in self.hypotheses if s != segment_id and s not in self.typed]:
+                del self.hypotheses[stale]
+            self.hypotheses[segment_id] = words
+            stable = " ".join(common_prefix(previous, words))
+            typed = self.typed.get(segment_id, "")
+            if len(stable) <= len(typed) or not stable.startswith(typed):
+                return
+            new_text = stable[len(typed):] + " "
+            logging.debug(f"[PARTIAL] #{segment_id}: {stable}")
+            result = self.emit(segment_id, stable, new_text)
+            if result is None:
+                # the utterance looks like a command; stop streaming it
+                self.suppressed.add(segment_id)
+            elif result:
+                self.typed[segment_id] = typed + new_text
+
+    def finalize(self, segment_id):
+        """
+        The final transcription of segment_id has arrived.
+        Returns whatever partial text was typed for it, and stops streaming it.
+        """
+        with self.lock:
+            self._forget(segment_id)
+            return self.typed.pop(segment_id, "")
+
+    def merge(self, segment_id, other_id):
+        """
+        Segment other_id was merged onto the end of segment_id before it
+        was transcribed: the final text of segment_id now covers both, so
+        it takes over the text typed for other_id.
+        """
+        with self.lock:
+            self._forget(other_id)
+            other = self.typed.pop(other_id, "")
+            if other:
+                self.typed[segment_id] = self.typed.get(segment_id, "") + other
+
+    def _forget(self, segment_id):
+        self.finalized[segment_id] = True
+        while len(self.finalized) > FINALIZED_KEPT:
+            self.finalized.popitem(last=False)
+        self.hypotheses.pop(segment_id, None)
+        self.suppressed.discard(segment_id)
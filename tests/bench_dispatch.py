@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## bench_dispatch.py
+##
+## Per-utterance command dispatch cost as the command set grows.
+## Compares the old scan (re.search on each pattern string in turn)
+## with the compiled CommandRegistry.
+##
+## Usage: python tests/bench_dispatch.py [utterances per size]
+##
+import os
+import re
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dispatcher import CommandRegistry
+
+utterances = [
+    "new paragraph",
+    "computer, open terminal",
+    "samantha, take a picture",
+    "this is ordinary dictation that matches no command at all",
+    "computer what is the capital of france",
+]
+
+def make_commands(n):
+    """n user-defined commands in the style of the actions table"""
+    commands = {}
+    for i in range(n):
+        commands[rf"^(peter|samantha|computer)?.?,? ?(run|do) (the )?macro {i}\b"] = lambda q: None
+    commands[r"^new paragraph.?$"] = lambda q: None
+    commands[r"^(peter|samantha|computer).?,? (run|open|start|launch)(up)?( a| the)? "] = lambda q: None
+    commands[r"^(peter|samantha|computer)?.?,? ?(take|snap) (a|the|another) (photo|picture)"] = lambda q: None
+    commands[r"^(peter|samantha|computer).?,? "] = lambda q: None
+    return commands
+
+def old_scan(commands, tl):
+    for pattern, action in commands.items():
+        if s := re.search(pattern, tl):
+            return action, tl[s.end():]
+    return None
+
+def bench(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for tl in utterances:
+            fn(tl)
+    return (time.perf_counter() - start) / (rounds * len(utterances)) * 1e6
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'commands':>8} {'scan us':>10} {'registry us':>12} {'speedup':>8}")
+    for n in (10, 50, 100, 200, 500, 1000):
+        commands = make_commands(n)
+        registry = CommandRegistry(commands)
+        registry.compile()
+        # both must pick the same command
+        for tl in utterances:
+            old, new = old_scan(commands, tl), registry.match(tl)
+            assert (old and old[0]) == (new and new[0].handler), tl
+        scan = bench(lambda tl: old_scan(commands, tl), rounds)
+        compiled = bench(registry.match, rounds)
+        print(f"{len(commands):>8} {scan:>10.1f} {compiled:>12.1f} {scan / compiled:>7.1f}x")
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## bench_latency.py
+##
+## End-to-end latency benchmark for whisper_cpp_client.py.
+##
+## Replays a corpus of WAV files through record_to_queue(), the
+## transcription pipeline and gettext(), dispatched by main_async() (the
+## default asyncio core) or by feed_transcriber() and transcribe() (the
+## threaded core, ASYNC_CORE=false), against the stub whisper.cpp / chat
+## server in stub_server.py. The microphone is replaced by a fake
+## recorder, key injection by a fake pyautogui that timestamps every
+## write, and speech by a silent mimic3_client, so no audio stack is
+## needed. Reports p50/p95/p99 time from end of speech to text emitted,
+## and throughput in segments per second, as JSON that can be compared
+## between commits. Exits with status 1 if any segment did not complete.
+##
+## Usage:
+##   python tests/bench_latency.py [--corpus dir_of_wavs] [--latency 0.2]
+##       [--jitter 0.05] [--workers 1] [--gap 0.5] [--coalesce] [--core async|threaded]
+##       [--output result.json]
+##       [--compare previous.json]
+##
+import os
+import io
+import sys
+import json
+import glob
+import time
+import types
+import asyncio
+import argparse
+import threading
+import subprocess
+import contextlib
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stub_server import start_stub_server
+from audio_buffer import AudioSegment
+
+injected = []  # monotonic time of every text injection
+
+def fake_pyautogui():
+    """Stand-in for pyautogui that records when text would be typed"""
+    module = types.ModuleType("pyautogui")
+    module.write = lambda text, *args, **kwargs: injected.append(time.monotonic())
+    for name in ("hotkey", "press", "click", "middleClick", "rightClick"):
+        setattr(module, name, lambda *args, **kwargs: None)
+    module.prompt = lambda *args, **kwargs: None
+    return module
+
+def fake_mimic3_client():
+    """Stand-in for mimic3_client, which needs GStreamer: says nothing"""
+    module = types.ModuleType("mimic3_client")
+    module.say = lambda *args, **kwargs: None
+    module.shutup = lambda *args, **kwargs: None
+    return module
+
+def load_corpus(directory, count, seconds):
+    """WAV files from directory, or a synthetic low hum if none are given"""
+    if directory:
+        files = sorted(glob.glob(os.path.join(directory, "*.wav")))
+        if not files:
+            sys.exit(f"No .wav files in {directory}")
+        return [AudioSegment.from_wav(f) for f in files][:count or None]
+    pcm = b"\x00\x01" * int(16000 * seconds)
+    return [AudioSegment(pcm) for _ in range(count)]
+
+class ReplayRecorder:
+    """Replaces PersistentAudioRecorder: hands out corpus segments at a fixed pace"""
+    def __init__(self, segments, gap, **kwargs):
+        self.segments = list(segments)
+        self.gap = gap
+        self.end_times = []
+
+    def start(self):
+        return True
+
+    def snapshot(self):
+        return None
+
+    def get_audio_segment(self, timeout=5.0):
+        if not self.segments:
+            time.sleep(min(timeout, 0.5))
+            return None
+        time.sleep(self.gap)
+        segment = self.segments.pop(0)
+        # end of speech is now
+        segment.end_time = time.monotonic()
+        segment.segment_id = len(self.end_times) + 1
+        self.end_times.append(segment.end_time)
+        return segment
+
+    def stop(self):
+        pass
+
+def percentile(values, p):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(k, len(values) - 1)]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except Exception:
+        return ""
+
+def run(args):
+    server = start_stub_server(0, args.latency, args.jitter, args.text, args.reply)
+    base = f"http://127.0.0.1:{server.server_port}"
+    os.environ.update({
+        "WHISPER_CPP_URL": f"{base}/inference",
+        "FALLBACK_CHAT_URL": f"{base}/v1",
+        "USE_PERSISTENT_RECORDER": "true",
+        "TRANSCRIBE_WORKERS": str(args.workers),
+        "QUIET": "true",
+        "INJECT_BACKEND": "pyautogui",
+        "INJECT_PASTE_OVER": "0",
+        "COALESCE": "true" if args.coalesce else "false",
+        "ASYNC_CORE": "true" if args.core == "async" else "false",
+    })
+    for name in ("OPENAI_API_KEY", "GENAI_TOKEN", "STREAMING", "NO_KEYS"):
+        os.environ.pop(name, None)
+    sys.modules["pyautogui"] = fake_pyautogui()
+    sys.modules["mimic3_client"] = fake_mimic3_client()
+
+    segments = load_corpus(args.corpus, args.count, args.seconds)
+    recorder = ReplayRecorder(segments, args.gap)
+    # the client prints dictated text to stdout in quiet mode
+    with contextlib.redirect_stdout(io.StringIO()):
+        import whisper_cpp_client as client
+        from pipeline import TranscriptionPipeline
+        client.PersistentAudioRecorder = lambda **kwargs: recorder
+        deadline = time.monotonic() + args.timeout
+        def stop_when_done():
+            while len(injected) < len(segments) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            client.running = False  # the recorder returns, which ends main_async()
+        if args.core == "async":
+            # main_async() installs signal handlers, so it runs on the main thread
+            threading.Thread(target=stop_when_done, daemon=True).start()
+            asyncio.run(client.main_async())
+        else:
+            client.transcriber = TranscriptionPipeline(
+                client.cached_gettext, workers=client.transcribe_workers,
+                transcribe_batch=client.cached_gettext_batch)
+            for target in (client.feed_transcriber, client.record_to_queue, client.transcribe):
+                threading.Thread(target=target, daemon=True).start()
+            stop_when_done()
+
+    done = min(len(injected), len(recorder.end_times))
+    latencies = [(injected[i] - recorder.end_times[i]) * 1000 for i in range(done)]
+    span = (injected[done - 1] - recorder.end_times[0]) if done else 0
+    return {
+        "commit": git_commit(),
+        "config": {"latency": args.latency, "jitter": args.jitter, "workers": args.workers,
+                   "gap": args.gap, "corpus": args.corpus or f"synthetic {args.seconds}s",
+                   "text": args.text, "coalesce": args.coalesce, "core": args.core},
+        "corpus": len(segments),
+        "segments": len(recorder.end_times),
+        "completed": done,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / done if done else None,
+            "max": max(latencies) if latencies else None,
+        },
+        "throughput_sps": done / span if span > 0 else None,
+        "stub_requests": server.requests,
+        "bytes_uploaded": server.bytes_received,
+        "pipeline": client.transcriber.stats(),
+    }
+
+def compare(result, previous):
+    print(f"{'metric':<16} {'previous':>10} {'current':>10} {'change':>8}", file=sys.stderr)
+    rows = [(f"{k} ms", previous["latency_ms"].get(k), result["latency_ms"].get(k))
+            for k in ("p50", "p95", "p99")]
+    rows.append(("segments/s", previous.get("throughput_sps"), result.get("throughput_sps")))
+    for name, old, new in rows:
+        if old and new:
+            print(f"{name:<16} {old:>10.1f} {new:>10.1f} {100 * (new - old) / old:>+7.1f}%",
+                  file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end dictation latency benchmark")
+    parser.add_argument("--corpus", help="directory of 16 kHz mono WAV files")
+    parser.add_argument("--count", type=int, default=50, help="segments (synthetic corpus)")
+    parser.add_argument("--seconds", type=float, default=1.5, help="synthetic segment length")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub server seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="stub server +/- seconds")
+    parser.add_argument("--workers", type=int, default=1, help="TRANSCRIBE_WORKERS")
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between end of speech events")
+    parser.add_argument("--coalesce", action="store_true", help="COALESCE short waiting segments")
+    parser.add_argument("--core", choices=("async", "threaded"), default="async",
+                        help="dispatch core: ASYNC_CORE=true (the default) or false")
+    parser.add_argument("--text", default=" This is a benchmark sentence.",
+                        help="transcript the stub returns (a 'Computer, ...' prompt exercises chat)")
+    parser.add_argument("--reply", default="Here is a short answer.", help="stub chat reply")
+    parser.add_argument("--timeout", type=float, default=120, help="give up after seconds")
+    parser.add_argument("--output", help="write the JSON result here")
+    parser.add_argument("--compare", help="previous JSON result to compare with")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    if result["completed"] < result["corpus"]:
+        sys.exit(f"Only {result['completed']} of {result['corpus']} segments completed")
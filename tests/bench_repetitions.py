@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## bench_repetitions.py
+##
+## remove_repetitions on normal transcripts and on long hallucination
+## loops, compared with the original per-length regex passes.
+##
+## Usage: python tests/bench_repetitions.py
+##
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from repetitions import remove_repetitions
+from test_repetitions import remove_repetitions_regex
+
+inputs = {
+    "sentence": "Computer, open a web browser and search for places to eat nearby. ",
+    "paragraph": "This is ordinary dictation without any loops in it at all. " * 1 +
+                 "It goes on for a while, the way a long dictated paragraph does, " +
+                 "with commas, clauses and the occasional number like 42. " * 3,
+    "word loop": "I think that " + "the " * 500,
+    "phrase loop": "Okay. " + "Thank you for watching. " * 200,
+    "char loop": "Wow" + "!" * 2000,
+    "mixed loops": ("hmm " * 50 + "la la " * 80 + "Titulky vytvořil JohnyX. " * 40) * 2,
+}
+
+def bench(fn, text):
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        fn(text)
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > 0.3:
+            return elapsed / rounds * 1e3
+
+if __name__ == '__main__':
+    print(f"{'input':<12} {'chars':>6} {'regex ms':>10} {'linear ms':>10} {'speedup':>8}")
+    for name, text in inputs.items():
+        assert remove_repetitions(text) == remove_repetitions_regex(text)
+        old = bench(remove_repetitions_regex, text)
+        new = bench(remove_repetitions, text)
+        print(f"{name:<12} {len(text):>6} {old:>10.3f} {new:>10.3f} {old / new:>7.1f}x")
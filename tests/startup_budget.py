@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## startup_budget.py
+##
+## Cold-start budget for whisper_cpp_client.py.
+##
+## Starts the client under `python -X importtime` with STARTUP_REPORT=true,
+## waits for it to report that it is listening, then stops it. Prints the
+## slowest imports, like `-X importtime` sorted by cumulative time, and
+## the modules the client imported on demand. Exits with status 1 if the
+## time from launch to listening is over the budget, so it can gate
+## commits that add start-up imports.
+##
+## The client runs in its default (speaking) mode unless --quiet is given.
+## That needs a working microphone, like the client itself. With
+## --no-audio the client module is only imported, which runs all of its
+## start-up code but not the recorder, and the check also fails if any of
+## the optional subsystems in DEFERRED was imported. test_startup.py runs
+## that check under pytest.
+##
+## Usage:
+##   python tests/startup_budget.py [--budget 3.0] [--top 15] [--timeout 30]
+##                                  [--quiet] [--no-audio]
+##
+import os
+import re
+import sys
+import time
+import signal
+import argparse
+import subprocess
+import threading
+
+CLIENT = os.path.join(os.path.dirname(__file__), "..", "whisper_cpp_client.py")
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+# libraries the client imports on first use only; none of them at start-up
+DEFERRED = ("gi", "openai", "pyautogui", "numpy", "mimic3_client", "on_screen",
+            "google.generativeai", "PIL", "record", "persistent_record")
+# import the client without recording, then report like STARTUP_REPORT does
+IMPORT_ONLY = """
+import sys, time
+import whisper_cpp_client as client
+elapsed = time.monotonic() - client.startup_time
+print(f"[LISTENING] {elapsed:.3f}s after start (import only)", file=sys.stderr, flush=True)
+"""
+
+def run_client(timeout, quiet=False, no_audio=False):
+    """Start the client; returns (seconds to listening or None, stderr lines)"""
+    env = dict(os.environ, STARTUP_REPORT="true", NO_KEYS="true", PYTHONUNBUFFERED="1")
+    if quiet:
+        env["QUIET"] = "true"
+    args = ["-c", IMPORT_ONLY] if no_audio else [CLIENT]
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, "-X", "importtime"] + args, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True,
+                               cwd=os.path.dirname(CLIENT))
+    lines = []
+    listening = threading.Event()
+    def read():
+        for line in process.stderr:
+            lines.append(line.rstrip("\n"))
+            if line.startswith("[LISTENING]"):
+                listening.set()
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    elapsed = time.monotonic() - start if listening.wait(timeout) else None
+    process.send_signal(signal.SIGINT)
+    try:
+        process.communicate("\n", timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    reader.join(2)
+    return elapsed, lines
+
+def deferred_imports(lines):
+    """Modules in DEFERRED that were imported, going by the -X importtime lines"""
+    imported = {match.group(4) for match in map(IMPORT_LINE.match, lines) if match}
+    return [name for name in DEFERRED if name in imported]
+
+def slowest_imports(lines, top):
+    """(cumulative seconds, self seconds, module) of the top-level-most slow imports"""
+    imports = []
+    for line in lines:
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((int(cumulative) / 1e6, int(own) / 1e6, len(indent), module))
+    imports.sort(reverse=True)
+    return imports[:top]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="whisper_cpp_client cold-start budget")
+    parser.add_argument("--budget", type=float, default=3.0, help="seconds from launch to listening")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to show")
+    parser.add_argument("--timeout", type=float, default=30, help="give up after seconds")
+    parser.add_argument("--quiet", action="store_true", help="run with QUIET=true")
+    parser.add_argument("--no-audio", action="store_true",
+                        help="import the client instead of running it; no microphone needed")
+    args = parser.parse_args()
+
+    elapsed, lines = run_client(args.timeout, args.quiet, args.no_audio)
+    print(f"{'cumulative':>10} {'self':>8}  module")
+    for cumulative, own, depth, module in slowest_imports(lines, args.top):
+        print(f"{cumulative:>9.3f}s {own:>7.3f}s  {'  ' * (depth // 2)}{module}")
+    for line in lines:
+        if line.startswith("[LISTENING]"):
+            print(line)
+    if elapsed is None:
+        print(f"FAIL: not listening after {args.timeout}s", file=sys.stderr)
+        print("\n".join(l for l in lines if not IMPORT_LINE.match(l))[-2000:], file=sys.stderr)
+        sys.exit(1)
+    deferred = deferred_imports(lines) if args.no_audio else []
+    if deferred:
+        print(f"FAIL: imported at start-up: {', '.join(deferred)}", file=sys.stderr)
+    verdict = "ok" if elapsed <= args.budget else "FAIL"
+    print(f"{verdict}: listening {elapsed:.2f}s after launch (budget {args.budget:.2f}s)")
+    sys.exit(0 if elapsed <= args.budget and not deferred else 1)
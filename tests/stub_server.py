@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## stub_server.py
+##
+## Stand-in for whisper-server's /inference and an OpenAI-compatible
+## /v1/chat/completions endpoint, with configurable latency and jitter.
+## With response_format=verbose_json, every stretch of non-silent audio
+## gets the stub text, with word timestamps, so coalesced requests can be
+## split again. Used by bench_latency.py; can also be run on its own:
+##
+##   python tests/stub_server.py --port 7777 --latency 0.3 --jitter 0.1
+##
+import io
+import re
+import sys
+import json
+import time
+import wave
+import array
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def speech_runs(body, min_gap=0.3):
+    """(start, end) seconds of the non-silent stretches of the WAV in a multipart body"""
+    offset = body.find(b"RIFF")
+    if offset < 0:
+        return []
+    with wave.open(io.BytesIO(body[offset:]), "rb") as wav:
+        rate = wav.getframerate()
+        samples = array.array("h", wav.readframes(wav.getnframes()))
+    block = rate // 100  # 10 ms
+    runs = []
+    for i in range(0, len(samples), block):
+        if max(map(abs, samples[i:i + block]), default=0) == 0:
+            continue
+        start, end = i / rate, (i + block) / rate
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
+
+def verbose_json(text, runs):
+    """whisper-server's verbose_json: one segment of text per run, words spread evenly"""
+    words = re.findall(r" ?\S+", text)
+    segments = []
+    for n, (start, end) in enumerate(runs):
+        step = (end - start) / max(len(words), 1)
+        segments.append({"id": n, "text": text, "start": start, "end": end, "words": [
+            {"word": word, "start": start + i * step, "end": start + (i + 1) * step}
+            for i, word in enumerate(words)]})
+    return {"text": text * len(runs), "segments": segments}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like whisper-server
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _delay(self):
+        server = self.server
+        time.sleep(max(server.latency + random.uniform(-server.jitter, server.jitter), 0))
+
+    def _reply(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # readiness probe
+        self._reply({"status": "ok"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += len(body)
+        self._delay()
+        if self.path.endswith("/inference"):
+            name = re.search(rb'filename="([^"]*)"', body)
+            if re.search(rb'name="response_format"\r\n\r\nverbose_json', body):
+                self._reply(verbose_json(self.server.text, speech_runs(body)))
+                return
+            self._reply({"text": self.server.text,
+                         "file": name.group(1).decode() if name else ""})
+        elif self.path.endswith("/chat/completions"):
+            self._reply({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()),
+                "model": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.server.reply}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        else:
+            self._reply({"error": "not found"}, 404)
+
+def start_stub_server(port=0, latency=0.2, jitter=0.05,
+                      text=" This is a benchmark sentence.",
+                      reply="Here is a short answer."):
+    """Start the stub in a background thread; returns the server (see .server_port)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency, server.jitter = latency, jitter
+    server.text, server.reply = text, reply
+    server.lock = threading.Lock()
+    server.requests = server.bytes_received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub whisper.cpp and chat server")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="+/- seconds")
+    parser.add_argument("--text", default=" This is a benchmark sentence.")
+    parser.add_argument("--reply", default="Here is a short answer.")
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.latency, args.jitter, args.text, args.reply)
+    print(f"Stub server on http://127.0.0.1:{server.server_port}/inference", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
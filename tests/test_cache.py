@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## test_cache.py
+##
+## TranscriptionCache must recognise a repeated short command in segments
+## as the recorders deliver them: the speech between a preroll and a
+## silence hangover whose lengths differ from one utterance to the next.
+## ResponseCache must answer a prompt once it has been generated often
+## enough, whether or not the replies differ.
+##
+## Usage: pytest tests/test_cache.py
+##
+import os
+import sys
+import pytest
+try:
+    import numpy as np
+except ImportError:
+    np = None
+needs_numpy = pytest.mark.skipif(np is None, reason="TranscriptionCache requires numpy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from audio_buffer import AudioSegment
+from cache import TranscriptionCache, ResponseCache
+
+RATE = 16000
+
+def speech(seconds, pitch, seed):
+    """A voiced sound: harmonics of a gliding pitch under a syllable envelope"""
+    t = np.arange(int(RATE * seconds)) / RATE
+    f0 = pitch * (1 + 0.2 * t / seconds)
+    phase = 2 * np.pi * np.cumsum(f0) / RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 3 * t) ** 2
+    noise = np.random.default_rng(seed).normal(0, 0.02, len(t))
+    return 6000 * (voice * envelope + noise)
+
+def padded(voice, preroll, hangover, seed):
+    """voice between preroll and hangover seconds of quiet room noise"""
+    rng = np.random.default_rng(seed)
+    room = lambda seconds: rng.normal(0, 20, int(RATE * seconds))
+    samples = np.concatenate([room(preroll), voice, room(hangover)])
+    return AudioSegment(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+
+@needs_numpy
+def test_padded_repeat_hits():
+    cache = TranscriptionCache(max_duration=1.5)
+    first = padded(speech(0.8, 140, 1), preroll=0.6, hangover=2.0, seed=2)
+    assert first.duration > cache.max_duration
+    assert cache.lookup(first, "ctx") == ("miss", None)
+    cache.store(first, "ctx", "New paragraph.")
+    # the same command again, with an adaptive hangover and a shorter preroll
+    again = padded(speech(0.8, 140, 3), preroll=0.4, hangover=0.9, seed=4)
+    assert cache.lookup(again, "ctx") == ("hit", "New paragraph.")
+    assert cache.hit_rate() == 0.5
+
+@needs_numpy
+def test_other_speech_misses():
+    cache = TranscriptionCache(max_duration=1.5)
+    cache.store(padded(speech(0.8, 140, 1), 0.6, 2.0, 2), "ctx", "New paragraph.")
+    longer = padded(speech(1.2, 220, 5), 0.6, 2.0, 6)
+    assert cache.lookup(longer, "ctx") == ("miss", None)
+    assert cache.lookup(padded(speech(0.8, 140, 1), 0.6, 2.0, 2), "other") == ("miss", None)
+
+@needs_numpy
+def test_long_speech_is_uncacheable():
+    cache = TranscriptionCache(max_duration=1.5)
+    dictation = padded(speech(3.0, 140, 7), 0.6, 2.0, 8)
+    assert cache.lookup(dictation, "ctx") == ("uncacheable", None)
+    cache.store(dictation, "ctx", "A long sentence.")
+    assert len(cache.entries) == 0
+    assert cache.hits == cache.misses == 0
+
+def test_response_variants_rotate():
+    cache = ResponseCache(variants=2)
+    cache.store("tell me a joke", [], "Knock knock.", 2.0)
+    assert cache.lookup("Tell me a joke!", []) is None  # one more to collect
+    cache.store("tell me a joke", [], "Why did the chicken...", 4.0)
+    assert [cache.lookup("tell me a joke", []) for _ in range(3)] == \
+        ["Knock knock.", "Why did the chicken...", "Knock knock."]
+    assert cache.seconds_saved == pytest.approx(9.0)
+
+def test_response_same_reply_hits():
+    # a provider that always answers the same never yields a second variant
+    cache = ResponseCache(variants=3)
+    for _ in range(3):
+        assert cache.lookup("hello", []) is None
+        cache.store("hello", [], "Hi there!", 1.0)
+    assert cache.lookup("hello", []) == "Hi there!"
+    assert cache.lookup("hello", []) == "Hi there!"
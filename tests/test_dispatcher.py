@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## test_dispatcher.py
+##
+## CommandRegistry merges commands into alternation groups. Commands with
+## named groups must still compile and match in table order, whether the
+## names differ or repeat from one command to the next. Only a whole
+## command that is not open-ended counts as complete for the endpointer.
+##
+## Usage: pytest tests/test_dispatcher.py
+##
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dispatcher import CommandRegistry, sends_keys, open_ended, is_complete_command
+
+def registry(patterns):
+    return CommandRegistry({pattern: (lambda q, p=pattern: p) for pattern in patterns})
+
+def matched(registry, text):
+    hit = registry.match(text)
+    return (hit[0].pattern, hit[1]) if hit else None
+
+def test_distinct_named_groups():
+    commands = registry([r"^open (?P<app>\w+)", r"^close (?P<window>\w+)", r"^quit"])
+    commands.compile()
+    assert len(commands.groups) == 1
+    assert matched(commands, "close editor now") == (r"^close (?P<window>\w+)", " now")
+    assert matched(commands, "open terminal") == (r"^open (?P<app>\w+)", "")
+
+def test_repeated_named_group():
+    commands = registry([r"^open (?P<app>\w+)", r"^close (?P<app>\w+)", r"^kill (?P<app>\w+)"])
+    assert matched(commands, "open terminal") == (r"^open (?P<app>\w+)", "")
+    assert matched(commands, "close terminal") == (r"^close (?P<app>\w+)", "")
+    assert matched(commands, "kill terminal please") == (r"^kill (?P<app>\w+)", " please")
+    assert matched(commands, "start terminal") is None
+    assert len(commands.groups) == 3
+
+def test_table_order_across_groups():
+    # the first command in table order wins, even when split into groups
+    commands = registry([r"^(?P<x>go) home", r"^(?P<x>go) ", r"^go home"])
+    assert matched(commands, "go home") == (r"^(?P<x>go) home", "")
+    assert matched(commands, "go away") == (r"^(?P<x>go) ", "away")
+
+def test_complete_command():
+    actions = CommandRegistry({
+        r"^left click.?$": sends_keys(lambda q: None),
+        r"^computer.?,? search( the web)? for ": lambda q: None,
+        r"^computer.?,? ": open_ended(lambda q: None),
+    })
+    assert is_complete_command("left click", [actions])
+    assert not is_complete_command("left click here", [actions])
+    assert not is_complete_command("computer, search the web for", [actions])
+    assert not is_complete_command("computer, ", [actions])
+    assert is_complete_command("left click", [CommandRegistry(), actions])
+
+def test_complete_command_skips_key_commands():
+    hotkeys = CommandRegistry({r"^select all.?$": sends_keys(lambda q: None)}, skip_keys=True)
+    assert not is_complete_command("select all", [hotkeys])
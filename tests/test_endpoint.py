@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## test_endpoint.py
+##
+## The adaptive endpointer ends an utterance at once only for a whole
+## command that takes no more words. A chat prompt that starts with a
+## wake word must keep the full hangover through a mid-sentence pause,
+## and so must long dictation, which Whisper punctuates throughout.
+## Commands come from the real tables in whisper_cpp_client.py.
+##
+## Usage: pytest tests/test_endpoint.py
+##
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from endpoint import Endpointer
+
+@pytest.fixture(scope="module")
+def client():
+    """whisper_cpp_client, with hotkeys; importing it starts nothing but the injector"""
+    pytest.importorskip("requests")
+    os.environ.pop("NO_KEYS", None)
+    import whisper_cpp_client
+    return whisper_cpp_client
+
+def hangover(partial, speech_seconds=3.0, is_command=None):
+    endpointer = Endpointer(stop_after=2.2, min_stop_after=0.3, is_command=is_command)
+    endpointer.set_partial(1, partial)
+    return endpointer.hangover(speech_seconds, 1)
+
+def test_commands_end_at_once(client):
+    for partial in ("New paragraph.", "select all", "Computer, close window.",
+                    "Stop dictation.", "left click"):
+        assert hangover(partial, is_command=client.is_complete_command) == 0.3, partial
+
+def test_chat_prompt_pause(client):
+    # "Computer, write me a long story about ... a dragon": paused after "about"
+    for partial in ("Computer, write me a long story about", "Computer,", "computer"):
+        assert hangover(partial, is_command=client.is_complete_command) == 2.2, partial
+
+def test_command_with_more_words(client):
+    # a search needs its query; text before or after a hotkey is dictation
+    for partial in ("Computer, search the web for", "new paragraph and then some more",
+                    "I said select all of them"):
+        assert hangover(partial, is_command=client.is_complete_command) == 2.2, partial
+
+def test_long_dictation_keeps_full_pause():
+    # Whisper punctuates every partial; a pause in long dictation is not its end
+    assert hangover("So the first thing we did was to measure it.", 6.0) == 2.2
+    assert hangover("Okay.", 2.0) == pytest.approx(1.1)  # a short sentence ends early
+    assert hangover("", 0.5) == pytest.approx(1.32)  # so does a short utterance
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## test_repetitions.py
+##
+## Property tests: the linear-time remove_repetitions must give exactly
+## the same results as the original regex implementation.
+##
+## Usage: pytest tests/test_repetitions.py
+##
+import os
+import re
+import sys
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from repetitions import remove_repetitions
+
+def remove_repetitions_regex(text, min_repetitions=6, keep_repetitions=5):
+    """The original implementation, kept as the reference"""
+    if not text:
+        return text
+    max_pattern_length = min(len(text) // min_repetitions, 100)
+    for pattern_length in range(1, max_pattern_length + 1):
+        pattern = r'(.{' + str(pattern_length) + r'})(?:\1){' + str(min_repetitions - 1) + r',}'
+        replacement = r'\1' * keep_repetitions
+        text = re.sub(pattern, replacement, text)
+    return text
+
+def random_text(rng):
+    """Random text built from repeated chunks, so that loops are common"""
+    alphabet = rng.choice(["ab", "abc", "ab \n", "the cat. \n", "ěščř ab"])
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        unit = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 6)))
+        parts.append(unit * rng.randint(1, 12))
+        parts.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4))))
+    return "".join(parts)
+
+def check(text, min_repetitions=6, keep_repetitions=5):
+    expected = remove_repetitions_regex(text, min_repetitions, keep_repetitions)
+    got = remove_repetitions(text, min_repetitions, keep_repetitions)
+    assert got == expected, (text, min_repetitions, keep_repetitions, got, expected)
+
+def test_examples():
+    check("")
+    check("hello world")
+    check("the " * 40)
+    check("!" * 300)
+    check("ha" * 7 + " ok")
+    check("Thank you. " * 30 + "Bye.")
+    check("a\n" * 20)
+    check("\n" * 20)
+    check("ab" * 3, 2, 1)
+    check("x" * 10, 1, 1)
+
+def test_random_defaults():
+    rng = random.Random(1)
+    for _ in range(3000):
+        check(random_text(rng))
+
+def test_random_settings():
+    rng = random.Random(2)
+    for _ in range(3000):
+        min_repetitions = rng.randint(2, 8)
+        check(random_text(rng), min_repetitions, rng.randint(0, min_repetitions))
+
+def test_long_loops():
+    rng = random.Random(3)
+    for _ in range(50):
+        unit = "".join(rng.choice("abc ") for _ in range(rng.randint(1, 40)))
+        check("Intro text. " + unit * rng.randint(5, 200) + " outro")
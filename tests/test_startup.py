@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## test_startup.py
+##
+## Start-up budget without audio hardware: import whisper_cpp_client in
+## its default (speaking) mode, as startup_budget.py --no-audio does, and
+## check that it is quick and imports none of the optional subsystems,
+## TTS included.
+##
+## Usage: pytest tests/test_startup.py
+##
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.dirname(__file__))
+import startup_budget
+
+BUDGET = 3.0  # seconds from launch to the end of the client's start-up code
+
+def test_import_budget():
+    pytest.importorskip("requests")  # the one start-up dependency imported eagerly
+    elapsed, lines = startup_budget.run_client(timeout=30, no_audio=True)
+    assert elapsed is not None, "\n".join(lines[-20:])
+    assert startup_budget.deferred_imports(lines) == []
+    assert elapsed <= BUDGET, f"{elapsed:.2f}s after launch"
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Pooled, keep-alive HTTP transport for the whisper.cpp /inference backend
+One session per backend, so TCP and HTTP setup is paid once, not per utterance
+"""
+
+import time
+import random
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+# gateway errors are safe to retry; whisper.cpp transcription is idempotent
+RETRY_STATUS = (502, 503, 504)
+
+class InferenceTransport:
+    def __init__(self, url, pool_size=2, connect_timeout=3.05, read_timeout=60,
+                 retries=2, backoff=0.2):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.requests_sent = 0
+        self.retried = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _pool(self):
+        """The urllib3 connection pool serving self.url"""
+        adapter = self.session.get_adapter(self.url)
+        return adapter.poolmanager.connection_from_url(self.url)
+
+    @property
+    def connections_opened(self):
+        return self._pool().num_connections
+
+    @property
+    def reused_connections(self):
+        """Requests that went out on an already-open keep-alive connection"""
+        pool = self._pool()
+        return max(pool.num_requests - pool.num_connections, 0)
+
+    def _sleep_before_retry(self, attempt):
+        # exponential backoff with full jitter
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        logging.debug(f"Retrying {self.url} in {delay:.2f}s (attempt {attempt + 2})")
+        self.retried += 1
+        time.sleep(delay)
+
+    def post(self, files=None, data=None) -> requests.Response:
+        """
+        POST to the backend with connect/read deadlines.
+        Connection failures and gateway errors are retried with jitter;
+        read timeouts are not, since the server may still be decoding.
+        """
+        timeout = (self.connect_timeout, self.read_timeout)
+        for attempt in range(self.retries + 1):
+            self.requests_sent += 1
+            try:
+                response = self.session.post(self.url, files=files, data=data,
+                                             timeout=timeout)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ConnectTimeout) as e:
+                if attempt >= self.retries:
+                    raise
+                logging.debug(f"Connection to {self.url} failed: {e}")
+                self._sleep_before_retry(attempt)
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                logging.debug(f"{self.url} returned {response.status_code}")
+                self._sleep_before_retry(attempt)
+                continue
+            response.raise_for_status()
+            logging.debug(f"Transport: {self.requests_sent} requests, "
+                          f"{self.reused_connections} on reused connections")
+            return response
+
+    def close(self):
+        self.session.close()
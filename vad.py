@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Voice-activity detectors for the recorders
+
+LevelVAD is the original detector: one RMS value from the GStreamer
+level element every 100 ms, compared to a fixed threshold.
+NumpyVAD works on the raw appsink frames in batches. It combines frame
+energy, zero-crossing rate and speech-band energy ratio with an adaptive
+noise floor, so fans, keyboards and HVAC do not open segments.
+"""
+
+import logging
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class LevelVAD:
+    """Speech when the level element's RMS is above threshold (dB)"""
+    uses_frames = False
+
+    def __init__(self, threshold=-30):
+        self.threshold = threshold
+        self.rejected_bursts = 0
+
+    def is_speech(self, rms):
+        return rms > self.threshold
+
+class NumpyVAD:
+    """Frame-based detector fed with raw S16LE PCM chunks from the appsink"""
+    uses_frames = True
+
+    def __init__(self, threshold=-30, sample_rate=16000, frame_ms=20,
+                 snr_db=10.0, zcr_range=(0.02, 0.35), min_band_ratio=0.6,
+                 ignore=0.3, floor_rise=0.02, floor_creep=0.001):
+        if np is None:
+            raise ImportError("NumpyVAD requires numpy")
+        self.threshold = threshold     # absolute minimum level (dBFS)
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.snr_db = snr_db           # speech must be this far above the noise floor
+        self.zcr_range = zcr_range     # voiced speech has a moderate zero-crossing rate
+        self.min_band_ratio = min_band_ratio
+        self.floor_rise = floor_rise   # how fast the noise floor follows rising noise
+        self.floor_creep = floor_creep # ...and follows sustained loud sound
+        self.noise_floor = threshold - snr_db
+        self.pending = b""
+
+        # speech band 150-4000 Hz as an rfft bin mask
+        freqs = np.fft.rfftfreq(self.frame_len, 1.0 / sample_rate)
+        self.band = (freqs >= 150) & (freqs <= 4000)
+        self.window = np.hanning(self.frame_len)
+
+        # loud noise that did not count as speech
+        self.burst_frames = int(ignore * 1000 / frame_ms)
+        self.loud_run = 0
+        self.rejected_frames = 0
+        self.rejected_bursts = 0
+
+    def frames(self, chunk):
+        """Split PCM into a (frames, frame_len) float array, keeping any remainder"""
+        data = self.pending + chunk
+        usable = len(data) // (2 * self.frame_len) * 2 * self.frame_len
+        self.pending = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+        return samples.reshape(-1, self.frame_len)
+
+    def classify(self, frames):
+        """Return a boolean speech decision for each frame"""
+        energy = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        spectrum = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        band_ratio = spectrum[:, self.band].sum(axis=1) / (spectrum.sum(axis=1) + 1e-10)
+
+        # the noise floor drops at once to quieter frames and rises slowly;
+        # it only creeps up under loud sound, so long speech does not raise it
+        floors = np.empty_like(energy)
+        floor = self.noise_floor
+        for i, e in enumerate(energy):
+            if e < floor:
+                floor = e
+            elif e < floor + self.snr_db:
+                floor += self.floor_rise * (e - floor)
+            else:
+                floor += self.floor_creep * (e - floor)
+            floors[i] = floor
+        self.noise_floor = floor
+
+        loud = energy > np.maximum(self.threshold, floors + self.snr_db)
+        voiced = (zcr >= self.zcr_range[0]) & (zcr <= self.zcr_range[1]) & \
+                 (band_ratio >= self.min_band_ratio)
+        speech = loud & voiced
+        self._count_rejections(loud & ~voiced)
+        return speech
+
+    def _count_rejections(self, rejected):
+        for r in rejected:
+            if r:
+                self.rejected_frames += 1
+                self.loud_run += 1
+                # long enough that the level detector would have opened a segment
+                if self.loud_run == self.burst_frames:
+                    self.rejected_bursts += 1
+                    logging.debug(f"VAD rejected non-speech burst #{self.rejected_bursts}")
+            else:
+                self.loud_run = 0
+
+    def process(self, chunk):
+        """
+        Feed a PCM chunk. Returns True/False for speech in this chunk,
+        or None if it did not complete a frame.
+        """
+        frames = self.frames(chunk)
+        if not len(frames):
+            return None
+        return bool(self.classify(frames).mean() >= 0.5)
+
+def make_vad(engine="level", threshold=-30, ignore=0.3):
+    """Create a detector by name: 'level' or 'numpy'"""
+    if engine == "numpy":
+        try:
+            return NumpyVAD(threshold=threshold, ignore=ignore)
+        except ImportError as e:
+            logging.warning(f"{e}; using the level detector")
+    elif engine != "level":
+        logging.warning(f"Unknown VAD engine '{engine}'; using the level detector")
+    return LevelVAD(threshold=threshold)
@@ -18,30 +18,81 @@
 ## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 ## MA 02110-1301, USA.
 ##
-import pyautogui
-import os, sys
 import time
+startup_time = time.monotonic()  # for the time-to-listening report
+import os, sys
 import queue
 import re
-from openai import OpenAI, NotGiven
 
 import webbrowser
 import tempfile
 import threading
+import asyncio
+import signal
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import tracer
-from mimic3_client import say, shutup
-from on_screen import camera, show_pictures
-from record import delayRecord
-from persistent_record import PersistentAudioRecorder
-audio_queue = queue.Queue()
+import lazy
+from lazy import LazyModule, LazyObject, lazy_function
+from audio_buffer import AudioSegment, SegmentQueue
+from transport import InferenceTransport
+from hedge import HedgedTranscriber
+from context import Conversation
+from providers import ProviderPool, OpenAIChatProvider, GeminiChatProvider
+from pipeline import TranscriptionPipeline, AsyncTranscriptionPipeline, split_transcript
+from streaming import StreamingTranscriber, reconcile
+from endpoint import make_endpointer
+import dispatcher
+from dispatcher import CommandRegistry, sends_keys, open_ended
+from repetitions import remove_repetitions
+from metrics import metrics
+from cache import TranscriptionCache, ResponseCache
+from encode import SegmentEncoder
+from inject import TextInjector, ClipboardBackend, make_backend
+from lifecycle import ManagedServer
+
+# Optional subsystems and their libraries (GStreamer, PIL, the OpenAI SDK)
+# are imported the first time they are used, not at start-up
+pyautogui = LazyModule("pyautogui")
+openai = LazyModule("openai")
+mimic3_client = LazyModule("mimic3_client")
+on_screen_module = LazyModule("on_screen")
+tts_available = True  # until mimic3_client fails to import
+def say(text):
+    """Speak text; the TTS client and GStreamer are imported on the first call"""
+    global tts_available
+    if not tts_available:
+        return
+    try:
+        mimic3_client.say(text)
+    except ImportError as e:
+        logging.error(f"No speech output: {e}")
+        tts_available = False
+
+def shutup():
+    """Stop speaking; nothing can be speaking, and nothing is imported, before say()"""
+    if "mimic3_client" in lazy.loaded:
+        mimic3_client.shutup()
+camera = lazy_function(on_screen_module, "camera")
+show_pictures = lazy_function(on_screen_module, "show_pictures")
+# only one of the two recorders is used in a session
+delayRecord = lazy_function(LazyModule("record"), "delayRecord")
+PersistentAudioRecorder = lazy_function(LazyModule("persistent_record"), "PersistentAudioRecorder")
 listening = True
-chatting = False
+# prompts go to the chat providers without a wake word; set from the chat
+# thread, read and cleared from the thread acting on transcriptions
+chat_mode = threading.Event()
 record_process = None
 running = True
 cam = None
 persistent_recorder = None
+transcriber = None
+streamer = None
+typing_lock = threading.Lock()
+chat_lock = threading.RLock()  # one conversation turn at a time
+event_loop = None  # set while the asyncio core runs
+background_tasks = set()
 
 # Define debug mode early
 debug = os.getenv("DEBUG_WHISPER", "false").lower() in ["true", "1", "yes", "y"]
@@ -59,7 +110,7 @@ no_keys = os.getenv("NO_KEYS", "false").lower() in ["true", "1", "yes", "y"]
 show_status = os.getenv("SHOW_PROCESSING_STATUS", "false").lower() in ["true", "1", "yes", "y"]
 
 # Language setting
-whisper_language =  os.getenv("WHISPER_LANGUAGE", NotGiven())
+whisper_language =  os.getenv("WHISPER_LANGUAGE")  # None: the backend detects it
 # Model setting for OpenAI Whisper API
 whisper_model = os.getenv("WHISPER_MODEL", "whisper-1")  # Default: whisper-1
 
@@ -67,6 +118,76 @@ whisper_model = os.getenv("WHISPER_MODEL", "whisper-1")  # Default: whisper-1
 min_repetitions = int(os.getenv("MIN_REPETITIONS", "6"))  # Minimum repetitions to trigger removal
 keep_repetitions = int(os.getenv("KEEP_REPETITIONS", "5"))  # Number of repetitions to keep
 
+# Drive capture, speech and chat requests from an asyncio event loop;
+# false runs the older blocking record/transcribe threads
+async_core = os.getenv("ASYNC_CORE", "true").lower() in ["true", "1", "yes", "y"]
+
+# Number of segments that may be sent to the speech backend at once
+transcribe_workers = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+
+# Type stable words while the user is still speaking (persistent recorder only)
+streaming_mode = os.getenv("STREAMING", "false").lower() in ["true", "1", "yes", "y"]
+stream_interval = float(os.getenv("STREAM_INTERVAL", "1.0"))  # seconds between partial requests
+
+# End-of-utterance detection: fixed waits STOP_AFTER seconds of silence,
+# adaptive picks a shorter hangover for commands and short utterances
+endpointing = os.getenv("ENDPOINTING", "fixed").lower()
+min_stop_after = float(os.getenv("MIN_STOP_AFTER", "0.3"))
+
+# Keep the delayRecord pipeline and audio device open between utterances
+# (fallback recorder only; the persistent recorder always does)
+reuse_pipeline = os.getenv("REUSE_PIPELINE", "false").lower() in ["true", "1", "yes", "y"]
+
+# Answer repeated short utterances from a cache instead of the backend
+use_transcription_cache = os.getenv("TRANSCRIPTION_CACHE", "false").lower() in ["true", "1", "yes", "y"]
+
+# Upload format per backend: wav, flac (lossless) or opus, encoded in-process.
+# whisper-server reads flac itself; opus needs whisper-server --convert
+cpp_upload_format = os.getenv("CPP_UPLOAD_FORMAT", "wav").lower()
+openai_upload_format = os.getenv("OPENAI_UPLOAD_FORMAT", "wav").lower()
+encoder = SegmentEncoder()
+
+# Bound on segments waiting for transcription. When QUEUE_SIZE are waiting,
+# QUEUE_POLICY blocks the recorder, merges new speech into the last waiting
+# segment, or drops the oldest; QUEUE_MAX_AGE drops segments too late to type
+queue_size = int(os.getenv("QUEUE_SIZE", "8"))
+queue_policy = os.getenv("QUEUE_POLICY", "block").lower()
+queue_max_age = float(os.getenv("QUEUE_MAX_AGE", "0"))  # seconds after speech, 0 = never
+
+# Send short segments that are waiting together as one request to the local
+# server, with COALESCE_GAP seconds of silence between them, and split the
+# text back per segment by word timestamps
+coalesce = os.getenv("COALESCE", "false").lower() in ["true", "1", "yes", "y"]
+coalesce_max_seconds = float(os.getenv("COALESCE_MAX_SECONDS", "4"))  # per segment
+coalesce_max_segments = int(os.getenv("COALESCE_MAX_SEGMENTS", "4"))
+coalesce_gap = float(os.getenv("COALESCE_GAP", "0.6"))
+
+# Answer repeated chat prompts from a cache: after RESPONSE_CACHE_VARIANTS
+# replies to a prompt, the different ones are used in rotation
+use_response_cache = os.getenv("RESPONSE_CACHE", "false").lower() in ["true", "1", "yes", "y"]
+response_cache_context = int(os.getenv("RESPONSE_CACHE_CONTEXT", "2"))  # recent messages in the key
+
+# How text reaches the active window: auto (ydotool on Wayland, xdotool on
+# X11, else pyautogui), xdotool, ydotool, clipboard or pyautogui. Text of
+# INJECT_PASTE_OVER characters or more is pasted through the clipboard
+inject_backend = os.getenv("INJECT_BACKEND", "auto").lower()
+inject_key_delay = int(os.getenv("INJECT_KEY_DELAY", "2"))  # ms between keys
+inject_paste_over = int(os.getenv("INJECT_PASTE_OVER", "200"))  # 0 = never paste
+
+# Print time from start-up to listening, and what was imported on demand
+startup_report = os.getenv("STARTUP_REPORT", "false").lower() in ["true", "1", "yes", "y"]
+# Say "All systems ready." once listening; imports TTS, so only if it is wanted
+announce_ready = not quiet_mode and \
+    os.getenv("ANNOUNCE_READY", "true").lower() in ["true", "1", "yes", "y"]
+
+# Type chat replies as they are generated and speak them sentence by sentence
+stream_chat = os.getenv("STREAM_CHAT", "false").lower() in ["true", "1", "yes", "y"]
+
+# Local metrics endpoint (/metrics, /metrics.json); 0 disables it
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+# Append a JSON line with the stage timeline of every segment
+trace_file = os.getenv("TRACE_FILE", "")
+
 # Ignore patterns for transcriptions
 ignore_patterns = os.getenv("IGNORE_PATTERNS", "")
 
@@ -196,10 +317,73 @@ if debug:
     logging.debug(f"OpenAI Whisper enabled: {os.getenv('USE_OPENAI_WHISPER', 'false')}")
     logging.debug(f"Show processing status: {show_status}")
 
+last_drop_notice = 0.0
+
+def announce_dropped(segment, reason):
+    """
+    Tell the user that speech was skipped because transcription fell behind.
+    Runs on the thread that queues segments, so the speech is left to the
+    TTS worker rather than delaying capture.
+    """
+    global last_drop_notice
+    if quiet_mode:
+        print(f"[DROPPED] {segment} ({reason})", file=sys.stderr)
+    elif time.monotonic() - last_drop_notice > 10:
+        last_drop_notice = time.monotonic()
+        speech_executor.submit(say, "Sorry, I fell behind and skipped some speech.")
+
+def segment_dropped(segment, reason):
+    """audio_queue dropped a segment: erase its streamed partial text, then tell the user"""
+    if streamer:
+        erase_partial(streamer.finalize(segment.segment_id))
+    announce_dropped(segment, reason)
+
+def segment_merged(merged, segment):
+    """audio_queue merged segment into a waiting one, whose transcription now covers both"""
+    if streamer:
+        streamer.merge(merged.segment_id, segment.segment_id)
+
+audio_queue = SegmentQueue(queue_size, queue_policy, queue_max_age,
+                           on_drop=segment_dropped, on_merge=segment_merged)
+
 # address of whisper.cpp server
-cpp_url = "http://127.0.0.1:7777/inference"
+cpp_url = os.getenv("WHISPER_CPP_URL", "http://127.0.0.1:7777/inference")
+# keep-alive connection pool to the whisper.cpp server
+transport = InferenceTransport(
+    cpp_url,
+    pool_size=max(int(os.getenv("CPP_POOL_SIZE", "2")), transcribe_workers),
+    connect_timeout=float(os.getenv("CPP_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("CPP_READ_TIMEOUT", "60")),
+    retries=int(os.getenv("CPP_RETRIES", "2"))
+)
 # address of Fallback Chat Server.
-fallback_chat_url = "http://localhost:8888/v1"
+fallback_chat_url = os.getenv("FALLBACK_CHAT_URL", "http://localhost:8888/v1")
+
+# Start whisper-server when it is needed and stop it after WHISPER_SERVER_IDLE
+# seconds without requests (0: keep it running), from a command line, e.g.
+# WHISPER_SERVER_CMD=./start_server.sh, or a systemd user unit, e.g.
+# WHISPER_SERVER_UNIT=whisper. The same for llama-server with LLAMA_SERVER_*.
+server_start_timeout = float(os.getenv("SERVER_START_TIMEOUT", "120"))
+whisper_server = ManagedServer(
+    "whisper-server",
+    # whisper-server serves its web page once the model is loaded
+    os.getenv("WHISPER_PROBE_URL", cpp_url.rsplit("/", 1)[0] + "/"),
+    command=os.getenv("WHISPER_SERVER_CMD"),
+    unit=os.getenv("WHISPER_SERVER_UNIT"),
+    warmup=lambda: warm_up_whisper(),
+    idle_timeout=float(os.getenv("WHISPER_SERVER_IDLE", "0")),
+    start_timeout=server_start_timeout
+)
+llama_server = ManagedServer(
+    "llama-server",
+    # 503 while the model loads, 200 when ready
+    os.getenv("LLAMA_PROBE_URL", fallback_chat_url.rstrip("/").removesuffix("/v1") + "/health"),
+    command=os.getenv("LLAMA_SERVER_CMD"),
+    unit=os.getenv("LLAMA_SERVER_UNIT"),
+    warmup=lambda: warm_up_llama(),
+    idle_timeout=float(os.getenv("LLAMA_SERVER_IDLE", "0")),
+    start_timeout=server_start_timeout
+)
 
 # OpenAI API configuration
 gpt_key = os.getenv("OPENAI_API_KEY")
@@ -207,8 +391,8 @@ client = None
 openai_whisper = False  # Flag to use OpenAI's Whisper API instead of local server
 
 if gpt_key:
-    from openai import OpenAI
-    client = OpenAI(api_key=gpt_key)
+    # the OpenAI SDK is loaded by the first request
+    client = LazyObject(lambda: openai.OpenAI(api_key=gpt_key))
     # Check if user wants to use OpenAI for transcription
     openai_whisper = os.getenv("USE_OPENAI_WHISPER", "false").lower() in ["true", "1", "yes", "y"]
     if openai_whisper:
@@ -246,13 +430,48 @@ if debug:
 
 gem_key = os.getenv("GENAI_TOKEN")
 if (gem_key):
-    import google.generativeai as genai
-    genai.configure(api_key=gem_key)
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    genai = LazyModule("google.generativeai")
+    def gemini_model():
+        genai.configure(api_key=gem_key)
+        return genai.GenerativeModel("gemini-1.5-flash")
+    model = LazyObject(gemini_model)  # loaded by the first Gemini request
     logging.debug("Gemini API key found. Gemini responses available.\n")
 else:
     logging.debug("Export GENAI_TOKEN if you want answers from Gemini.\n")
 
+injector = TextInjector(make_backend(inject_backend, pyautogui, inject_key_delay))
+try:
+    # pastes long text, and text the typing backend cannot type
+    injector.paste = ClipboardBackend(lambda *keys: pyautogui.hotkey(*keys),
+                                      fallback=injector.backend)
+    injector.paste_over = inject_paste_over
+except RuntimeError as e:
+    logging.debug(f"No clipboard pasting: {e}")
+logging.debug(f"Typing with {injector.backend.name}")
+
+# One long-lived client per chat provider, tried in this order
+chat_timeout = float(os.getenv("CHAT_TIMEOUT", "30"))
+chat_provider_list = []
+if gpt_key and client:
+    chat_provider_list.append(OpenAIChatProvider("openai", client, timeout=chat_timeout))
+if gem_key:
+    chat_provider_list.append(GeminiChatProvider("gemini", model, timeout=chat_timeout))
+# ref. llama.cpp/examples/server/README.md
+chat_provider_list.append(OpenAIChatProvider(
+    "local", LazyObject(lambda: openai.OpenAI(base_url=fallback_chat_url, api_key="sk-no-key-required")),
+    timeout=float(os.getenv("LOCAL_CHAT_TIMEOUT", "120")),
+    # reuse the KV cache of the unchanged prompt prefix, always in the same slot
+    extra_body={"cache_prompt": True, "id_slot": int(os.getenv("LLAMA_SLOT", "0"))},
+    server=llama_server if llama_server.managed else None))
+chat_providers = ProviderPool(chat_provider_list)
+
+def warm_up_llama():
+    """Generate one token, so the first answer does not pay for setting up the GPU"""
+    local = chat_provider_list[-1]
+    local.client.chat.completions.create(
+        model=local.model, messages=[{"role": "user", "content": "Hi"}],
+        max_tokens=1, timeout=server_start_timeout)
+
 # commands and hotkeys for various platforms
 commands = {
 "windows": {
@@ -290,48 +509,80 @@ hotkeys = {
     r"^copy that.?$":     [['ctrl', 'c']],
     r"^paste it.?$":      [['ctrl', 'v']],
     }
+@open_ended
+def chat_prompt(q):
+    """The catch-all action: anything after a wake word goes to the chat providers"""
+    run_in_background(generate_text, q)
+
+# actions receive q, the rest of the utterance after the command
 actions = {
-    r"^left click.?$": "pyautogui.click()",
-    r"^(click)( the)?( mouse).?": "pyautogui.click()",
-    r"^middle click.?$": "pyautogui.middleClick()",
-    r"^right click.?$": "pyautogui.rightClick()",
-    r"^directory listing.?$": "pyautogui.write('ls\n')",
-    r"^(peter|samantha|computer).?,? (run|open|start|launch)(up)?( a| the)? ": "os.system(commands[sys.platform][q])",
-    r"^(peter|samantha|computer).?,? closed? window": "pyautogui.hotkey('alt', 'F4')",
+    r"^left click.?$": sends_keys(lambda q: pyautogui.click()),
+    r"^(click)( the)?( mouse).?": sends_keys(lambda q: pyautogui.click()),
+    r"^middle click.?$": sends_keys(lambda q: pyautogui.middleClick()),
+    r"^right click.?$": sends_keys(lambda q: pyautogui.rightClick()),
+    r"^directory listing.?$": sends_keys(lambda q: injector.write('ls\n')),
+    r"^(peter|samantha|computer).?,? (run|open|start|launch)(up)?( a| the)? ": lambda q: os.system(commands[sys.platform][q]),
+    r"^(peter|samantha|computer).?,? closed? window": sends_keys(lambda q: pyautogui.hotkey('alt', 'F4')),
     r"^(peter|samantha|computer).?,? search( the)?( you| web| google| bing| online)?(.com)? for ": 
-       "webbrowser.open('https://you.com/search?q=' + re.sub(' ','%20',q))",
-    r"^(peter|samantha|computer).?,? (send|compose|write)( an| a) email to ": "os.popen('xdg-open \"mailto://' + q.replace(' at ', '@') + '\"')",
-    r"^(peter|samantha|computer).?,? (i need )?(let's )?(see |have |show )?(us |me )?(an? )?(image|picture|draw|create|imagine|paint)(ing| of)? ": "os.popen(f'./sdapi.py \"{q}\"')",
-    r"^(peter|samantha|computer)?.?,? ?(resume|zoom|continue|start|type|thank|got|whoa|that's) (typing|d.ctation|this|you|there|enough|it)" : "resume_dictation()",
-    r"^(peter|samantha|computer)?.?,? ?(record)( a| an| my)?( audio| sound| voice| file| clip)+" : "record_mp3()",
-    r"^(peter|samantha|computer)?.?,? ?(on|show|start|open) (the )?(webcam|camera|screen)" : "on_screen()",
-    r"^(peter|samantha|computer)?.?,? ?(off|stop|close) (the )?(webcam|camera|screen)" : "off_screen()",
-    r"^(peter|samantha|computer)?.?,? ?(take|snap) (a|the|another) (photo|picture)" : "take_picture()",
-    r"^(peter|samantha|computer)?.?,? ?(show|view) (the )?(photo|photos|pictures)( album| collection)?" : "show_pictures()",
-    r"^(peter|samantha|computer).?,? ": "generate_text(q)"
+       lambda q: webbrowser.open('https://you.com/search?q=' + re.sub(' ','%20',q)),
+    r"^(peter|samantha|computer).?,? (send|compose|write)( an| a) email to ": lambda q: os.popen('xdg-open "mailto://' + q.replace(' at ', '@') + '"'),
+    r"^(peter|samantha|computer).?,? (i need )?(let's )?(see |have |show )?(us |me )?(an? )?(image|picture|draw|create|imagine|paint)(ing| of)? ": lambda q: os.popen(f'./sdapi.py "{q}"'),
+    r"^(peter|samantha|computer)?.?,? ?(resume|zoom|continue|start|type|thank|got|whoa|that's) (typing|d.ctation|this|you|there|enough|it)" : lambda q: resume_dictation(),
+    r"^(peter|samantha|computer)?.?,? ?(record)( a| an| my)?( audio| sound| voice| file| clip)+" : lambda q: record_mp3(),
+    r"^(peter|samantha|computer)?.?,? ?(on|show|start|open) (the )?(webcam|camera|screen)" : lambda q: on_screen(),
+    r"^(peter|samantha|computer)?.?,? ?(off|stop|close) (the )?(webcam|camera|screen)" : lambda q: off_screen(),
+    r"^(peter|samantha|computer)?.?,? ?(take|snap) (a|the|another) (photo|picture)" : lambda q: take_picture(),
+    r"^(peter|samantha|computer)?.?,? ?(show|view) (the )?(photo|photos|pictures)( album| collection)?" : lambda q: show_pictures(),
+    r"^(peter|samantha|computer).?,? ": chat_prompt
+    }
+
+def open_website(q):
+    webbrowser.open('https://' + q.strip())
+
+def stop_dictation(q):
+    if not quiet_mode:
+        say("Shutting down.")
+    return "stop"
+
+def pause_dictation(q):
+    global listening
+    listening = False
+    if not quiet_mode:
+        say("okay")
+
+# commands checked before actions, even while dictation is paused
+control_commands = {
+    r"^(peter|computer).? (go|open|browse|visit|navigate)( up| to| the| website)* [a-zA-Z0-9-]{1,63}(\.[a-zA-Z0-9-]{1,63})+$": open_website,
+    r"^stop.? (d.ctation|listening).?$": stop_dictation,
+    r"^paused? (d.ctation|positi.?i?cation).?$": pause_dictation,
     }
 
+# compiled once; NO_KEYS leaves out actions that send keys
+control_registry = CommandRegistry(control_commands)
+action_registry = CommandRegistry(actions, skip_keys=no_keys)
+
+def run_command(command, q):
+    """Run a command; one that sends keys or clicks waits until earlier text is typed"""
+    if command.sends_keys:
+        injector.flush()  # or the rest would go wherever focus moves
+    return command.handler(q)
+
 def process_actions(tl:str) -> bool:
-    global chatting
     global listening
-    for input, action in actions.items():
-        # look for action in list
-        if s:=re.search(input, tl):
-            # Skip pyautogui actions if NO_KEYS is set
-            if no_keys and "pyautogui" in action:
-                continue
-            q = tl[s.end():] # get q for action
-            if not quiet_mode:
-                say("okay")
-            eval(action)
-            if debug:
-                if quiet_mode:
-                    print(q, file=sys.stderr)
-                else:
-                    print(q)
-            return True # success
-    if chatting:
-        generate_text(tl); return True
+    # look for action in list
+    if hit := action_registry.match(tl):
+        action, q = hit # get q for action
+        if not quiet_mode:
+            say("okay")
+        run_command(action, q)
+        if debug:
+            if quiet_mode:
+                print(q, file=sys.stderr)
+            else:
+                print(q)
+        return True # success
+    if chat_mode.is_set():
+        run_in_background(generate_text, tl); return True
     return False # no action
 
 def on_screen():
@@ -354,114 +605,325 @@ def off_screen():
     global cam
     if cam: cam = cam.stop_camera()
 
+def press_hotkeys(combos):
+    """Return a handler pressing each key combo in turn, such as ctrl-v"""
+    def press(q):
+        for x in combos:
+            # The * unpacks x to separate args
+            pyautogui.hotkey(*x)
+    return sends_keys(press)
+
+hotkey_registry = CommandRegistry({key: press_hotkeys(val) for key, val in hotkeys.items()})
+
 # search text for hotkeys
 def process_hotkeys(txt: str) -> bool:
     if no_keys:
         return False  # Don't process hotkeys if key sending is disabled
-    for key,val in hotkeys.items():
-        # if hotkey command
-        if re.search(key, txt):
-            # unpack list of key combos such as ctrl-v
-            for x in val:
-                # press each key combo in turn
-                # The * unpacks x to separate args
-                pyautogui.hotkey(*x)
-            return True
+    if hit := hotkey_registry.match(txt):
+        hotkey, q = hit
+        run_command(hotkey, q)
+        return True
     return False
 
-def gettext(f:str) -> str:
+wake_words = re.compile(r"^(peter|samantha|computer)\b")
+
+def is_command(tl: str) -> bool:
+    """True if lower-case text would be handled as a command, not dictation"""
+    return bool(wake_words.match(tl)) or tl in control_registry or \
+        tl in action_registry or (not no_keys and tl in hotkey_registry)
+
+# whole commands end the utterance at once, see endpoint.py
+complete_command_registries = [control_registry, action_registry] + ([] if no_keys else [hotkey_registry])
+
+def is_complete_command(tl: str) -> bool:
+    """True if lower-case text is all of a command that takes no more words"""
+    return dispatcher.is_complete_command(tl, complete_command_registries)
+
+def type_partial(segment_id, stable: str, new_text: str):
+    """
+    Called by the StreamingTranscriber with newly stable words.
+    Returns True if typed, False to try again later, None for commands.
+    """
+    if is_command(stable.lower().strip()):
+        return None
+    if show_status:
+        print(f"[PARTIAL] {stable}", file=sys.stderr)
+    if no_keys or not listening or chat_mode.is_set():
+        return False
+    with typing_lock:
+        # don't type ahead of segments that are still being transcribed
+        if not audio_queue.empty() or not transcriber.idle():
+            return False
+        injector.write(new_text)
+    return True
+
+def erase_partial(typed: str):
+    """Remove streamed partial text that turned out not to be dictation"""
+    if typed and not no_keys:
+        logging.debug(f"Erasing partial text: '{typed}'")
+        with typing_lock:
+            injector.backspace(len(typed))
+
+def openai_gettext(segment, timeline=None) -> str:
+    """Transcribe with OpenAI's Whisper API; raises on errors"""
+    upload = encoder.upload(segment, openai_upload_format)
+    logging.debug(f"Sending audio to OpenAI Whisper API... (upload size: {len(upload[1])} bytes)")
+    start_time = time.time()
+    
+    # Add timeout for API call
+    api_timeout = float(os.getenv("OPENAI_API_TIMEOUT", "30"))  # Default 30 seconds
+    
+    try:
+        logging.info(f"Transcribing {segment.name} ({segment.duration:.1f}s) using OpenAI Whisper API with timeout {api_timeout} seconds")
+        if timeline is not None:
+            timeline.mark("request_sent")
+        transcription = client.audio.transcriptions.create(
+            model=whisper_model,
+            file=upload,
+            language=whisper_language or openai.NOT_GIVEN,
+            temperature=0.0,
+            response_format="text",
+            timeout=api_timeout
+        )
+    except Exception as api_error:
+        if "timeout" in str(api_error).lower():
+            logging.error(f"OpenAI API timeout after {api_timeout} seconds")
+        metrics.inc("backend_errors_total", backend="openai")
+        raise api_error
+        
+    if timeline is not None:
+        timeline.mark("response_received")
+    elapsed = time.time() - start_time
+    metrics.observe("request_seconds", elapsed, backend="openai",
+                    format=openai_upload_format)
+    metrics.inc("transcriptions_total", backend="openai")
+    logging.debug(f"OpenAI API response received in {elapsed:.2f} seconds")
+    logging.debug(f"Transcription text: '{transcription}'")
+    # OpenAI API returns text directly
+    return transcription
+
+def warm_up_whisper():
+    """Transcribe half a second of silence, so the weights are resident before the user speaks"""
+    silence = AudioSegment(bytes(16000))
+    transport.post(files={'file': encoder.upload(silence, "wav")},
+                   data={'response_format': 'json', 'language': whisper_language})
+
+def start_whisper_server() -> float:
+    """Start whisper-server if it is managed and stopped; seconds waited for it"""
+    if not whisper_server.managed:
+        return 0.0
+    try:
+        return whisper_server.ensure_running()
+    except (OSError, RuntimeError) as e:  # TimeoutError is an OSError
+        raise requests.exceptions.ConnectionError(f"Could not start whisper-server: {e}")
+
+def local_gettext(segment, timeline=None) -> str:
+    """Transcribe with the local whisper.cpp server; raises on errors"""
+    waited = start_whisper_server()
+    upload = encoder.upload(segment, cpp_upload_format)
+    logging.debug(f"Sending audio to local whisper.cpp server... (upload size: {len(upload[1])} bytes)")
+    files = {'file': upload}
+    # Enhanced parameters for better recognition
+    data = {
+        'temperature': '0.0',      # Lower temperature for more deterministic output
+        'response_format': 'json', 
+        'word_timestamps': 'true', # Get word-level timestamps
+        'language': whisper_language,  # Use configured language
+        'beam_size': '5',          # Increase beam size for better accuracy
+    }
+
+    if timeline is not None:
+        timeline.mark("request_sent")
+    start_time = time.time()
+    try:
+        response = transport.post(files=files, data=data)  # raises on errors
+    except requests.exceptions.RequestException as e:
+        metrics.inc("backend_errors_total", backend="local")
+        if isinstance(e, requests.exceptions.ConnectionError):
+            whisper_server.mark_down()
+        raise
+    if timeline is not None:
+        timeline.mark("response_received")
+    observe_local_request(time.time() - start_time, waited)
+    metrics.inc("transcriptions_total", backend="local")
+
+    # Parse the JSON response
+    return response.json()['text']
+
+def observe_local_request(elapsed, waited):
+    """Warm requests go to request_seconds; those that waited for whisper-server to start, to cold_request_seconds"""
+    if waited:
+        metrics.observe("cold_request_seconds", waited + elapsed, server=whisper_server.name)
+    else:
+        metrics.observe("request_seconds", elapsed, backend="local", format=cpp_upload_format)
+
+def gettext(segment) -> str:
     """
-    Convert audio file to text using either local whisper.cpp server or OpenAI's Whisper API
+    Convert an AudioSegment to text using either local whisper.cpp server or OpenAI's Whisper API
+    The upload is built in memory; a WAV file path is also accepted.
     """
-    result = ['']
-    if not f or not os.path.isfile(f):
-        logging.debug(f"gettext: Invalid file: {f}")
+    if isinstance(segment, str):
+        if not os.path.isfile(segment):
+            logging.debug(f"gettext: Invalid file: {segment}")
+            return ""
+        segment = AudioSegment.from_wav(segment)
+    if not segment:
+        logging.debug(f"gettext: Empty audio segment: {segment}")
         return ""
     
-    file_size = os.path.getsize(f)
-    logging.debug(f"gettext: Processing audio file: {f} (size: {file_size} bytes)")
+    logging.debug(f"gettext: Processing {segment}")
+    timeline = segment.timeline
+
+    # Send to both backends when the preferred one is slow, take the first answer
+    if hedger:
+        timeline.mark("request_sent")
+        try:
+            return hedger(segment)
+        except Exception as e:
+            logging.error(f"Hedged transcription failed: {e}")
+            return ""
+        finally:
+            timeline.mark("response_received")
+            # Show idle status after processing
+            show_idle_status()
     
     # If OpenAI's Whisper API is enabled and API key is available
     if openai_whisper and client:
         try:
-            with open(f, "rb") as audio_file:
-                logging.debug("Sending audio to OpenAI Whisper API...")
-                start_time = time.time()
-                
-                # Add timeout for API call
-                api_timeout = float(os.getenv("OPENAI_API_TIMEOUT", "30"))  # Default 30 seconds
-                
-                try:
-                    # Calculate audio duration
-                    import wave
-                    try:
-                        with wave.open(f, 'rb') as wav_file:
-                            frames = wav_file.getnframes()
-                            rate = wav_file.getframerate()
-                            duration = frames / float(rate)
-                        duration_str = f"{duration:.1f}s"
-                    except:
-                        duration_str = "unknown duration"
-                    
-                    logging.info(f"Transcribing audio file '{f}' ({duration_str}) using OpenAI Whisper API with timeout {api_timeout} seconds")
-                    transcription = client.audio.transcriptions.create(
-                        model=whisper_model,
-                        file=audio_file,
-                        language=whisper_language,
-                        temperature=0.0,
-                        response_format="text",
-                        timeout=api_timeout
-                    )
-                except Exception as api_error:
-                    if "timeout" in str(api_error).lower():
-                        logging.error(f"OpenAI API timeout after {api_timeout} seconds")
-                    raise api_error
-                    
-                elapsed = time.time() - start_time
-                logging.debug(f"OpenAI API response received in {elapsed:.2f} seconds")
-                logging.debug(f"Transcription text: '{transcription}'")
-                # Show idle status after processing
-                show_idle_status()
-                # OpenAI API returns text directly
-                return transcription
-                
+            text = openai_gettext(segment, timeline)
+            # Show idle status after processing
+            show_idle_status()
+            return text
         except Exception as e:
             logging.error(f"OpenAI API Error: {e}")
+            metrics.inc("fallbacks_total")
             logging.info("Falling back to local server...")
             # Fall back to local server if OpenAI API fails
     
     # Use local whisper.cpp server
     try:
-        logging.debug("Sending audio to local whisper.cpp server...")
-        files = {'file': (f, open(f, 'rb'))}
-        # Enhanced parameters for better recognition
+        return local_gettext(segment, timeline)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Local Server Error: {e}")
+        return ""
+    finally:
+        # Show idle status after processing, or after an error
+        show_idle_status()
+
+# Hedged requests: HEDGE=true sends a segment to the preferred backend
+# (OpenAI with USE_OPENAI_WHISPER, else local) and, if it has not answered
+# within HEDGE_PERCENTILE of its recent latency, to the other one as well
+hedger = None
+if os.getenv("HEDGE", "false").lower() in ["true", "1", "yes", "y"]:
+    if client:
+        backends = {"openai": openai_gettext, "local": local_gettext}
+        preferred, secondary = ("openai", "local") if openai_whisper else ("local", "openai")
+        hedger = HedgedTranscriber(
+            backends, preferred, secondary,
+            percentile=float(os.getenv("HEDGE_PERCENTILE", "90")),
+            initial_delay=float(os.getenv("HEDGE_INITIAL_DELAY", "1.5")),  # until latencies are known
+            min_delay=float(os.getenv("HEDGE_MIN_DELAY", "0.2")),
+            workers=2 * transcribe_workers + 2
+        )
+        logging.debug(f"Hedging transcription requests from {preferred} to {secondary}")
+    else:
+        logging.info("HEDGE needs OPENAI_API_KEY for a second backend; not hedging")
+
+def gettext_batch(segments):
+    """
+    Transcribe several short segments with one request to the local server.
+    Returns one text per segment, or None if the result could not be split.
+    """
+    joined = AudioSegment.join(segments, coalesce_gap)
+    try:
+        waited = start_whisper_server()
+        upload = encoder.upload(joined, cpp_upload_format)
+        logging.debug(f"Sending {len(segments)} segments as one request... (upload size: {len(upload[1])} bytes)")
         data = {
-            'temperature': '0.0',      # Lower temperature for more deterministic output
-            'response_format': 'json', 
-            'word_timestamps': 'true', # Get word-level timestamps
-            'language': whisper_language,  # Use configured language
-            'beam_size': '5',          # Increase beam size for better accuracy
+            'temperature': '0.0',
+            'response_format': 'verbose_json',  # segments with word timestamps
+            'word_timestamps': 'true',
+            'language': whisper_language,
+            'beam_size': '5',
         }
+        for segment in segments:
+            segment.timeline.mark("request_sent")
+        start_time = time.time()
+        response = transport.post(files={'file': upload}, data=data)
+        for segment in segments:
+            segment.timeline.mark("response_received")
+        observe_local_request(time.time() - start_time, waited)
+        metrics.inc("transcriptions_total", backend="local")
+        texts = split_transcript(response.json(), joined.spans)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Local Server Error: {e}")
+        metrics.inc("backend_errors_total", backend="local")
+        if isinstance(e, requests.exceptions.ConnectionError):
+            whisper_server.mark_down()
+        return None
+    finally:
+        show_idle_status()
+    logging.debug(f"Batch transcription split into {texts}")
+    return texts
 
-        response = requests.post(cpp_url, files=files, data=data)
-        response.raise_for_status()  # Check for errors
+transcription_cache = None
+if use_transcription_cache:
+    try:
+        transcription_cache = TranscriptionCache(
+            capacity=int(os.getenv("CACHE_SIZE", "256")),
+            max_duration=float(os.getenv("CACHE_MAX_SECONDS", "1.5")),  # seconds of speech; only very short utterances
+            similarity=float(os.getenv("CACHE_SIMILARITY", "0.9")),  # fingerprint correlation
+            path=os.getenv("CACHE_FILE") or None  # keep entries across restarts
+        )
+    except ImportError as e:
+        logging.info(f"Transcription cache disabled: {e}")
 
-        # Parse the JSON response
-        result = [response.json()]
-        
-        # Show idle status after processing
-        show_idle_status()
-        return result[0]['text']
+def cache_context() -> str:
+    """Backend, model and language; cached text is only reused under the same ones"""
+    if openai_whisper and client:
+        return f"openai/{whisper_model}/{whisper_language or ''}"
+    return f"local/{cpp_url}/{whisper_language or ''}"
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Local Server Error: {e}")
-        # Show idle status even after error
-        show_idle_status()
-        return ""
-    
-    # Show idle status if we somehow reached here
-    show_idle_status()
-    return ""
+def cached_gettext(segment) -> str:
+    """gettext() with the transcription cache in front, for finished segments"""
+    if not transcription_cache or isinstance(segment, str):
+        return gettext(segment)
+    context = cache_context()
+    status, text = transcription_cache.lookup(segment, context)
+    if status == "hit":
+        metrics.inc("cache_hits_total")
+        return text
+    text = gettext(segment)
+    if status == "miss":
+        metrics.inc("cache_misses_total")
+        transcription_cache.store(segment, context, text)
+    return text
+
+def cached_gettext_batch(segments):
+    """gettext_batch() for the segments the transcription cache cannot answer"""
+    texts = [None] * len(segments)
+    missed = set()  # cacheable segments the cache could not answer
+    context = cache_context()
+    if transcription_cache:
+        for i, segment in enumerate(segments):
+            status, texts[i] = transcription_cache.lookup(segment, context)
+            if status == "hit":
+                metrics.inc("cache_hits_total")
+            elif status == "miss":
+                metrics.inc("cache_misses_total")
+                missed.add(i)
+    todo = [i for i, text in enumerate(texts) if text is None]
+    if len(todo) > 1:
+        batch = gettext_batch([segments[i] for i in todo])
+        if batch is None:
+            return None
+        for i, text in zip(todo, batch):
+            texts[i] = text
+    elif todo:
+        texts[todo[0]] = gettext(segments[todo[0]])
+    for i in missed:
+        transcription_cache.store(segments[i], context, texts[i])
+    return texts
 
 # Print startup messages
 if quiet_mode:
@@ -480,7 +942,6 @@ else:
         print("\n[DEBUG MODE ACTIVE - Detailed logs will be shown]")
         print(f"Recording timeout: {os.getenv('RECORDING_TIMEOUT', '10')} seconds")
         print(f"OpenAI API timeout: {os.getenv('OPENAI_API_TIMEOUT', '30')} seconds\n")
-    say("All systems ready.")
 
 # Show initial idle status indicator
 show_idle_status()
@@ -488,13 +949,131 @@ show_idle_status()
 if debug:
     logging.debug("System initialized, starting main loops...")
 
-messages = [{ "role": "system", "content": "In this conversation between `user:` and `assistant:`, play the role of assistant. Reply as a helpful assistant." },]
+response_cache = None
+if use_response_cache:
+    response_cache = ResponseCache(
+        capacity=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),  # seconds
+        variants=int(os.getenv("RESPONSE_CACHE_VARIANTS", "1")),
+        path=os.getenv("RESPONSE_CACHE_FILE") or None  # keep entries across restarts
+    )
+
+def summarize_turns(summary: str, dropped) -> str:
+    """Have the first available chat provider fold dropped turns into the summary"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    request = [{"role": "system", "content": "Summarize the conversation below in a few short "
+                "sentences, keeping names, facts and decisions."},
+               {"role": "user", "content": (summary + "\n" if summary else "") + transcript}]
+    completion, _ = chat_providers.call(chat_providers.available()[0], request)
+    return completion.strip()
+
+# Chat context: CHAT_CONTEXT_TOKENS should match the -c of the local llama.cpp server.
+# CHAT_PINNED is kept in every prompt; CHAT_SUMMARY=model has the chat provider
+# summarize dropped turns, otherwise their first sentences are kept
+conversation = Conversation(
+    "In this conversation between `user:` and `assistant:`, play the role of assistant. Reply as a helpful assistant.",
+    budget=int(os.getenv("CHAT_CONTEXT_TOKENS", "2048")),
+    reserve=int(os.getenv("CHAT_REPLY_TOKENS", "512")),  # room left for the reply
+    summary_tokens=int(os.getenv("CHAT_SUMMARY_TOKENS", "256")),
+    pinned=[os.getenv("CHAT_PINNED")] if os.getenv("CHAT_PINNED") else (),
+    summarize=summarize_turns if os.getenv("CHAT_SUMMARY", "extract").lower() == "model" else None
+)
+
+def run_in_background(fn, *args):
+    """
+    Run slow work, such as a chat request, without holding up dictation.
+    Under the asyncio core it becomes a task on the I/O pool; otherwise it runs inline.
+    """
+    if event_loop is None or not event_loop.is_running():
+        return fn(*args)
+    def spawn():
+        task = asyncio.ensure_future(event_loop.run_in_executor(io_executor, fn, *args))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    event_loop.call_soon_threadsafe(spawn)
 
 def generate_text(prompt: str):
-    conversation_length = 9 # try increasing if AI model has a large ctx window
-    global chatting, messages, gpt_key, gem_key
-    messages.append({"role": "user", "content": prompt})
+    with chat_lock:
+        return chat_turn(prompt)
+
+# replies that ask for more information instead of answering
+CLARIFICATION_PHRASES = ("more information?", "It sounds like", "It seems like",
+                         "you tell me", "Could you please", "a large language model")
+NO_OUTPUT = "< nooutput >"
+# end of a sentence, for speaking streamed replies one sentence at a time
+SENTENCE_END = re.compile(r"[.!?:;][\"')\]]*\s+|\n+")
+
+def needs_clarification(completion: str) -> bool:
+    """True if the model asked for more information"""
+    return any(phrase in completion for phrase in CLARIFICATION_PHRASES) or \
+        completion == NO_OUTPUT
+
+def may_need_clarification(prefix: str) -> bool:
+    """True while a streamed reply could still turn out to open with a clarification"""
+    prefix = prefix.lstrip()
+    return any(phrase.startswith(prefix) for phrase in CLARIFICATION_PHRASES + (NO_OUTPUT,))
+
+# speaks streamed sentences one after another, without holding up typing
+speech_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speech")
+# dialogs: tkinter wants all of them on one thread, and transcriptions must
+# still be typed into them while one is open
+ui_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ui")
+
+def stream_reply(deltas):
+    """
+    Type a chat reply as it is generated and speak each sentence as soon
+    as it ends. The clarification heuristics are checked on the running
+    prefix; when one matches, generation is cut off and anything typed is
+    erased. Returns (completion, clarify).
+    """
     completion = ""
+    typed = ""
+    spoken = 0
+    sentences = []
+    try:
+        for delta in deltas:
+            completion += delta
+            if needs_clarification(completion):
+                logging.debug(f"Reply asks for clarification, cutting it off: '{completion}'")
+                deltas.close()
+                for sentence in sentences:
+                    sentence.cancel()
+                if not quiet_mode:
+                    shutup()
+                erase_partial(typed)
+                return completion, True
+            if may_need_clarification(completion):
+                continue  # hold back text that may have to be erased
+            if not no_keys:
+                with typing_lock:
+                    injector.write(completion[len(typed):])
+            typed = completion
+            if not quiet_mode:
+                for end in SENTENCE_END.finditer(completion, spoken):
+                    sentences.append(speech_executor.submit(say, completion[spoken:end.end()].strip()))
+                    spoken = end.end()
+    except Exception as e:
+        if not completion:
+            raise  # nothing received: let the next provider answer
+        logging.debug(f"Streamed reply ended early: {e}")
+    # the held-back or unfinished rest
+    if not no_keys and len(completion) > len(typed):
+        with typing_lock:
+            injector.write(completion[len(typed):])
+    if not quiet_mode and completion[spoken:].strip():
+        speech_executor.submit(say, completion[spoken:].strip())
+    return completion, False
+
+def chat_turn(prompt: str):
+    global gpt_key, gem_key
+    # the messages before this prompt, for the response cache key
+    context = conversation.turns[-response_cache_context:] if response_cache_context else []
+    conversation.add("user", prompt)
+    conversation.fit()  # within the token budget, keeping the prompt prefix stable
+    messages = conversation.messages()
+    completion = ""
+    streamed = False  # the reply was already typed and spoken while generated
+    clarify = False
     
     # Show processing status for AI generation
     if show_status:
@@ -504,45 +1083,31 @@ def generate_text(prompt: str):
         else:
             print(output, end="", flush=True)
     
-    # Try chatGPT
-    if gpt_key and client:
-        logging.debug("Asking ChatGPT")
-        try:
-            completion = client.chat.completions.create(model="gpt-3.5-turbo",
-            messages=messages)
-            completion = completion.choices[0].message.content
-        except Exception as e:
-                logging.debug("ChatGPT had a problem. Here's the error message.")
-                logging.debug(e)
-
-    # Fallback to Google Gemini
-    elif gem_key and not completion:
-        logging.debug("Asking Gemini")
-        chat = model.start_chat(
-            history=[
-            {"role": "user" if x["role"] == "user" else "model",
-                "parts": x["content"]}for x in messages]
-        )
-        response = chat.send_message(prompt)
-        completion = response.text
+    cached = response_cache.lookup(prompt, context) if response_cache else None
+    if cached:
+        metrics.inc("response_cache_hits_total")
+        completion = cached
+    elif response_cache:
+        metrics.inc("response_cache_misses_total")
+    start_time = time.monotonic()
 
-    # Fallback to localhost
-    if not completion:
-        logging.debug(f"Querying {fallback_chat_url}")
-        # ref. llama.cpp/examples/server/README.md
+    # Ask the providers in order, skipping those that keep failing
+    for provider in [] if completion else chat_providers.available():
+        logging.debug(f"Asking {provider.name}")
         try:
-            import openai
-            client = openai.OpenAI(
-            base_url=fallback_chat_url,
-            api_key = "sk-no-key-required")
-            completion = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages
-            )
-            completion = completion.choices[0].message.content
+            completion, clarify = chat_providers.call(
+                provider, messages, stream_reply if stream_chat else None)
         except Exception as e:
-            logging.debug(f"Error: {e}")
-            completion = "I'm sorry, I can't assist with that right now."
+            logging.debug(f"{provider.name} had a problem. Here's the error message.")
+            logging.debug(e)
+            continue
+        if completion:
+            streamed = stream_chat
+            if response_cache and not clarify and not needs_clarification(completion):
+                response_cache.store(prompt, context, completion, time.monotonic() - start_time)
+            break
+    if not completion:
+        completion = "I'm sorry, I can't assist with that right now."
 
     # Show idle status after processing
     show_idle_status()
@@ -553,69 +1118,181 @@ def generate_text(prompt: str):
         else:
             print(f"{completion}")
         # handle queries for more information
-        if "more information?" in completion or \
-            "It sounds like" in completion or \
-            "It seems like" in completion or \
-            "you tell me" in completion or \
-            "Could you please" in completion or \
-            "a large language model" in completion or \
-            completion == "< nooutput >":
+        if clarify or needs_clarification(completion):
             if not quiet_mode:
                 say("Sorry, I didn't catch that. Can you give me more information, please?")
-            chatting = False # allow dictation into the prompt box
-            response = pyautogui.prompt("More information, please.",
-            "Please clarify.", prompt)
+            chat_mode.clear() # allow dictation into the prompt box
+            injector.flush()  # the reply goes to this window, not the dialog
+            response = ui_executor.submit(pyautogui.prompt, "More information, please.",
+                                          "Please clarify.", prompt).result()
             # on user cancel, stop AI chat & resume dictation
             if not response: return None
             # otherwise, process the new query
-            chatting = True
-            return generate_text(response)
-        if not no_keys:
-            pyautogui.write(completion)
-        if not quiet_mode:
-            say(completion)
-        chatting = True
+            chat_mode.set()
+            return chat_turn(response)
+        if not streamed:
+            if not no_keys:
+                injector.write(completion)
+            if not quiet_mode:
+                say(completion)
+        chat_mode.set()
         # add to conversation
-        messages.append({"role": "assistant", "content": completion})
-        if len(messages) > conversation_length:
-            messages.remove(messages[1])
-            messages.remove(messages[1])
+        conversation.add("assistant", completion)
 
 def resume_dictation():
-    global chatting, listening
-    chatting = False
+    global listening
+    chat_mode.clear()
     listening = True
 
-def remove_repetitions(text, min_repetitions=6, keep_repetitions=5):
+def process_transcription(segment, txt: str, typed: str = "") -> str:
     """
-    Remove excessive repetitive patterns from text, keeping only a specified number of repetitions.
-    
-    Args:
-        text: The input text to process
-        min_repetitions: Minimum number of repetitions to consider as excessive (default: 6)
-        keep_repetitions: Number of repetitions to keep (default: 5)
-    
-    Returns:
-        Text with repetitions reduced to keep_repetitions occurrences
+    Filter, print and act on the transcription of one segment: run a
+    command or type the dictation. typed is partial text already
+    streamed for this segment. Returns what became of the segment:
+    typed, command, paused, ignored, empty, dropped or stop.
     """
-    if not text:
-        return text
-    
-    # Start with small pattern sizes and work up to larger ones
-    # This helps catch both single character and longer phrase repetitions
-    max_pattern_length = min(len(text) // min_repetitions, 100)  # Cap at 100 chars for performance
+    if not txt: 
+        erase_partial(typed)
+        logging.debug("No text returned from gettext, continuing...")
+        return "empty"
+    # filter space at beginning of lines
+    txt = re.sub(r"(^|\n)\s", r"\1", txt)
+    # print messages [BLANK_AUDIO], (swoosh), *barking*
+    if re.search(r"[\(\[\*]", txt):
+        if quiet_mode:
+            print(txt.strip(), file=sys.stderr)
+        else:
+            print(txt.strip())
+        # filter it out
+        txt = re.sub(r'[\*\[\(][^\]\)]*[\]\)\*]*\s*$', '', txt)
+    if txt == " ":
+        erase_partial(typed)
+        return "ignored" # ignoring empty
     
-    for pattern_length in range(1, max_pattern_length + 1):
-        # Use regex to find consecutive repetitions of patterns
-        # The pattern captures any sequence of 'pattern_length' characters
-        # and checks if it repeats min_repetitions or more times
-        pattern = r'(.{' + str(pattern_length) + r'})(?:\1){' + str(min_repetitions - 1) + r',}'
-        
-        # Replace with the pattern repeated keep_repetitions times
-        replacement = r'\1' * keep_repetitions
-        text = re.sub(pattern, replacement, text)
+    # Remove excessive repetitions
+    txt = remove_repetitions(txt, min_repetitions, keep_repetitions)
     
-    return text
+    # Check against ignore patterns
+    if should_ignore_transcription(txt):
+        logging.debug(f"[IGNORED] Transcription matching pattern: '{txt.strip()}'")
+        # Always show ignored messages with [IGNORED] prefix
+        if quiet_mode:
+            print(f"[IGNORED] {txt.strip()}", file=sys.stderr)
+        else:
+            print(f"[IGNORED] {txt.strip()}")
+        erase_partial(typed)
+        return "ignored"
+    # get lower-case spoken command string
+    lower_case = txt.lower().strip()
+    if not lower_case:
+        erase_partial(typed)
+        return "ignored"
+    shutup() # stop bot from talking
+    if match := re.search(r"[^\w\s]$", lower_case):
+        lower_case = lower_case[:match.start()] # remove punctuation
+    # strip txt unless we specifically say "new paragraph"
+    txt = txt.strip(' \n') + ' '
+    if quiet_mode:
+        # In quiet mode, debug info goes to stderr
+        print(txt, file=sys.stderr)
+    else:
+        print(txt) # print the text
+    segment.timeline.mark("postprocessed")
+    if typed and (is_command(lower_case) or not listening):
+        erase_partial(typed)
+        typed = ""
+
+    # see list of actions and hotkeys at top of file :)
+    # Go to website, stop or pause dictation.
+    if hit := control_registry.match(lower_case):
+        command, q = hit # get q for command
+        if run_command(command, q) == "stop":
+            return "stop"
+        return "command"
+    elif process_actions(lower_case): return "command"
+    if not listening: return "paused"
+    elif process_hotkeys(lower_case): return "command"
+    elif len(txt) > 1:
+        logging.debug(f"Writing text to active window: '{txt}' (length: {len(txt)})")
+        try:
+            if not no_keys:
+                with typing_lock:
+                    # fix up the unstable tail of streamed partial text
+                    backspaces, rest = reconcile(typed, txt)
+                    if backspaces:
+                        injector.backspace(backspaces)
+                    # typed on the injector thread; the segment is done when the keys are sent
+                    segment.injection = injector.write(rest)
+                segment.injection.add_done_callback(lambda f: segment.timeline.mark("injected"))
+                logging.debug(f"Queued {len(rest)} characters for {injector.backend.name}")
+            else:
+                segment.timeline.mark("injected")
+            if quiet_mode:
+                # In quiet mode, print ONLY the transcribed text to stdout
+                output_text = txt.strip()
+                if newline_mode:
+                    print(output_text)
+                else:
+                    print(output_text, end='', flush=True)
+            logging.debug("Text written successfully, continuing to next iteration")
+            return "typed"
+        except Exception as e:
+            logging.error(f"Failed to write text: {e}")
+    return "dropped"
+
+def finish_segment(segment, outcome: str):
+    """The consumer is done with a segment: free its pipeline slot and record metrics"""
+    transcriber.task_done()
+    metrics.inc("segments_total", outcome=outcome)
+    def record(injection=None):
+        metrics.record(segment.timeline, segment=segment.segment_id,
+                       audio_seconds=round(segment.duration, 3), outcome=outcome)
+    if segment.injection:
+        # the timeline ends when the text has been typed
+        segment.injection.add_done_callback(record)
+    else:
+        record()
+
+def handle_result(segment, txt: str) -> str:
+    """
+    Act on one transcription, in spoken order, for either core: finish
+    its streamed partials, run the command or type the text, and record
+    the outcome. Returns the outcome.
+    """
+    outcome = "dropped"  # what became of the segment, for metrics
+    try:
+        # partial text already typed while the segment was recorded
+        typed = streamer.finalize(segment.segment_id) if streamer else ""
+        outcome = process_transcription(segment, txt, typed)
+    except Exception as e:
+        logging.error(f"Error processing transcription: {e}")
+    finally:
+        finish_segment(segment, outcome)
+    return outcome
+
+max_consecutive_empty = 5
+consecutive_empty = 0
+
+def pause_after(outcome: str) -> float:
+    """Seconds to pause after outcome: a run of empty transcriptions suggests audio device trouble"""
+    global consecutive_empty
+    if outcome != "empty":
+        consecutive_empty = 0
+        return 0.0
+    consecutive_empty += 1
+    if consecutive_empty < max_consecutive_empty:
+        return 0.0
+    logging.error(f"Too many consecutive empty transcriptions ({consecutive_empty})")
+    logging.error("This might indicate audio device issues")
+    consecutive_empty = 0
+    return 2.0
+
+def next_segment(timeout: float):
+    """The next recorded segment from audio_queue, or None after timeout seconds"""
+    try:
+        return audio_queue.get(timeout=timeout)
+    except queue.Empty:
+        return None
 
 def transcribe():
     global listening
@@ -629,118 +1306,22 @@ def transcribe():
             if debug:
                 logging.debug(f"Transcribe loop iteration {iteration_count}, queue size: {audio_queue.qsize()}")
             
-            # Get audio from queue with timeout to prevent hanging
-            logging.debug(f"About to check audio queue, iteration {iteration_count}")
-            try:
-                f = audio_queue.get(timeout=5.0)  # 5 second timeout
-                logging.debug(f"Got file from queue: {f}")
-            except queue.Empty:
+            # Get the next transcription, in spoken order, with timeout to prevent hanging
+            logging.debug(f"About to check transcription pipeline, iteration {iteration_count}")
+            result = transcriber.get(timeout=5.0)  # 5 second timeout
+            if result is None:
                 if debug and iteration_count % 12 == 0:  # Log every minute
                     logging.debug("No audio in queue, continuing...")
+                    logging.debug(f"Transcription pipeline: {transcriber.stats()}")
                 logging.debug(f"Queue empty, continuing loop, iteration {iteration_count}")
                 continue
-                
-            if f:
-                logging.debug(f"Got audio file from queue: {f}")
-                txt = gettext(f)
-                # delete temporary audio file
-                try: 
-                    #os.remove(f)
-                    logging.debug(f"Deleted temp file: {f}")
-                except Exception as e: 
-                    logging.debug(f"Failed to delete temp file {f}: {e}")
-                if not txt: 
-                    logging.debug("No text returned from gettext, continuing...")
-                    consecutive_errors += 1
-                    if consecutive_errors >= max_consecutive_errors:
-                        logging.error(f"Too many consecutive empty transcriptions ({consecutive_errors})")
-                        logging.error("This might indicate audio device issues")
-                        time.sleep(2)
-                        consecutive_errors = 0
-                    continue
-                else:
-                    consecutive_errors = 0  # Reset on successful transcription
-                # filter space at beginning of lines
-                txt = re.sub(r"(^|\n)\s", r"\1", txt)
-                # print messages [BLANK_AUDIO], (swoosh), *barking*
-                if re.search(r"[\(\[\*]", txt):
-                    if quiet_mode:
-                        print(txt.strip(), file=sys.stderr)
-                    else:
-                        print(txt.strip())
-                    # filter it out
-                    txt = re.sub(r'[\*\[\(][^\]\)]*[\]\)\*]*\s*$', '', txt)
-                if txt == " ":
-                    continue # ignoring empty
-                
-                # Remove excessive repetitions
-                txt = remove_repetitions(txt, min_repetitions, keep_repetitions)
-                
-                # Check against ignore patterns
-                if should_ignore_transcription(txt):
-                    logging.debug(f"[IGNORED] Transcription matching pattern: '{txt.strip()}'")
-                    # Always show ignored messages with [IGNORED] prefix
-                    if quiet_mode:
-                        print(f"[IGNORED] {txt.strip()}", file=sys.stderr)
-                    else:
-                        print(f"[IGNORED] {txt.strip()}")
-                    continue
-                # get lower-case spoken command string
-                lower_case = txt.lower().strip()
-                if not lower_case: continue
-                shutup() # stop bot from talking
-                if match := re.search(r"[^\w\s]$", lower_case):
-                    lower_case = lower_case[:match.start()] # remove punctuation
-                # strip txt unless we specifically say "new paragraph"
-                txt = txt.strip(' \n') + ' '
-                if quiet_mode:
-                    # In quiet mode, debug info goes to stderr
-                    print(txt, file=sys.stderr)
-                else:
-                    print(txt) # print the text
-
-                # see list of actions and hotkeys at top of file :)
-                # Go to Website.
-                if s:=re.search(r"^(peter|computer).? (go|open|browse|visit|navigate)( up| to| the| website)* [a-zA-Z0-9-]{1,63}(\.[a-zA-Z0-9-]{1,63})+$", lower_case):
-                    q = lower_case[s.end():] # get q for command
-                    webbrowser.open('https://' + q.strip())
-                    continue
-                # Stop dictation.
-                elif re.search(r"^stop.? (d.ctation|listening).?$", lower_case):
-                    if not quiet_mode:
-                        say("Shutting down.")
-                    break
-                elif re.search(r"^paused? (d.ctation|positi.?i?cation).?$", lower_case):
-                    listening = False
-                    if not quiet_mode:
-                        say("okay")
-                elif process_actions(lower_case): continue
-                if not listening: continue
-                elif process_hotkeys(lower_case): continue
-                elif len(txt) > 1:
-                    logging.debug(f"Writing text to active window: '{txt}' (length: {len(txt)})")
-                    try:
-                        if not no_keys:
-                            logging.debug("About to call pyautogui.write()")
-                            pyautogui.write(txt)
-                            logging.debug("pyautogui.write() completed")
-                        if quiet_mode:
-                            # In quiet mode, print ONLY the transcribed text to stdout
-                            output_text = txt.strip()
-                            if newline_mode:
-                                print(output_text)
-                            else:
-                                print(output_text, end='', flush=True)
-                        logging.debug("Text written successfully, continuing to next iteration")
-                    except Exception as e:
-                        logging.error(f"Failed to write text: {e}")
-            # continue looping every 1/5 second
-            else: 
-                if debug and iteration_count % 50 == 0:  # Log every 10 seconds
-                    logging.debug(f"Waiting for audio, iteration {iteration_count}")
-                logging.debug(f"About to sleep 0.2s in transcribe loop, iteration {iteration_count}")
-                time.sleep(0.2)
-                logging.debug(f"Woke up from sleep, back to queue check, iteration {iteration_count}")
+            segment, txt = result
+            logging.debug(f"Got transcription of {segment}")
+            outcome = handle_result(segment, txt)
+            consecutive_errors = 0
+            if outcome == "stop":
+                break
+            time.sleep(pause_after(outcome))
         except KeyboardInterrupt:
             if not quiet_mode:
                 say("Goodbye.")
@@ -757,6 +1338,140 @@ def transcribe():
         if debug:
             logging.debug(f"Completed transcribe loop iteration {iteration_count}, going to next iteration")
 
+def feed_transcriber():
+    """Move recorded segments from audio_queue into the transcription workers"""
+    while running:
+        # admission control: the backlog stays in audio_queue, where QUEUE_POLICY applies
+        if not transcriber.wait_for_room(transcribe_workers + 1, timeout=1.0):
+            continue
+        if segment := next_segment(1.0):
+            submit_segment(segment)
+
+def enqueue_segment(segment):
+    """Put a recorded segment in audio_queue; with QUEUE_POLICY=block, wait for room"""
+    segment.timeline.mark("queued")
+    while running:
+        try:
+            audio_queue.put(segment, timeout=1.0)
+            return
+        except queue.Full:
+            logging.debug("audio_queue full, waiting for the transcriber")
+
+def coalescible(segment) -> bool:
+    """True if segment may share a request with others (local server only)"""
+    return coalesce and not (openai_whisper and client) and \
+        segment.duration <= coalesce_max_seconds
+
+def submit_segment(segment):
+    """
+    Hand a recorded segment to the transcription workers. With COALESCE,
+    short segments already waiting behind it go along in the same request.
+    """
+    batch = [segment]
+    later = None
+    if coalescible(segment):
+        while len(batch) < coalesce_max_segments:
+            try:
+                waiting = audio_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not waiting:
+                continue
+            if not coalescible(waiting):
+                later = waiting
+                break
+            batch.append(waiting)
+    if len(batch) > 1:
+        logging.debug(f"Coalescing {len(batch)} segments into one request")
+        metrics.inc("batches_total")
+        metrics.inc("segments_coalesced_total", len(batch))
+        transcriber.submit_batch(batch)
+    else:
+        # compress for upload while earlier segments are transcribed
+        encoder.prepare(segment, openai_upload_format if openai_whisper and client
+                        else cpp_upload_format)
+        transcriber.submit(segment)
+    if later:
+        submit_segment(later)
+
+def start_metrics():
+    """Export queue depth and backend statistics; serve them if METRICS_PORT is set"""
+    for name, text in (
+        ("stage_seconds", "Seconds spent in each stage from speech onset to injection"),
+        ("end_to_end_seconds", "Seconds from the end of speech to text injection"),
+        ("request_seconds", "Speech backend round-trip seconds, server already running"),
+        ("cold_request_seconds", "Seconds of requests that had to start their server first"),
+        ("server_start_seconds", "Seconds from starting a server to its readiness probe passing"),
+        ("server_warmup_seconds", "Seconds of the warm-up request after a server start"),
+        ("server_stops_total", "Servers stopped after being idle, or at exit"),
+        ("server_exits_total", "Servers started by the client that exited on their own"),
+        ("backend_errors_total", "Failed speech backend requests"),
+        ("fallbacks_total", "Requests that fell back from OpenAI to the local server"),
+        ("segments_total", "Finished segments by outcome"),
+        ("encode_seconds", "Seconds spent compressing a segment for upload"),
+        ("upload_bytes_total", "Bytes of audio uploaded to the speech backend"),
+        ("upload_bytes_saved_total", "Upload bytes saved by compression, compared to WAV"),
+        ("queue_age_seconds", "Seconds segments waited in audio_queue"),
+        ("segments_dropped_total", "Segments dropped from audio_queue, by reason"),
+        ("segments_merged_total", "Segments merged into one already waiting in audio_queue"),
+        ("segments_refused_total", "Segments not recorded because audio_queue was full"),
+        ("hedged_requests_total", "Segments also sent to the secondary backend"),
+        ("hedge_wins_total", "Answers used, by backend and whether the request was hedged"),
+        ("hedge_cancelled_total", "Losing hedged requests cancelled or discarded, by backend"),
+        ("chat_seconds", "Chat reply seconds, by provider"),
+        ("chat_requests_total", "Chat requests, by provider and outcome"),
+        ("chat_circuit_opened_total", "Times a failing chat provider was taken out of rotation"),
+        ("response_cache_hits_total", "Chat prompts answered from the response cache"),
+        ("response_cache_misses_total", "Chat prompts the response cache could not answer"),
+        ("response_cache_hit_rate", "Share of cacheable chat prompts answered from the response cache"),
+        ("response_cache_seconds_saved", "Seconds of chat generation saved by response cache hits"),
+        ("injected_chars_total", "Characters typed into the active window, by backend"),
+        ("inject_seconds", "Seconds spent typing one piece of text, by backend"),
+        ("inject_errors_total", "Text that could not be typed, by backend"),
+        ("context_trims_total", "Times old turns were dropped from the chat context"),
+        ("batches_total", "Requests that carried several coalesced segments"),
+        ("segments_coalesced_total", "Segments sent in a coalesced request"),
+    ):
+        metrics.describe(name, text)
+    metrics.gauge("audio_queue_depth", audio_queue.qsize)
+    metrics.gauge("inject_chars_per_second", injector.rate)
+    metrics.gauge("audio_queue_oldest_seconds", audio_queue.oldest_age)
+    metrics.gauge("transcriptions_in_flight", lambda: transcriber.in_flight())
+    metrics.gauge("worker_utilization", lambda: transcriber.stats()["worker_utilization"])
+    metrics.gauge("connections_opened", lambda: transport.connections_opened)
+    metrics.gauge("connections_reused", lambda: transport.reused_connections)
+    metrics.gauge("requests_retried", lambda: transport.retried)
+    if hedger:
+        metrics.gauge("hedge_delay_seconds", hedger.delay)
+    for provider in chat_providers.providers:
+        metrics.gauge(f"chat_{provider.name}_error_rate", provider.error_rate)
+        metrics.gauge(f"chat_{provider.name}_circuit_open", lambda p=provider: int(p.breaker.open))
+    if response_cache:
+        metrics.gauge("response_cache_hit_rate", response_cache.hit_rate)
+        metrics.gauge("response_cache_seconds_saved", lambda: response_cache.seconds_saved)
+    for server in (whisper_server, llama_server):
+        if server.managed:
+            metrics.gauge(f"{server.name.replace('-', '_')}_running", lambda s=server: int(s.ready))
+    if transcription_cache:
+        metrics.gauge("cache_hit_rate", transcription_cache.hit_rate)
+        metrics.gauge("cache_entries", lambda: len(transcription_cache.entries))
+    metrics.gauge("vad_rejected_bursts",
+        lambda: persistent_recorder.vad.rejected_bursts if persistent_recorder else None)
+    # share of OpenAI requests that had to be retried on the local server
+    metrics.gauge("fallback_rate", lambda: metrics.counter("fallbacks_total") /
+        max(metrics.counter("transcriptions_total", backend="openai")
+            + metrics.counter("fallbacks_total"), 1))
+    if trace_file:
+        try:
+            metrics.open_trace(trace_file)
+        except OSError as e:
+            logging.error(f"Could not open TRACE_FILE {trace_file}: {e}")
+    if metrics_port:
+        try:
+            metrics.serve(metrics_port)
+        except OSError as e:
+            logging.error(f"Could not serve metrics on port {metrics_port}: {e}")
+
 def record_mp3():
     global listening
     listening = False
@@ -775,6 +1490,7 @@ def record_to_queue():
     global record_process
     global running
     global persistent_recorder
+    global streamer
     
     # Check if we should use persistent recorder
     use_persistent = os.getenv("USE_PERSISTENT_RECORDER", "false").lower() in ["true", "1", "yes", "y"]
@@ -785,9 +1501,15 @@ def record_to_queue():
         stop_after = float(os.environ.get("STOP_AFTER", "2"))
         
         # Create persistent recorder
+        endpointer = make_endpointer(endpointing, stop_after, min_stop_after, is_complete_command)
         persistent_recorder = PersistentAudioRecorder(
             threshold=voice_threshold,
-            stop_after=stop_after
+            stop_after=stop_after,
+            preroll=float(os.getenv("PREROLL", "0.6")),  # seconds kept before onset
+            vad=os.getenv("VAD_ENGINE", "level"),  # level | numpy
+            endpointer=endpointer,
+            # with the block policy, stop taking speech while the queue is full
+            queue_size=queue_size if queue_policy == "block" else 0
         )
         
         if not persistent_recorder.start():
@@ -795,6 +1517,15 @@ def record_to_queue():
             use_persistent = False
         else:
             logging.debug("Persistent audio recorder started")
+            now_listening()
+            if streaming_mode:
+                streamer = StreamingTranscriber(persistent_recorder, gettext,
+                    type_partial, interval=stream_interval,
+                    on_partial=endpointer.set_partial if endpointer else None)
+                streamer.start()
+                logging.debug(f"Streaming partial transcription every {stream_interval}s")
+    elif streaming_mode:
+        logging.info("STREAMING requires USE_PERSISTENT_RECORDER=true; streaming disabled")
     
     if use_persistent:
         # Use persistent recorder
@@ -804,11 +1535,11 @@ def record_to_queue():
                 segment_count += 1
                 logging.debug(f"Waiting for audio segment #{segment_count}")
                 
-                segment_file = persistent_recorder.get_audio_segment(timeout=5.0)
+                segment = persistent_recorder.get_audio_segment(timeout=5.0)
                 
-                if segment_file:
-                    logging.debug(f"Got audio segment: {segment_file}")
-                    audio_queue.put(segment_file)
+                if segment:
+                    logging.debug(f"Got audio segment: {segment}")
+                    enqueue_segment(segment)
                 else:
                     if debug and segment_count % 12 == 0:
                         logging.debug("No audio segments received, continuing...")
@@ -826,6 +1557,11 @@ def record_to_queue():
         consecutive_errors = 0
         max_consecutive_errors = 5
         recording_timeout = float(os.getenv("RECORDING_TIMEOUT", "10"))
+        endpointer = make_endpointer(endpointing, float(os.environ.get("STOP_AFTER", "2")),
+                                     min_stop_after, is_complete_command)
+        if reuse_pipeline:
+            record_long_lived(endpointer)
+            return
         
         while running:
             recording_count += 1
@@ -838,12 +1574,14 @@ def record_to_queue():
                 logging.debug(f"Creating delayRecord instance with threshold: {voice_threshold}")
                 record_process = delayRecord(temp_file, threshold=voice_threshold)
                 record_process.stop_after = float(os.environ.get("STOP_AFTER", "2"))
+                record_process.endpointer = endpointer
                 logging.debug(f"delayRecord instance created successfully")
                 
                 logging.debug(f"Starting recording thread for recording #{recording_count}")
                 recording_thread = threading.Thread(target=record_process.start)
                 recording_thread.daemon = True
                 recording_thread.start()
+                now_listening()
                 logging.debug(f"Recording thread started, waiting for completion...")
                 
                 recording_thread.join(timeout=recording_timeout)
@@ -860,7 +1598,11 @@ def record_to_queue():
                     continue
                 
                 if os.path.exists(temp_file) and os.path.getsize(temp_file) > 0:
-                    audio_queue.put(record_process.file_name)
+                    # load into memory so /tmp does not fill up with clips
+                    segment = AudioSegment.from_wav(record_process.file_name,
+                        segment_id=recording_count, remove=True,
+                        timeline=record_process.timeline)
+                    enqueue_segment(segment)
                     consecutive_errors = 0
                 else:
                     logging.error(f"Recording #{recording_count} produced empty file")
@@ -875,6 +1617,55 @@ def record_to_queue():
                 time.sleep(5)
                 consecutive_errors = 0
 
+def record_long_lived(endpointer):
+    """Fallback recorder with one delayRecord pipeline kept open for all utterances"""
+    global record_process
+    recorder_thread = None
+    while running:
+        if not recorder_thread or not recorder_thread.is_alive():
+            if recorder_thread:
+                logging.error("Recording pipeline stopped, reopening the audio device")
+                time.sleep(1)
+            record_process = delayRecord(threshold=float(os.getenv("VOICE_THRESHOLD", "-30")),
+                                         long_lived=True)
+            record_process.stop_after = float(os.environ.get("STOP_AFTER", "2"))
+            record_process.endpointer = endpointer
+            recorder_thread = threading.Thread(target=record_process.start, daemon=True)
+            recorder_thread.start()
+            now_listening()
+            logging.debug(f"Long-lived recorder started in {record_process.setup_seconds:.3f}s")
+        segment = record_process.get_audio_segment(timeout=1.0)
+        if segment:
+            logging.debug(f"Got audio segment: {segment}")
+            enqueue_segment(segment)
+    if record_process:
+        record_process.stop_recording()
+
+listening_since = None
+
+def now_listening():
+    """The first recorder is ready: report the time since start-up, once"""
+    global listening_since
+    if listening_since is not None:
+        return
+    listening_since = time.monotonic()
+    elapsed = listening_since - startup_time
+    metrics.gauge("startup_seconds", lambda: elapsed)
+    logging.info(f"Listening {elapsed:.2f}s after start")
+    if startup_report:
+        print(f"[LISTENING] {elapsed:.3f}s after start; imported on demand: "
+              f"{', '.join(f'{name} {t:.3f}s' for name, t in lazy.loaded.items()) or 'nothing'}",
+              file=sys.stderr, flush=True)
+    if announce_ready:
+        speech_executor.submit(say, "All systems ready.")  # TTS loads after listening starts
+
+def start_servers():
+    """Start and warm up managed servers while the recorder starts, unless OpenAI transcribes"""
+    if whisper_server.managed and not (openai_whisper and client and not hedger):
+        whisper_server.start_in_background()
+    if llama_server.managed and not chat_provider_list[:-1]:
+        llama_server.start_in_background()  # the only chat provider
+
 def discard_input():
     if quiet_mode:
         print("\nShutdown complete. Press ENTER to return to terminal.", file=sys.stderr)
@@ -885,14 +1676,16 @@ def discard_input():
     while input():
         time.sleep(0.1)
 
-def quit():
-    logging.debug("\nStopping...")
+def stop_recording():
+    """Stop streaming and the recorders; record_to_queue returns soon after"""
     global running
     global listening
-    global persistent_recorder
     listening = False
     running = False
     
+    if streamer:
+        streamer.stop()
+
     # Stop persistent recorder
     if persistent_recorder:
         persistent_recorder.stop()
@@ -900,28 +1693,138 @@ def quit():
     # Stop old-style recorder if used
     if record_process:
         record_process.stop_recording()
-        
-    record_thread.join()
+
+def release_resources():
+    """Shut down the worker pools and connections, after the recorder has stopped"""
+    transcriber.shutdown()
+    logging.info(f"Transcription pipeline: {transcriber.stats()}")
     
     # clean up
     try:
-        while f := audio_queue.get_nowait():
-            logging.debug(f"Removing temporary file: {f}")
-            if f[:5] == "/tmp/": # safety check
-                os.remove(f)
+        while segment := audio_queue.get_nowait():
+            logging.debug(f"Discarding unprocessed segment: {segment}")
     except Exception: pass
+    transport.close()
+    encoder.shutdown()
+    speech_executor.shutdown(wait=False, cancel_futures=True)
+    ui_executor.shutdown(wait=False, cancel_futures=True)
+    logging.info(f"Typed {injector.chars} characters at {injector.rate():.0f}/s")
+    injector.close()
+    logging.info(f"Chat providers: {chat_providers.stats()}")
+    chat_providers.close()
+    if hedger:
+        logging.info(f"Hedged requests: {hedger.stats()}")
+        hedger.shutdown()
+    if transcription_cache:
+        transcription_cache.close()
+    if response_cache:
+        logging.info(f"Response cache: {response_cache.hit_rate():.0%} hits, "
+                     f"{response_cache.seconds_saved:.1f}s of generation saved")
+        response_cache.close()
+    # only stops servers this process started
+    whisper_server.close()
+    llama_server.close()
+    metrics.close()
     logging.debug("\nFreeing system resources.\n")
-#    os.system("systemctl --user stop whisper")
+
+def quit():
+    logging.debug("\nStopping...")
+    stop_recording()
+    record_thread.join()
+    release_resources()
     discard_input()
     if not quiet_mode:
         shutup()
 
+# asyncio core: the recorder and other blocking work run on thread pools,
+# everything else is a task on one event loop
+io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="io")
+# pyautogui and command handlers, one at a time so keystrokes stay in order
+key_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keys")
+
+async def capture_async():
+    """Move recorded segments from the recorder thread into the transcription pool"""
+    loop = asyncio.get_running_loop()
+    while True:
+        # admission control: the backlog stays in audio_queue, where QUEUE_POLICY applies
+        await transcriber.wait_for_room(transcribe_workers + 1)
+        # submitted from the loop, which AsyncTranscriptionPipeline requires
+        if segment := await loop.run_in_executor(io_executor, next_segment, 0.5):
+            submit_segment(segment)
+
+async def dispatch_async():
+    """Act on transcriptions in spoken order; returns when dictation is stopped"""
+    loop = asyncio.get_running_loop()
+    while True:
+        segment, txt = await transcriber.get()
+        logging.debug(f"Got transcription of {segment}")
+        outcome = await loop.run_in_executor(key_executor, handle_result, segment, txt)
+        if outcome == "stop":
+            return
+        await asyncio.sleep(pause_after(outcome))
+
+async def main_async():
+    """Run recording, transcription and dispatch as tasks until one of them ends"""
+    global event_loop, transcriber
+    event_loop = asyncio.get_running_loop()
+    transcriber = AsyncTranscriptionPipeline(cached_gettext, workers=transcribe_workers,
+                                             transcribe_batch=cached_gettext_batch)
+    start_metrics()
+    start_servers()
+    interrupted = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        event_loop.add_signal_handler(sig, interrupted.set)
+
+    # the recorder is a blocking GStreamer loop, so it gets a thread of its own
+    recorder = event_loop.run_in_executor(io_executor, record_to_queue)
+    names = {
+        recorder: "recorder",
+        asyncio.create_task(capture_async()): "capture",
+        asyncio.create_task(dispatch_async()): "dispatch",
+        asyncio.create_task(interrupted.wait()): "signal",
+    }
+    if debug:
+        logging.debug("Recording, capture and dispatch tasks started")
+    # "stop listening", a signal, or a crash in any task ends the session
+    done, pending = await asyncio.wait(names, return_when=asyncio.FIRST_COMPLETED)
+    for task in done:
+        if not task.cancelled() and task.exception():
+            logging.error(f"{names[task]} failed: {task.exception()}")
+    if interrupted.is_set() and not quiet_mode:
+        say("Goodbye.")
+
+    # structured shutdown: cancel the tasks, stop the recorder, then release resources
+    logging.debug("\nStopping...")
+    pending.discard(recorder)
+    for task in pending | background_tasks:
+        task.cancel()
+    await asyncio.gather(*pending, *background_tasks, return_exceptions=True)
+    stop_recording()
+    try:
+        await asyncio.wait_for(recorder, timeout=10)
+    except asyncio.TimeoutError:
+        logging.error("Recorder did not stop within 10 seconds")
+    release_resources()
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    key_executor.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == '__main__':
     if debug:
         logging.debug("Starting whisper_cpp_client in debug mode")
         logging.debug(f"Audio queue initialized: {audio_queue}")
+    if async_core:
+        asyncio.run(main_async())
+        discard_input()
+        if not quiet_mode:
+            shutup()
+        sys.exit()
+    transcriber = TranscriptionPipeline(cached_gettext, workers=transcribe_workers,
+                                        transcribe_batch=cached_gettext_batch)
+    start_metrics()
+    feed_thread = threading.Thread(target=feed_transcriber, daemon=True)
+    feed_thread.start()
     record_thread = threading.Thread(target=record_to_queue)
-#    os.system("systemctl --user start whisper")
+    start_servers()
     record_thread.start()
     if debug:
         logging.debug("Recording thread started")